@@ -0,0 +1,189 @@
+"""Helpers shared by the benchmarks.
+
+Benchmarks write their results as JSON, so that runs can be kept and
+compared with each other later on.
+"""
+import gc
+import os
+import ctypes
+import ctypes.util
+import sys
+import json
+import time
+import platform
+import subprocess
+from datetime import datetime
+
+from lxml import etree
+
+try:
+    import resource
+except ImportError:
+    # not on Windows
+    resource = None
+
+def best(func, repeat):
+    """Return the shortest time in seconds func takes in repeat runs.
+    """
+    result = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        duration = time.time() - start
+        if result is None or duration < result:
+            result = duration
+    return result
+
+def maxRSS():
+    """Return the peak resident memory of the process in kilobytes.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # reported in bytes there
+        rss = rss / 1024
+    return rss
+
+def peakMemory(script, spec):
+    """Return by how many kilobytes a benchmark makes the peak memory grow.
+
+    The benchmark is measured in a new interpreter, which runs script
+    with the option --memory and spec as JSON. The script then sets up
+    the benchmark and passes its function to measureMemory. Memory that
+    an earlier benchmark, or the setup, allocated and freed again can
+    still be reused without growing the process, so small numbers are
+    rough. Returns None if memory can not be measured.
+    """
+    if resource is None:
+        return None
+    if script.endswith('.pyc'):
+        script = script[:-1]
+    process = subprocess.Popen(
+        [sys.executable, script, '--memory', json.dumps(spec)],
+        stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode:
+        return None
+    return int(output.strip().splitlines()[-1])
+
+def measureMemory(func):
+    """Print by how many kilobytes func makes the peak memory grow.
+
+    This is what a script does when peakMemory runs it. Where the
+    peak can be reset, it is reset before func runs, so that only
+    what func allocates is counted.
+    """
+    gc.collect()
+    releaseFreeMemory()
+    if resetPeak():
+        before = statusKB('VmRSS')
+        func()
+        print statusKB('VmHWM') - before
+    else:
+        before = maxRSS()
+        func()
+        print maxRSS() - before
+
+def releaseFreeMemory():
+    """Give memory that is free back to the system, where possible.
+
+    Otherwise func could reuse what the setup freed without growing
+    the process.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        libc.malloc_trim(0)
+    except (OSError, AttributeError):
+        # not glibc
+        pass
+
+def resetPeak():
+    """Reset the peak resident memory of the process to what it is now.
+
+    Returns False where this is not possible, as on systems other than
+    Linux.
+    """
+    try:
+        f = open('/proc/self/clear_refs', 'w')
+        try:
+            f.write('5')
+        finally:
+            f.close()
+    except IOError:
+        return False
+    return True
+
+def statusKB(field):
+    """Return a memory field of /proc/self/status, in kilobytes.
+    """
+    f = open('/proc/self/status')
+    try:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    finally:
+        f.close()
+    raise KeyError(field)
+
+class NullRegistry(object):
+    """Metadata registry that does not read metadata, so only
+    building the records themselves is measured.
+    """
+    def readMetadata(self, metadata_prefix, element):
+        return None
+
+def environment():
+    """Describe where the benchmarks ran.
+    """
+    return {
+        'date': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'lxml': '.'.join([str(part) for part in etree.LXML_VERSION]),
+        'platform': platform.platform(),
+        }
+
+def writeResults(path, name, options, results):
+    """Write results to a JSON file.
+
+    name - name of the benchmark suite
+    options - dictionary of the options the suite ran with
+    results - list of dictionaries, one per measurement
+    """
+    data = {'suite': name, 'options': options, 'results': results}
+    data.update(environment())
+    f = open(path, 'wb')
+    try:
+        json.dump(data, f, indent=1, sort_keys=True)
+    finally:
+        f.close()
+
+def readResults(path):
+    f = open(path, 'rb')
+    try:
+        return json.load(f)['results']
+    finally:
+        f.close()
+
+def compareResults(old, new, keys, value):
+    """Compare the results of two runs.
+
+    Results are matched on the values of keys. Returns a list of
+    (result, ratio) for the new results, where ratio is the new value
+    divided by the old one, or None if there is no old result to
+    compare with.
+    """
+    def key(result):
+        return tuple([result.get(name) for name in keys])
+    old_values = {}
+    for result in old:
+        old_values[key(result)] = result.get(value)
+    comparison = []
+    for result in new:
+        old_value = old_values.get(key(result))
+        if old_value:
+            comparison.append((result, result[value] / float(old_value)))
+        else:
+            comparison.append((result, None))
+    return comparison
+
+def parseSizes(text):
+    return [int(size) for size in text.split(',')]
@@ -0,0 +1,55 @@
+"""Micro-benchmark of building records from a parsed ListRecords page.
+
+Builds a synthetic page and reports how many records per second
+BaseClient.buildRecords and BaseClient.buildIdentifiers process.
+
+usage: python build_records.py [record_count] [repeat]
+"""
+import sys
+
+from oaipmh import client, metadata
+
+from benchutil import NullRegistry, best
+
+RECORD = (
+    '<record><header><identifier>oai:bench:%(i)s</identifier>'
+    '<datestamp>2004-01-01T00:00:00Z</datestamp>'
+    '<setSpec>a</setSpec><setSpec>a:b</setSpec></header>'
+    '<metadata><oai_dc:dc '
+    'xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+    '<dc:title>Title %(i)s</dc:title><dc:creator>Creator</dc:creator>'
+    '<dc:date>2004-01-01</dc:date></oai_dc:dc></metadata></record>')
+
+HEADER = (
+    '<header><identifier>oai:bench:%(i)s</identifier>'
+    '<datestamp>2004-01-01T00:00:00Z</datestamp>'
+    '<setSpec>a</setSpec></header>')
+
+def createPage(verb, item, record_count):
+    return (
+        '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+        '<responseDate>2004-01-01T00:00:00Z</responseDate>'
+        '<request verb="%s">http://bench/oai</request><%s>%s</%s>'
+        '</OAI-PMH>' % (verb, verb,
+                        ''.join([item % {'i': i}
+                                 for i in range(record_count)]),
+                        verb))
+
+def main(record_count=10000, repeat=5):
+    oaiclient = client.BaseClient(metadata.MetadataRegistry())
+    namespaces = oaiclient.getNamespaces()
+    records_tree = oaiclient.parse(
+        createPage('ListRecords', RECORD, record_count))
+    headers_tree = oaiclient.parse(
+        createPage('ListIdentifiers', HEADER, record_count))
+    registry = NullRegistry()
+    duration = best(lambda: oaiclient.buildRecords(
+        'oai_dc', namespaces, registry, records_tree), repeat)
+    print 'buildRecords:     %8.0f records/s' % (record_count / duration)
+    duration = best(lambda: oaiclient.buildIdentifiers(
+        namespaces, headers_tree), repeat)
+    print 'buildIdentifiers: %8.0f headers/s' % (record_count / duration)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,177 @@
+"""Benchmark suite of the client side of harvesting.
+
+Measures records per second and peak memory for pages of several sizes
+generated by oaipmh.tests.synthetic, served from memory so that no
+network or server is involved:
+
+harvest_records - ListRecords with oai_dc, everything included
+harvest_identifiers - ListIdentifiers, everything included
+buildRecords - BaseClient.buildRecords on a parsed page, without
+               reading the metadata
+buildIdentifiers - BaseClient.buildIdentifiers on a parsed page
+buildHeader - client.buildHeader for each header of a page
+oai_dc_reader - metadata.oai_dc_reader for each record of a page
+datestamp_to_datetime - for the datestamp of each header of a page
+
+The harvests list at least --harvest records, in pages of the page
+size. Peak memory is how much a single run makes the peak memory of
+a new process grow, in kilobytes, after the benchmark was set up.
+
+Results are written as JSON with --output; with --compare the rates
+are also shown relative to an earlier run.
+
+usage: python client_throughput.py [options]
+"""
+import sys
+import json
+from optparse import OptionParser, SUPPRESS_HELP
+
+from oaipmh import client, metadata, replay
+from oaipmh.datestamp import datestamp_to_datetime
+from oaipmh.tests import synthetic
+
+import benchutil
+
+DEFAULT_SIZES = '10,100,1000,10000'
+
+class MemoryClient(client.BaseClient):
+    """A client that answers requests from responses kept in memory.
+    """
+    def __init__(self, responses, metadata_registry=None):
+        client.BaseClient.__init__(self, metadata_registry)
+        self._responses = responses
+
+    def makeRequest(self, **kw):
+        return self._responses[replay.requestKey(kw)]
+
+def createRegistry():
+    registry = metadata.MetadataRegistry()
+    registry.registerReader('oai_dc', metadata.oai_dc_reader)
+    return registry
+
+def pageBenchmarks(page_size, harvest_count):
+    """Get the benchmarks for a page size as (name, items, func).
+    """
+    harvested = max(page_size, harvest_count)
+    repository = synthetic.SyntheticRepository(harvested)
+    responses = {}
+    first_pages = {}
+    for kw, response in synthetic.responses(repository, page_size):
+        responses[replay.requestKey(kw)] = response
+        if 'resumptionToken' not in kw:
+            first_pages[kw['verb']] = response
+    oaiclient = MemoryClient(responses, createRegistry())
+    namespaces = oaiclient.getNamespaces()
+    records_tree = oaiclient.parse(first_pages['ListRecords'])
+    headers_tree = oaiclient.parse(first_pages['ListIdentifiers'])
+    xpaths = oaiclient.getXPaths()
+    header_nodes = xpaths.headers(headers_tree)
+    metadata_nodes = [xpaths.record_metadata(node)[0]
+                      for node in xpaths.records(records_tree)]
+    datestamps = [str(xpaths.datestamp(node)) for node in header_nodes]
+    null_registry = benchutil.NullRegistry()
+
+    def harvestRecords():
+        for record in oaiclient.listRecords(metadataPrefix='oai_dc'):
+            pass
+    def harvestIdentifiers():
+        for header in oaiclient.listIdentifiers(metadataPrefix='oai_dc'):
+            pass
+    def buildRecords():
+        oaiclient.buildRecords('oai_dc', namespaces, null_registry,
+                               records_tree)
+    def buildIdentifiers():
+        oaiclient.buildIdentifiers(namespaces, headers_tree)
+    def buildHeader():
+        for node in header_nodes:
+            client.buildHeader(node, namespaces)
+    def oai_dc_reader():
+        for node in metadata_nodes:
+            metadata.oai_dc_reader(node)
+    def convertDatestamps():
+        for datestamp in datestamps:
+            datestamp_to_datetime(datestamp)
+
+    return [
+        ('harvest_records', harvested, harvestRecords),
+        ('harvest_identifiers', harvested, harvestIdentifiers),
+        ('buildRecords', len(metadata_nodes), buildRecords),
+        ('buildIdentifiers', len(header_nodes), buildIdentifiers),
+        ('buildHeader', len(header_nodes), buildHeader),
+        ('oai_dc_reader', len(metadata_nodes), oai_dc_reader),
+        ('datestamp_to_datetime', len(datestamps), convertDatestamps),
+        ]
+
+def run(sizes, harvest_count, repeat):
+    results = []
+    for page_size in sizes:
+        for name, items, func in pageBenchmarks(page_size, harvest_count):
+            seconds = benchutil.best(func, repeat)
+            results.append({
+                'name': name,
+                'page_size': page_size,
+                'items': items,
+                'seconds': seconds,
+                'items_per_second': items / seconds,
+                'peak_memory_kb': benchutil.peakMemory(
+                    __file__, {'name': name, 'page_size': page_size,
+                               'harvest': harvest_count}),
+                })
+    return results
+
+def report(comparison):
+    print '%-22s %9s %12s %10s %8s' % (
+        'benchmark', 'page size', 'items/s', 'memory kB', 'ratio')
+    for result, ratio in comparison:
+        if ratio is None:
+            ratio = '-'
+        else:
+            ratio = '%.2f' % ratio
+        memory = result['peak_memory_kb']
+        if memory is None:
+            memory = '-'
+        print '%-22s %9s %12.0f %10s %8s' % (
+            result['name'], result['page_size'],
+            result['items_per_second'], memory, ratio)
+
+def measureMemory(spec):
+    for name, items, func in pageBenchmarks(spec['page_size'],
+                                            spec['harvest']):
+        if name == spec['name']:
+            benchutil.measureMemory(func)
+
+def main(args):
+    parser = OptionParser(usage=__doc__.split('usage: ')[-1].strip())
+    parser.add_option('-s', '--sizes', default=DEFAULT_SIZES,
+                      help='page sizes, separated by commas [%default]')
+    parser.add_option('-n', '--harvest', type='int', default=10000,
+                      help='records to harvest at least [%default]')
+    parser.add_option('-r', '--repeat', type='int', default=5,
+                      help='runs to take the best time of [%default]')
+    parser.add_option('-o', '--output',
+                      help='file to write the results to as JSON')
+    parser.add_option('-c', '--compare',
+                      help='JSON results of an earlier run to compare with')
+    # used by benchutil.peakMemory
+    parser.add_option('--memory', help=SUPPRESS_HELP)
+    options, args = parser.parse_args(args)
+    if options.memory:
+        measureMemory(json.loads(options.memory))
+        return 0
+    sizes = benchutil.parseSizes(options.sizes)
+    results = run(sizes, options.harvest, options.repeat)
+    old = []
+    if options.compare:
+        old = benchutil.readResults(options.compare)
+    report(benchutil.compareResults(
+        old, results, ['name', 'page_size'], 'items_per_second'))
+    if options.output:
+        benchutil.writeResults(
+            options.output, 'client_throughput',
+            {'sizes': sizes, 'harvest': options.harvest,
+             'repeat': options.repeat},
+            results)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
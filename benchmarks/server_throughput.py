@@ -0,0 +1,237 @@
+"""Benchmark suite of the server side of OAI-PMH.
+
+Drives Server.handleRequest and BatchingServer.handleRequest for every
+verb, serving repositories generated by oaipmh.tests.synthetic, for
+each combination of record count and batch size. For each it reports:
+
+requests/s - requests handled per second
+bytes/s - bytes of responses produced per second
+s/record - seconds per record or header listed
+memory kB - how much memory handling the requests allocates at its
+            peak, measured in a new process once the server is set up
+backend, tree, serialize - the share of the time spent in the calls
+    to the repository, in building the response trees in
+    XMLTreeServer, and in the rest of handleRequest, which is almost
+    all etree.tostring
+
+The list verbs follow resumption tokens for at most --requests pages.
+GetRecord asks for --requests records spread over the repository.
+A Server asks its IOAI repository for the whole list again for every
+page, so it gets slower with the number of records, unlike a
+BatchingServer.
+
+Results are written as JSON with --output; with --compare the rates
+are also shown relative to an earlier run.
+
+usage: python server_throughput.py [options]
+"""
+import sys
+import json
+import time
+from optparse import OptionParser, SUPPRESS_HELP
+
+from oaipmh.tests import synthetic
+
+import benchutil
+
+DEFAULT_RECORDS = '1000,10000'
+DEFAULT_BATCHES = '10,100,1000'
+
+VERBS = ['Identify', 'ListMetadataFormats', 'ListSets', 'GetRecord',
+         'ListIdentifiers', 'ListRecords']
+
+class Timed(object):
+    """Proxy that adds up the time spent in the methods of an object.
+    """
+    def __init__(self, context):
+        self._context = context
+        self.seconds = 0.0
+
+    def __getattr__(self, name):
+        attribute = getattr(self._context, name)
+        if not callable(attribute):
+            return attribute
+        def timed(*args, **kw):
+            start = time.time()
+            try:
+                return attribute(*args, **kw)
+            finally:
+                self.seconds += time.time() - start
+        return timed
+
+class Scenario(object):
+    """The requests of a verb to one server, and how to time them.
+    """
+    def __init__(self, repository, record_count, batching, batch_size,
+                 verb, count):
+        self._backend = Timed(repository)
+        self._server = synthetic.createServer(self._backend, batch_size,
+                                              batching)
+        # the server keeps its tree server privately
+        self._tree_server = Timed(self._server._tree_server)
+        self._server._tree_server = self._tree_server
+        self.requests = self._requestsFor(verb, record_count, count)
+        # to set up the same scenario in another process
+        self.spec = {'record_count': record_count, 'batching': batching,
+                     'batch_size': batch_size, 'verb': verb, 'count': count}
+
+    def _requestsFor(self, verb, record_count, count):
+        if verb in ['Identify', 'ListMetadataFormats']:
+            return [{'verb': verb}] * count
+        if verb == 'GetRecord':
+            step = max(1, record_count / count)
+            return [{'verb': verb, 'metadataPrefix': 'oai_dc',
+                     'identifier': 'oai:synthetic:%s' % i}
+                    for i in range(0, record_count, step)[:count]]
+        kw = {'verb': verb}
+        if verb != 'ListSets':
+            kw['metadataPrefix'] = 'oai_dc'
+        # follow the resumption tokens once, to know what to ask for
+        requests = []
+        while kw is not None and len(requests) < count:
+            requests.append(kw)
+            token = synthetic.resumptionToken(
+                self._server.handleRequest(kw.copy()))
+            if token is None:
+                kw = None
+            else:
+                kw = {'verb': verb, 'resumptionToken': token}
+        return requests
+
+    def run(self):
+        """Handle the requests once.
+
+        Returns the numbers of bytes and records in the responses,
+        and the seconds spent in total, in the backend and in building
+        trees, including the backend.
+        """
+        self._backend.seconds = 0.0
+        self._tree_server.seconds = 0.0
+        size = records = 0
+        start = time.time()
+        for kw in self.requests:
+            response = self._server.handleRequest(kw.copy())
+            size += len(response)
+            records += response.count('<header') + response.count('<set>')
+        return (size, records, time.time() - start,
+                self._backend.seconds, self._tree_server.seconds)
+
+    def handleAll(self):
+        for kw in self.requests:
+            self._server.handleRequest(kw.copy())
+
+def measure(scenario, repeat):
+    best = None
+    for i in range(repeat):
+        result = scenario.run()
+        if best is None or result[2] < best[2]:
+            best = result
+    size, records, seconds, backend, tree = best
+    result = {
+        'requests': len(scenario.requests),
+        'bytes': size,
+        'records': records,
+        'seconds': seconds,
+        'requests_per_second': len(scenario.requests) / seconds,
+        'bytes_per_second': size / seconds,
+        'seconds_per_record': None,
+        'backend': backend / seconds,
+        'tree': (tree - backend) / seconds,
+        'serialize': (seconds - tree) / seconds,
+        'peak_memory_kb': benchutil.peakMemory(__file__, scenario.spec),
+        }
+    if records:
+        result['seconds_per_record'] = seconds / records
+    return result
+
+def run(record_counts, batch_sizes, requests, repeat):
+    results = []
+    for record_count in record_counts:
+        repository = synthetic.SyntheticRepository(record_count)
+        for batching in [False, True]:
+            for batch_size in batch_sizes:
+                for verb in VERBS:
+                    scenario = Scenario(repository, record_count, batching,
+                                        batch_size, verb, requests)
+                    result = measure(scenario, repeat)
+                    result.update({
+                        'server': batching and 'BatchingServer' or 'Server',
+                        'verb': verb,
+                        'record_count': record_count,
+                        'batch_size': batch_size,
+                        })
+                    results.append(result)
+    return results
+
+def report(comparison):
+    print ('%-14s %-19s %7s %5s %10s %12s %10s %9s %7s %5s %9s %6s' % (
+        'server', 'verb', 'records', 'batch', 'requests/s', 'bytes/s',
+        's/record', 'memory kB', 'backend', 'tree', 'serialize', 'ratio'))
+    for result, ratio in comparison:
+        if ratio is None:
+            ratio = '-'
+        else:
+            ratio = '%.2f' % ratio
+        per_record = result['seconds_per_record']
+        if per_record is None:
+            per_record = '-'
+        else:
+            per_record = '%.2e' % per_record
+        memory = result['peak_memory_kb']
+        if memory is None:
+            memory = '-'
+        print ('%-14s %-19s %7s %5s %10.0f %12.0f %10s %9s %6.0f%% %4.0f%% '
+               '%8.0f%% %6s' % (
+            result['server'], result['verb'], result['record_count'],
+            result['batch_size'], result['requests_per_second'],
+            result['bytes_per_second'], per_record, memory,
+            result['backend'] * 100, result['tree'] * 100,
+            result['serialize'] * 100, ratio))
+
+def measureMemory(spec):
+    repository = synthetic.SyntheticRepository(spec['record_count'])
+    scenario = Scenario(repository, spec['record_count'], spec['batching'],
+                        spec['batch_size'], spec['verb'], spec['count'])
+    benchutil.measureMemory(scenario.handleAll)
+
+def main(args):
+    parser = OptionParser(usage=__doc__.split('usage: ')[-1].strip())
+    parser.add_option('-n', '--records', default=DEFAULT_RECORDS,
+                      help='record counts of the repositories, '
+                      'separated by commas [%default]')
+    parser.add_option('-b', '--batches', default=DEFAULT_BATCHES,
+                      help='batch sizes, separated by commas [%default]')
+    parser.add_option('-q', '--requests', type='int', default=10,
+                      help='most requests per verb [%default]')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='runs to take the best time of [%default]')
+    parser.add_option('-o', '--output',
+                      help='file to write the results to as JSON')
+    parser.add_option('-c', '--compare',
+                      help='JSON results of an earlier run to compare with')
+    # used by benchutil.peakMemory
+    parser.add_option('--memory', help=SUPPRESS_HELP)
+    options, args = parser.parse_args(args)
+    if options.memory:
+        measureMemory(json.loads(options.memory))
+        return 0
+    record_counts = benchutil.parseSizes(options.records)
+    batch_sizes = benchutil.parseSizes(options.batches)
+    results = run(record_counts, batch_sizes, options.requests,
+                  options.repeat)
+    old = []
+    if options.compare:
+        old = benchutil.readResults(options.compare)
+    report(benchutil.compareResults(
+        old, results, ['server', 'verb', 'record_count', 'batch_size'],
+        'requests_per_second'))
+    if options.output:
+        benchutil.writeResults(
+            options.output, 'server_throughput',
+            {'records': record_counts, 'batches': batch_sizes,
+             'requests': options.requests, 'repeat': options.repeat},
+            results)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
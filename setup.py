@@ -28,4 +28,5 @@ http://www.openarchives.org/OAI/openarchivesprotocol.html
     license='BSD',
     keywords='OAI-PMH xml archive',
     install_requires=['lxml'],
+    extras_require={'numpy': ['numpy']},
 )
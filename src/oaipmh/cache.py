@@ -0,0 +1,228 @@
+"""Caches for the responses of requests that rarely change.
+
+Every harvest of a repository asks for Identify, ListMetadataFormats
+and ListSets again, though the answers hardly ever change. A client
+that uses a response cache (see BaseClient.useResponseCache) keeps
+these responses and reads them back instead of asking the server.
+
+A response cache has two methods:
+
+get(key, verb) - return the response cached under key, or None
+set(key, verb, xml) - cache a response under key
+
+where key is a tuple of strings identifying the request. MemoryCache
+keeps responses in memory, DiskCache keeps them as files in a
+directory, so that they can be shared between processes and runs.
+Both keep a response for a time that depends on its verb, and drop the
+least recently used responses when they grow beyond their size.
+"""
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from hashlib import sha1
+
+# seconds a response is kept for, per verb
+DEFAULT_TTLS = {
+    'Identify': 24 * 60 * 60,
+    'ListMetadataFormats': 24 * 60 * 60,
+    'ListSets': 60 * 60,
+    }
+
+# bytes of responses kept by default
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+
+# names of the files a DiskCache keeps responses in
+CACHE_FILE_NAME = re.compile(r'^[0-9a-f]{40}\.xml$')
+
+class MemoryCache(object):
+    """Keeps responses in memory.
+
+    ttls - seconds to keep a response for, per verb; responses to
+           verbs that are not in there are not cached
+    max_size - bytes of responses to keep at most
+    """
+    def __init__(self, ttls=None, max_size=DEFAULT_MAX_SIZE):
+        if ttls is None:
+            ttls = DEFAULT_TTLS
+        self._ttls = ttls
+        self._max_size = max_size
+        self._size = 0
+        # key -> (expires, xml), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, verb):
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, xml = entry
+            if expires <= time.time():
+                self._size -= len(xml)
+                return None
+            self._entries[key] = entry
+            return xml
+        finally:
+            self._lock.release()
+
+    def set(self, key, verb, xml):
+        ttl = self._ttls.get(verb)
+        if ttl is None or len(xml) > self._max_size:
+            return
+        self._lock.acquire()
+        try:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1])
+            self._entries[key] = (time.time() + ttl, xml)
+            self._size += len(xml)
+            while self._size > self._max_size:
+                expires, dropped = self._entries.popitem(last=False)[1]
+                self._size -= len(dropped)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._size = 0
+        finally:
+            self._lock.release()
+
+class DiskCache(object):
+    """Keeps responses as files in a directory.
+
+    directory - directory to keep the responses in; it is created if
+                it does not exist
+    ttls - seconds to keep a response for, per verb; responses to
+           verbs that are not in there are not cached
+    max_size - bytes of responses to keep at most
+
+    Each response is stored in a file named after a hash of its key.
+    The modification time of a file is updated whenever it is read,
+    and the files least recently read are removed first when the
+    directory grows beyond max_size. Several processes can use the
+    same directory. Other files in the directory are left alone, and
+    do not count towards max_size.
+    """
+    def __init__(self, directory, ttls=None, max_size=DEFAULT_MAX_SIZE):
+        if ttls is None:
+            ttls = DEFAULT_TTLS
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._directory = directory
+        self._ttls = ttls
+        self._max_size = max_size
+
+    def get(self, key, verb):
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                expires = float(f.readline())
+            except ValueError:
+                expires = None
+            xml = f.read()
+        finally:
+            f.close()
+        # a file that can not be read is as good as expired
+        if expires is None or expires <= time.time():
+            self._remove(path)
+            return None
+        try:
+            # mark as recently used
+            _touch(path)
+        except OSError:
+            pass
+        return xml
+
+    def set(self, key, verb, xml):
+        ttl = self._ttls.get(verb)
+        if ttl is None or len(xml) > self._max_size:
+            return
+        path = self._path(key)
+        replaceFile(path, '%r\n' % (time.time() + ttl) + xml)
+        try:
+            _touch(path)
+        except OSError:
+            # another process removed it already
+            pass
+        self._evict()
+
+    def clear(self):
+        for name in os.listdir(self._directory):
+            if CACHE_FILE_NAME.match(name):
+                self._remove(os.path.join(self._directory, name))
+
+    def _path(self, key):
+        return os.path.join(self._directory,
+                            sha1(repr(key)).hexdigest() + '.xml')
+
+    def _evict(self):
+        files = []
+        size = 0
+        for name in os.listdir(self._directory):
+            if not CACHE_FILE_NAME.match(name):
+                continue
+            path = os.path.join(self._directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            size += stat.st_size
+        files.sort()
+        for mtime, file_size, path in files:
+            if size <= self._max_size:
+                break
+            self._remove(path)
+            size -= file_size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            # another process removed it first
+            pass
+
+def replaceFile(path, data, sync=False):
+    """Write data to the file at path, replacing the file atomically.
+
+    The data goes to another file first, which is then renamed, so
+    readers, also in other processes, see the old or the new file but
+    never half of it. With sync the data is on disk before the rename,
+    so that a crash does not leave an empty file either.
+    """
+    temp_path = '%s.%s.%s.tmp' % (
+        path, os.getpid(), threading.currentThread().ident)
+    f = open(temp_path, 'wb')
+    try:
+        f.write(data)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        f.close()
+    try:
+        os.rename(temp_path, path)
+    except OSError:
+        # on Windows rename does not replace existing files
+        try:
+            os.remove(path)
+        except OSError:
+            # another process removed it first
+            pass
+        os.rename(temp_path, path)
+
+def _touch(path):
+    # the clock file systems set modification times from by default is
+    # too coarse to tell apart files used shortly after each other
+    now = time.time()
+    os.utime(path, (now, now))
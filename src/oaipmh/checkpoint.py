@@ -0,0 +1,149 @@
+"""Harvesting that can be resumed after it was interrupted.
+
+A CheckpointHarvester records its progress in a checkpoint store after
+every page. If the harvest dies, running it again with the same store
+continues from the last page instead of starting over.
+"""
+import os
+import json
+
+from oaipmh import cache, client, error
+from oaipmh.datestamp import datestamp_to_datetime, datetime_to_datestamp
+
+class Error(Exception):
+    pass
+
+class JSONCheckpointStore(object):
+    """Keeps the checkpoint of a harvest in a JSON file.
+
+    The file is replaced atomically, so a crash while saving leaves
+    the previous checkpoint intact.
+    """
+    def __init__(self, path):
+        self._path = path
+
+    def load(self):
+        """Return the saved checkpoint, or None if there is none.
+        """
+        if not os.path.exists(self._path):
+            return None
+        f = open(self._path, 'rb')
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+
+    def save(self, checkpoint):
+        """Save a checkpoint, a dictionary that can be serialized to JSON.
+        """
+        cache.replaceFile(self._path, json.dumps(checkpoint), sync=True)
+
+    def clear(self):
+        """Remove the checkpoint.
+        """
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+class CheckpointHarvester(object):
+    """Harvests ListRecords or ListIdentifiers, saving checkpoints.
+
+    client - the client to harvest with
+    store - a checkpoint store, like JSONCheckpointStore
+    verb - 'ListRecords' or 'ListIdentifiers'
+    kw - arguments of the request
+
+    After all records of a page have been consumed, the checkpoint
+    store is updated with the resumption token of the next page, the
+    number of pages done and the highest datestamp seen so far. If a
+    checkpoint for the same request exists when harvesting starts, the
+    harvest continues with its resumption token. If the server no
+    longer accepts that token, the records are requested again from
+    the highest datestamp seen; this only misses nothing if the server
+    lists records in datestamp order. A page that was consumed only in
+    part when the harvest died is harvested again, so consumers should
+    expect to see some records twice after resuming.
+
+    The checkpoint is removed when the harvest is complete.
+    """
+    def __init__(self, client, store, verb='ListRecords', **kw):
+        if verb not in ['ListRecords', 'ListIdentifiers']:
+            raise Error, "Can not checkpoint %s" % verb
+        self._client = client
+        self._store = store
+        self._verb = verb
+        self._kw = kw
+        self._arguments = encodeArguments(kw)
+
+    def __iter__(self):
+        checkpoint = self._store.load()
+        if (checkpoint is None or checkpoint['verb'] != self._verb or
+            checkpoint['arguments'] != self._arguments):
+            checkpoint = {
+                'verb': self._verb,
+                'arguments': self._arguments,
+                'token': None,
+                'page': 0,
+                'watermark': None,
+                }
+        batches = self._resume(checkpoint)
+        watermark = decodeDatestamp(checkpoint['watermark'])
+        for items, token in batches:
+            for item in items:
+                if self._verb == 'ListRecords':
+                    datestamp = client.recordDatestamp(item)
+                else:
+                    datestamp = item.datestamp()
+                if watermark is None or datestamp > watermark:
+                    watermark = datestamp
+                yield item
+            checkpoint['token'] = token
+            checkpoint['page'] += 1
+            checkpoint['watermark'] = encodeDatestamp(watermark)
+            if token is None:
+                break
+            self._store.save(checkpoint)
+        self._store.clear()
+
+    def _resume(self, checkpoint):
+        """Get the batches to continue the harvest of a checkpoint with.
+        """
+        token = checkpoint['token']
+        if token is None:
+            return self._client.listBatches(self._verb, **self._kw)
+        batches = self._client.listBatches(
+            self._verb, resumptionToken=token, **self._kw)
+        try:
+            first = batches.next()
+        except error.BadResumptionTokenError:
+            # the token expired, so request what we have not seen yet
+            kw = self._kw.copy()
+            watermark = decodeDatestamp(checkpoint['watermark'])
+            if watermark is not None:
+                kw['from_'] = watermark
+            return self._client.listBatches(self._verb, **kw)
+        return _chain(first, batches)
+
+def _chain(first, rest):
+    yield first
+    for item in rest:
+        yield item
+
+def encodeArguments(kw):
+    """Turn request arguments into something that can be saved as JSON.
+    """
+    result = {}
+    for key, value in kw.items():
+        if key in ['from_', 'until']:
+            value = encodeDatestamp(value)
+        result[key] = value
+    return result
+
+def encodeDatestamp(dt):
+    if dt is None:
+        return None
+    return datetime_to_datestamp(dt)
+
+def decodeDatestamp(datestamp):
+    if datestamp is None:
+        return None
+    return datestamp_to_datetime(datestamp)
@@ -9,29 +9,161 @@ from types import SliceType
 from lxml import etree
 import time
 import codecs
+import random
+from datetime import datetime
+import sys
+import threading
+import Queue
+from collections import deque
+from copy import deepcopy
 
-from oaipmh import common, metadata, validation, error
-from oaipmh.datestamp import datestamp_to_datetime, datetime_to_datestamp
+from oaipmh import common, metadata, validation, error, connection
+from oaipmh.datestamp import datestamp_to_datetime, datetime_to_datestamp,\
+     split_datetime_range
 
 WAIT_DEFAULT = 120 # two minutes
 WAIT_MAX = 5
+# seconds to wait at most after the first 503 without Retry-After;
+# this doubles with every retry, up to WAIT_DEFAULT
+WAIT_BACKOFF = 5
+
+# a request is hedged when it takes longer than this part of the
+# requests before it
+HEDGE_PERCENTILE = 0.95
+# requests to see before hedging, and how many to remember
+HEDGE_MIN_SAMPLES = 20
+HEDGE_HISTORY = 200
+
+# records waiting to be consumed per worker of a split up harvest
+PARTITION_RECORDS_QUEUED = 100
+
+NS_OAIPMH = 'http://www.openarchives.org/OAI/2.0/'
+
+# verbs whose responses are built into records, headers or sets
+BUILT_VERBS = ['GetRecord', 'ListIdentifiers', 'ListRecords', 'ListSets']
+
+# the XPath expressions responses are read with, by name; they use the
+# prefixes of BaseClient.getNamespaces
+XPATH_EXPRESSIONS = [
+    ('errors', '/oai:OAI-PMH/oai:error'),
+    ('token', 'string(/oai:OAI-PMH/*/oai:resumptionToken/text())'),
+    ('token_element', '/oai:OAI-PMH/*/oai:resumptionToken'),
+    ('verb_element',
+     '/oai:OAI-PMH/oai:*[not(self::oai:responseDate or self::oai:request)]'),
+    ('identify', '/oai:OAI-PMH/oai:Identify'),
+    ('repository_name', 'string(oai:repositoryName/text())'),
+    ('base_url', 'string(oai:baseURL/text())'),
+    ('protocol_version', 'string(oai:protocolVersion/text())'),
+    ('admin_emails', 'oai:adminEmail/text()'),
+    ('earliest_datestamp', 'string(oai:earliestDatestamp/text())'),
+    ('deleted_record', 'string(oai:deletedRecord/text())'),
+    ('granularity', 'string(oai:granularity/text())'),
+    ('compression', 'oai:compression/text()'),
+    ('metadata_formats',
+     '/oai:OAI-PMH/oai:ListMetadataFormats/oai:metadataFormat'),
+    ('metadata_prefix', 'string(oai:metadataPrefix/text())'),
+    ('schema', 'string(oai:schema/text())'),
+    ('metadata_namespace', 'string(oai:metadataNamespace/text())'),
+    ('records', '/oai:OAI-PMH/*/oai:record'),
+    ('record_header', 'oai:header'),
+    ('record_metadata', 'oai:metadata'),
+    ('metadata_element', '*[1]'),
+    ('uses_oai',
+     'boolean(descendant-or-self::oai:* | descendant-or-self::*/@oai:*)'),
+    ('headers', '/oai:OAI-PMH/oai:ListIdentifiers/oai:header'),
+    ('identifier', 'string(oai:identifier/text())'),
+    ('datestamp', 'string(oai:datestamp/text())'),
+    ('setspecs', 'oai:setSpec/text()'),
+    ('deleted', "@status = 'deleted'"),
+    ('sets', '/oai:OAI-PMH/oai:ListSets/oai:set'),
+    ('set_spec', 'string(oai:setSpec/text())'),
+    ('set_name', 'string(oai:setName/text())'),
+    ]
+
+class XPaths(object):
+    """The expressions of XPATH_EXPRESSIONS, compiled for a namespace map.
+
+    Each expression is an attribute, named as in XPATH_EXPRESSIONS.
+    """
+    def __init__(self, namespaces):
+        for name, expr in XPATH_EXPRESSIONS:
+            setattr(self, name, etree.XPath(expr, namespaces=namespaces))
+
+# compiled XPaths by namespace map, so that the expressions are not
+# parsed again for every record, header and set
+_compiled_xpaths = {}
+
+def compiledXPaths(namespaces):
+    """Return the XPaths for a namespace map, compiling them only once.
+    """
+    key = tuple(sorted(namespaces.items()))
+    xpaths = _compiled_xpaths.get(key)
+    if xpaths is None:
+        xpaths = _compiled_xpaths[key] = XPaths(namespaces)
+    return xpaths
 
 class Error(Exception):
     pass
 
+class RequestEvent(object):
+    """What happened during a request, as reported to request listeners.
+
+    verb - the verb of the request
+    arguments - the arguments of the request
+    bytes_received - size of the response, None if it was not retrieved
+    time_to_first_byte - seconds until the server started to answer
+    download_time - seconds spent reading the response
+    wait_time - seconds waited because the server was busy (503)
+    parse_time - seconds spent parsing the response
+    build_time - seconds spent building records, headers or sets
+    record_count - number of records, headers or sets built
+    error - the exception the request failed with, or None
+    hedged - True if a second request was sent because the first one
+             was slow (see Client.hedgeRequests)
+
+    Times that were not measured are None.
+    """
+    def __init__(self, verb, arguments):
+        self.verb = verb
+        self.arguments = arguments
+        self.bytes_received = None
+        self.time_to_first_byte = None
+        self.download_time = None
+        self.wait_time = None
+        self.parse_time = None
+        self.build_time = None
+        self.record_count = None
+        self.error = None
+        self.hedged = False
+
 class BaseClient(common.OAIPMH):
 
     def __init__(self, metadata_registry=None):
         self._metadata_registry = (
             metadata_registry or metadata.global_metadata_registry)
         self._ignore_bad_character_hack = 0
+        self._recovering_parser = None
         self._day_granularity = False
+        self._stream_records = False
+        self._prefetch_depth = 0
+        self._process_pool = None
+        self._pool_pages_ahead = 0
+        self._response_cache = None
+        self._raw_records = False
+        self._detach_records = False
+        self._compact_headers = False
+        self._request_listeners = []
+        # the request being made by a thread
+        self._request_events = threading.local()
 
     def updateGranularity(self):
         """Update the granularity setting dependent on that the server says.
         """
-        identify = self.identify()
-        granularity = identify.granularity()
+        self.setGranularity(self.identify().granularity())
+
+    def setGranularity(self, granularity):
+        """Set the granularity of the datestamps sent to the server.
+        """
         if granularity == 'YYYY-MM-DD':
             self._day_granularity = True
         elif granularity == 'YYYY-MM-DDThh:mm:ssZ':
@@ -42,6 +174,25 @@ class BaseClient(common.OAIPMH):
     def handleVerb(self, verb, kw):
         # validate kw first
         validation.validateArguments(verb, kw)
+        self.encodeDatestamps(kw)
+        # records can be built in other processes
+        if (self._process_pool is not None and verb == 'ListRecords' and
+            not self._raw_records):
+            return self.ListRecords_pool(kw)
+        # list pages can be parsed while they are being read
+        if self._stream_records and verb in ['ListIdentifiers',
+                                             'ListRecords']:
+            return getattr(self, verb + '_stream')(kw)
+        # now call underlying implementation
+        method = getattr(self, verb + '_impl')
+        if verb in BUILT_VERBS:
+            tree, event = self.makeRequestBuilding(verb=verb, **kw)
+            return method(kw, tree, event)
+        return method(kw, self.makeRequestErrorHandling(verb=verb, **kw))
+
+    def encodeDatestamps(self, kw):
+        """Turn the from_ and until arguments into request datestamps.
+        """
         # encode datetimes as datestamps
         from_ = kw.get('from_')
         if from_ is not None:
@@ -59,16 +210,16 @@ class BaseClient(common.OAIPMH):
         elif 'until' in kw:
             # until is None but is explicitly in kw, remove it
             del kw['until']
-        
-        # now call underlying implementation
-        method_name = verb + '_impl'
-        return getattr(self, method_name)(
-            kw, self.makeRequestErrorHandling(verb=verb, **kw))    
 
     def getNamespaces(self):
         """Get OAI namespaces.
         """
-        return {'oai': 'http://www.openarchives.org/OAI/2.0/'}
+        return {'oai': NS_OAIPMH}
+
+    def getXPaths(self):
+        """Get the XPaths to read responses with, for getNamespaces.
+        """
+        return compiledXPaths(self.getNamespaces())
 
     def getMetadataRegistry(self):
         """Return the metadata registry in use.
@@ -84,29 +235,306 @@ class BaseClient(common.OAIPMH):
         aren't completely. 	 
         """ 	 
         self._ignore_bad_character_hack = true_or_false 	 
+        if true_or_false and self._recovering_parser is None:
+            self._recovering_parser = etree.XMLParser(recover=True,
+                                                      huge_tree=True)
 
     def parse(self, xml): 	 
         """Parse the XML to a lxml tree. 	 
+
+        When ignoring bad characters, pages that are not well-formed
+        have their bad characters replaced and are parsed again with a
+        parser that recovers from other errors too. Pages that are
+        well-formed are parsed as they are.
+
+        Recovering can drop the rest of a page after an error. If the
+        recovered page misses the element of the verb, or a
+        resumptionToken the page has, XMLSyntaxError is raised rather
+        than ending a harvest early.
+        """
+        try:
+            return etree.XML(xml)
+        except etree.XMLSyntaxError:
+            if not self._ignore_bad_character_hack:
+                raise
+        tree = etree.XML(self.replaceBadCharacters(xml),
+                         self._recovering_parser)
+        if tree is None:
+            raise SyntaxError("Could not recover from XML errors")
+        xpaths = self.getXPaths()
+        if not xpaths.verb_element(tree):
+            raise etree.XMLSyntaxError(
+                "Recovered page has no response", None, 0, 0)
+        if 'resumptionToken' in xml and not xpaths.token_element(tree):
+            raise etree.XMLSyntaxError(
+                "Recovered page lost its resumptionToken", None, 0, 0)
+        return tree
+
+    def replaceBadCharacters(self, xml):
+        """Replace characters that would make the XML not well-formed.
         """
-        # XXX this is only safe for UTF-8 encoded content, 	 
+        # XXX this is only safe for UTF-8 encoded content,
         # and we're basically hacking around non-wellformedness anyway,
         # but oh well
-        if self._ignore_bad_character_hack: 	 
-            xml = unicode(xml, 'UTF-8', 'replace') 	 
-            # also get rid of character code 12 	 
-            xml = xml.replace(chr(12), '?')
-            xml = xml.encode('UTF-8')
-        return etree.XML(xml)
+        try:
+            xml.decode('UTF-8')
+        except UnicodeDecodeError:
+            xml = unicode(xml, 'UTF-8', 'replace').encode('UTF-8')
+        # also get rid of character code 12
+        return xml.replace(chr(12), '?')
+
+    def streamRecords(self, true_or_false):
+        """Set to parse ListRecords and ListIdentifiers pages incrementally.
+
+        Records are built as soon as they have been read, before the
+        rest of the page has arrived, and are dropped from the page tree
+        once they have been handed out. Memory use then no longer grows
+        with the size of the pages a server sends.
+        """
+        self._stream_records = true_or_false
+
+    def prefetchBatches(self, depth):
+        """Set how many list batches to retrieve ahead of the consumer.
+
+        With a depth above 0 the next batches of ListIdentifiers,
+        ListRecords and ListSets are requested and parsed in a
+        background thread as soon as their resumption token is known,
+        while the consumer is still busy with the current batch. 0, the
+        default, disables prefetching.
+
+        Pages that are streamed (see streamRecords) are not prefetched.
+        """
+        self._prefetch_depth = depth
+
+    def useProcessPool(self, pool, pages_ahead=4):
+        """Set a pool of worker processes to build ListRecords records in.
+
+        pool - a multiprocessing.Pool, or None to build records in this
+               process again
+        pages_ahead - how many pages may be handed to the pool before
+                      their records are consumed; to keep all processes
+                      busy this should be at least the size of the pool
+
+        Pages are still retrieved, and parsed for errors and their
+        resumption token, in this process; building the records and
+        reading their metadata happens in the pool. Records come back
+        in their original order. As lxml elements can not be moved
+        between processes, headers and metadata come without element,
+        and the metadata registry and what its readers return need to
+        be picklable. This takes precedence over streamRecords.
+        """
+        self._process_pool = pool
+        self._pool_pages_ahead = pages_ahead
+
+    def rawRecords(self, true_or_false):
+        """Set to return records of GetRecord and ListRecords unread.
+
+        Records are then (identifier, datestamp, deleted, xml) tuples,
+        where xml is the serialized first element inside oai:metadata,
+        or None if the record has no metadata. No header objects are
+        created and no metadata readers are run, so metadataPrefix
+        does not need a reader in the metadata registry. This takes
+        precedence over useProcessPool. listRecordsPerSet,
+        listRecordsPerWindow and checkpoint.CheckpointHarvester also
+        work with raw records.
+        """
+        self._raw_records = true_or_false
+
+    def detachRecords(self, true_or_false):
+        """Set to return headers and metadata that don't refer to their page.
+
+        Normally the element of a header and of metadata is part of the
+        tree of the page it was listed on, so keeping a single header
+        or record keeps its whole page in memory. Detached headers have
+        no element, and metadata created by a MetadataReader gets a
+        copy of its own element. Pages can then be freed as soon as
+        their records have been consumed, and memory use depends on the
+        number of records kept instead of on the number of pages.
+        """
+        self._detach_records = true_or_false
+
+    def compactHeaders(self, true_or_false):
+        """Set to keep the headers of ListIdentifiers pages in arrays.
+
+        Pages are then built as common.HeaderBatch objects, which need
+        far less memory than lists of headers. listIdentifiers still
+        generates headers, without element, but listBatches returns the
+        batches themselves, so they can be kept instead of the headers.
+        Pages that are streamed (see streamRecords) are not affected.
+        """
+        self._compact_headers = true_or_false
+
+    def addRequestListener(self, listener):
+        """Add a function to be called with a RequestEvent per request.
+
+        The event is reported once the response has been parsed and,
+        for GetRecord and list requests, built into results, so it can
+        tell where the time of a harvest goes. A page of a list is
+        reported when it is built, so pages of lists that are not
+        consumed are never reported. Requests for ListRecords pages
+        that are streamed or built in a process pool are not reported
+        either. Without listeners no measurements are taken.
+        """
+        self._request_listeners.append(listener)
+
+    def removeRequestListener(self, listener):
+        self._request_listeners.remove(listener)
+
+    def currentRequestEvent(self):
+        """Return the event of the request this thread is making, if any.
+
+        There is one only while the response is retrieved and parsed
+        by makeRequestBuilding; building the results gets the event
+        passed along instead, as lists are built lazily and may be
+        built in any order.
+        """
+        return getattr(self._request_events, 'current', None)
+
+    def finishRequestEvent(self, event, record_count=None, build_time=None):
+        event.record_count = record_count
+        event.build_time = build_time
+        for listener in list(self._request_listeners):
+            listener(event)
+
+    def useResponseCache(self, response_cache):
+        """Set a cache to keep the responses of rarely changing requests in.
+
+        response_cache - a cache.MemoryCache, cache.DiskCache or other
+                         object with the same get and set methods, or
+                         None to stop caching
+
+        Requests are looked up in the cache by the base URL of the
+        client and their arguments. Which verbs are cached and for how
+        long is up to the cache; by default those are Identify,
+        ListMetadataFormats and ListSets. Responses that report errors
+        and pages of lists that have a resumption token are never
+        cached.
+        """
+        self._response_cache = response_cache
+
+    def getBaseURL(self):
+        """Return the URL of the server, or None if it has none.
+        """
+        return None
+
+    def listBatches(self, verb, resumptionToken=None, **kw):
+        """Iterate over the batches of a list request.
+
+        verb - 'ListIdentifiers', 'ListRecords' or 'ListSets'
+        resumptionToken - continue the list from this token
+        kw - arguments of the request; when continuing from a token
+             they are not sent, but metadataPrefix is still needed to
+             read the metadata of records
+
+        Yields (items, token) tuples for every page of the list, where
+        token is the resumption token of the next page or None.
+        """
+        validation.validateArguments(verb, kw)
+        kw = kw.copy()
+        self.encodeDatestamps(kw)
+        namespaces = self.getNamespaces()
+        if verb == 'ListRecords':
+            metadata_prefix = kw['metadataPrefix']
+            def build(tree, event):
+                return self.buildRecords(
+                    metadata_prefix, namespaces,
+                    self._metadata_registry, tree, event)
+        elif verb == 'ListIdentifiers':
+            def build(tree, event):
+                return self.buildIdentifiers(namespaces, tree, event)
+        elif verb == 'ListSets':
+            def build(tree, event):
+                return self.buildSets(namespaces, tree, event)
+        else:
+            raise Error, "Not a list verb: %s" % verb
+        if resumptionToken is None:
+            tree, event = self.makeRequestBuilding(verb=verb, **kw)
+        else:
+            tree, event = self.makeRequestBuilding(
+                verb=verb, resumptionToken=resumptionToken)
+        while 1:
+            items, token = build(tree, event)
+            yield items, token
+            if token is None or not items:
+                break
+            tree, event = self.makeRequestBuilding(
+                verb=verb, resumptionToken=token)
+
+    def listRecordsPerSet(self, workers=4, sets=None, **kw):
+        """Harvest the records of a number of sets concurrently.
+
+        workers - how many sets to harvest at the same time
+        sets - setSpecs of the sets to harvest, by default all sets the
+               server lists
+        kw - arguments for listRecords, except set
+
+        Returns an iterator over the records of all sets, in the order
+        in which they arrive. A record that is in more than one set is
+        returned only once. Records that are not in any set are not
+        harvested at all.
+
+        An error while harvesting a set does not stop the harvest of the
+        other sets. Once those are done, error.SetHarvestError is raised
+        with the failed sets. A set without records is not an error.
+        """
+        if sets is None:
+            sets = [setSpec for setSpec, setName, setDescription
+                    in self.listSets()]
+        def listSet(setSpec):
+            return self.listRecords(set=setSpec, **kw)
+        return ParallelPartitionsGenerator(listSet, sets, workers,
+                                           error.SetHarvestError)
+
+    def listRecordsPerWindow(self, windows=4, workers=None, **kw):
+        """Harvest the records in a number of datestamp windows concurrently.
+
+        windows - in how many windows to split the datestamp range
+        workers - how many windows to harvest at the same time, by
+                  default all of them
+        kw - arguments for listRecords
+
+        The range runs from the from_ argument, or the earliest
+        datestamp of the repository, up to the until argument or now.
+        It is split in windows aligned to the granularity of the
+        server, which is also used for the requests from now on, so no
+        record falls between or in two windows. Without until the last
+        window is left open, so records the server stamps later than
+        our clock says it is are still harvested.
+
+        Returns an iterator over the records in the order in which they
+        arrive. A record that changes during the harvest, and so moves
+        to another window, is returned only once.
+
+        An error while harvesting a window does not stop the harvest of
+        the others. Once those are done, error.WindowHarvestError is
+        raised with the failed windows.
+        """
+        identify = self.identify()
+        self.setGranularity(identify.granularity())
+        start = kw.pop('from_', None) or identify.earliestDatestamp()
+        until = kw.pop('until', None)
+        ranges = split_datetime_range(
+            start, until or datetime.utcnow(), windows,
+            self._day_granularity)
+        if until is None:
+            ranges[-1] = (ranges[-1][0], None)
+        def listWindow(window):
+            from_, until = window
+            return self.listRecords(from_=from_, until=until, **kw)
+        return ParallelPartitionsGenerator(listWindow, ranges,
+                                           workers or len(ranges),
+                                           error.WindowHarvestError)
 
     # implementation of the various methods, delegated here by
     # handleVerb method
 
-    def GetRecord_impl(self, args, tree):
+    def GetRecord_impl(self, args, tree, event=None):
         records, token = self.buildRecords(
             args['metadataPrefix'],
             self.getNamespaces(),
             self._metadata_registry,
-            tree
+            tree,
+            event
             )
         assert token is None
         return records[0]
@@ -115,23 +543,18 @@ class BaseClient(common.OAIPMH):
         return tree
     
     def Identify_impl(self, args, tree):
-        namespaces = self.getNamespaces()
-        evaluator = etree.XPathEvaluator(tree, namespaces=namespaces)
-        identify_node = evaluator.evaluate(
-            '/oai:OAI-PMH/oai:Identify')[0]
-        identify_evaluator = etree.XPathEvaluator(identify_node,
-                                                  namespaces=namespaces)
-        e = identify_evaluator.evaluate
-
-        repositoryName = e('string(oai:repositoryName/text())')
-        baseURL = e('string(oai:baseURL/text())')
-        protocolVersion = e('string(oai:protocolVersion/text())')
-        adminEmails = e('oai:adminEmail/text()')
+        xpaths = self.getXPaths()
+        identify_node = xpaths.identify(tree)[0]
+
+        repositoryName = xpaths.repository_name(identify_node)
+        baseURL = xpaths.base_url(identify_node)
+        protocolVersion = xpaths.protocol_version(identify_node)
+        adminEmails = xpaths.admin_emails(identify_node)
         earliestDatestamp = datestamp_to_datetime(
-            e('string(oai:earliestDatestamp/text())'))
-        deletedRecord = e('string(oai:deletedRecord/text())')
-        granularity = e('string(oai:granularity/text())')
-        compression = e('oai:compression/text()')
+            xpaths.earliest_datestamp(identify_node))
+        deletedRecord = xpaths.deleted_record(identify_node)
+        granularity = xpaths.granularity(identify_node)
+        compression = xpaths.compression(identify_node)
         # XXX description
         identify = common.Identify(
             repositoryName, baseURL, protocolVersion,
@@ -139,176 +562,380 @@ class BaseClient(common.OAIPMH):
             deletedRecord, granularity, compression)
         return identify
 
-    def ListIdentifiers_impl(self, args, tree):
+    def ListIdentifiers_impl(self, args, tree, event=None):
         namespaces = self.getNamespaces()
         def firstBatch():
-            return self.buildIdentifiers(namespaces, tree)
+            return self.buildIdentifiers(namespaces, tree, event)
         def nextBatch(token):
-            tree = self.makeRequestErrorHandling(verb='ListIdentifiers',
-                                                 resumptionToken=token)
-            return self.buildIdentifiers(namespaces, tree)
-        return ResumptionListGenerator(firstBatch, nextBatch)
+            tree, event = self.makeRequestBuilding(verb='ListIdentifiers',
+                                                   resumptionToken=token)
+            return self.buildIdentifiers(namespaces, tree, event)
+        return self.resumptionList(firstBatch, nextBatch)
 
-    def ListMetadataFormats_impl(self, args, tree):
+    def ListIdentifiers_stream(self, args):
         namespaces = self.getNamespaces()
-        evaluator = etree.XPathEvaluator(tree, 
-                                         namespaces=namespaces)
+        def build(header_node):
+            header = buildHeader(header_node, namespaces)
+            if self._detach_records:
+                header = detachHeader(header)
+            return header
+        def firstPage():
+            return self.makeRequestStreaming(
+                'header', verb='ListIdentifiers', **args)
+        def nextPage(token):
+            return self.makeRequestStreaming(
+                'header', verb='ListIdentifiers', resumptionToken=token)
+        return StreamingResumptionListGenerator(firstPage, nextPage, build)
 
-        metadataFormat_nodes = evaluator.evaluate(
-            '/oai:OAI-PMH/oai:ListMetadataFormats/oai:metadataFormat')
+    def ListMetadataFormats_impl(self, args, tree):
+        xpaths = self.getXPaths()
+        metadataFormat_nodes = xpaths.metadata_formats(tree)
         metadataFormats = []
         for metadataFormat_node in metadataFormat_nodes:
-            e = etree.XPathEvaluator(metadataFormat_node, 
-                                     namespaces=namespaces).evaluate
-            metadataPrefix = e('string(oai:metadataPrefix/text())')
-            schema = e('string(oai:schema/text())')
-            metadataNamespace = e('string(oai:metadataNamespace/text())')
+            metadataPrefix = xpaths.metadata_prefix(metadataFormat_node)
+            schema = xpaths.schema(metadataFormat_node)
+            metadataNamespace = xpaths.metadata_namespace(metadataFormat_node)
             metadataFormat = (metadataPrefix, schema, metadataNamespace)
             metadataFormats.append(metadataFormat)
 
         return metadataFormats
 
-    def ListRecords_impl(self, args, tree):
+    def ListRecords_impl(self, args, tree, event=None):
         namespaces = self.getNamespaces()
         metadata_prefix = args['metadataPrefix']
         metadata_registry = self._metadata_registry
         def firstBatch():
             return self.buildRecords(
                 metadata_prefix, namespaces,
-                metadata_registry, tree)
+                metadata_registry, tree, event)
         def nextBatch(token):
-            tree = self.makeRequestErrorHandling(
+            tree, event = self.makeRequestBuilding(
                 verb='ListRecords',
                 resumptionToken=token)
             return self.buildRecords(
                 metadata_prefix, namespaces,
-                metadata_registry, tree)
-        return ResumptionListGenerator(firstBatch, nextBatch)
+                metadata_registry, tree, event)
+        return self.resumptionList(firstBatch, nextBatch)
 
-    def ListSets_impl(self, args, tree):
+    def ListRecords_stream(self, args):
+        namespaces = self.getNamespaces()
+        metadata_prefix = args['metadataPrefix']
+        metadata_registry = self._metadata_registry
+        def build(record_node):
+            return self.buildRecord(
+                metadata_prefix, namespaces,
+                metadata_registry, record_node)
+        def firstPage():
+            return self.makeRequestStreaming(
+                'record', verb='ListRecords', **args)
+        def nextPage(token):
+            return self.makeRequestStreaming(
+                'record', verb='ListRecords', resumptionToken=token)
+        return StreamingResumptionListGenerator(firstPage, nextPage, build)
+
+    def ListRecords_pool(self, args):
+        metadata_prefix = args['metadataPrefix']
+        metadata_registry = self._metadata_registry
+        pool = self._process_pool
+        ignore_bad_characters = self._ignore_bad_character_hack
+        namespaces = self.getNamespaces()
+        xpaths = compiledXPaths(namespaces)
+        def fetchPage(**kw):
+            # not reported: no request event is current here
+            xml = self.makeRequest(**kw)
+            tree = self.parseErrorHandling(xml, kw)
+            if not xpaths.records(tree):
+                return None, None
+            token = xpaths.token(tree)
+            if token.strip() == '':
+                token = None
+            return xml, token
+        def firstPage():
+            return fetchPage(verb='ListRecords', **args)
+        def nextPage(token):
+            return fetchPage(verb='ListRecords', resumptionToken=token)
+        def decode(xml):
+            return pool.apply_async(
+                buildRecordsInProcess,
+                (xml, metadata_prefix, metadata_registry,
+                 ignore_bad_characters, namespaces))
+        return PoolResumptionListGenerator(
+            firstPage(), nextPage, decode, self._pool_pages_ahead)
+
+    def ListSets_impl(self, args, tree, event=None):
         namespaces = self.getNamespaces()
         def firstBatch():
-            return self.buildSets(namespaces, tree)
+            return self.buildSets(namespaces, tree, event)
         def nextBatch(token):
-            tree = self.makeRequestErrorHandling(
+            tree, event = self.makeRequestBuilding(
                 verb='ListSets',
                 resumptionToken=token)
-            return self.buildSets(namespaces, tree)
-        return ResumptionListGenerator(firstBatch, nextBatch)
+            return self.buildSets(namespaces, tree, event)
+        return self.resumptionList(firstBatch, nextBatch)
 
     # various helper methods
+
+    def resumptionList(self, firstBatch, nextBatch):
+        if self._prefetch_depth > 0:
+            return PrefetchingResumptionListGenerator(
+                firstBatch, nextBatch, self._prefetch_depth)
+        return ResumptionListGenerator(firstBatch, nextBatch)
     
     def buildRecords(self,
-                     metadata_prefix, namespaces, metadata_registry, tree):
+                     metadata_prefix, namespaces, metadata_registry, tree,
+                     event=None):
+        if event is not None:
+            start = time.time()
+        xpaths = compiledXPaths(namespaces)
         # first find resumption token if available
-        evaluator = etree.XPathEvaluator(tree,
-                                         namespaces=namespaces)
-        token = evaluator.evaluate(
-            'string(/oai:OAI-PMH/*/oai:resumptionToken/text())')
+        token = xpaths.token(tree)
         if token.strip() == '':
             token = None
-        record_nodes = evaluator.evaluate(
-            '/oai:OAI-PMH/*/oai:record')
+        record_nodes = xpaths.records(tree)
         result = []
         for record_node in record_nodes:
-            record_evaluator = etree.XPathEvaluator(record_node, 
-                                                    namespaces=namespaces)
-            e = record_evaluator.evaluate
-            # find header node
-            header_node = e('oai:header')[0]
-            # create header
-            header = buildHeader(header_node, namespaces)
-            # find metadata node
-            metadata_list = e('oai:metadata')
-            if metadata_list:
-                metadata_node = metadata_list[0]
-                # create metadata
-                metadata = metadata_registry.readMetadata(metadata_prefix,
-                                                          metadata_node)
-            else:
-                metadata = None
-            # XXX TODO: about, should be third element of tuple
-            result.append((header, metadata, None))
+            result.append(self.buildRecord(
+                metadata_prefix, namespaces, metadata_registry, record_node))
+        if event is not None:
+            self.finishRequestEvent(event, len(result), time.time() - start)
         return result, token
 
-    def buildIdentifiers(self, namespaces, tree):
-        evaluator = etree.XPathEvaluator(tree, 
-                                         namespaces=namespaces)
+    def buildRecord(self,
+                    metadata_prefix, namespaces, metadata_registry,
+                    record_node):
+        if self._raw_records:
+            return buildRawRecord(record_node, namespaces)
+        xpaths = compiledXPaths(namespaces)
+        # find header node
+        header_node = xpaths.record_header(record_node)[0]
+        # create header
+        header = readHeader(header_node, xpaths)
+        # find metadata node
+        metadata_list = xpaths.record_metadata(record_node)
+        if metadata_list:
+            metadata_node = metadata_list[0]
+            # create metadata
+            metadata = metadata_registry.readMetadata(metadata_prefix,
+                                                      metadata_node)
+        else:
+            metadata = None
+        if self._detach_records:
+            header = detachHeader(header)
+            if (isinstance(metadata, common.Metadata) and
+                metadata.element() is not None):
+                metadata = common.Metadata(deepcopy(metadata.element()),
+                                           metadata.getMap())
+        # XXX TODO: about, should be third element of tuple
+        return header, metadata, None
+
+    def buildIdentifiers(self, namespaces, tree, event=None):
+        if event is not None:
+            start = time.time()
+        xpaths = compiledXPaths(namespaces)
         # first find resumption token is available
-        token = evaluator.evaluate(
-            'string(/oai:OAI-PMH/oai:ListIdentifiers/oai:resumptionToken/text())')
+        token = xpaths.token(tree)
         if token.strip() == '':
             token = None    
-        header_nodes = evaluator.evaluate(
-                '/oai:OAI-PMH/oai:ListIdentifiers/oai:header')            
-        result = []
+        header_nodes = xpaths.headers(tree)
+        if self._compact_headers:
+            result = common.HeaderBatch()
+        else:
+            result = []
         for header_node in header_nodes:
-            header = buildHeader(header_node, namespaces)
+            header = readHeader(header_node, xpaths)
+            if self._detach_records:
+                header = detachHeader(header)
             result.append(header)
+        if event is not None:
+            self.finishRequestEvent(event, len(result), time.time() - start)
         return result, token
 
-    def buildSets(self, namespaces, tree):
-        evaluator = etree.XPathEvaluator(tree, 
-                                         namespaces=namespaces)
+    def buildSets(self, namespaces, tree, event=None):
+        if event is not None:
+            start = time.time()
+        xpaths = compiledXPaths(namespaces)
         # first find resumption token if available
-        token = evaluator.evaluate(
-            'string(/oai:OAI-PMH/oai:ListSets/oai:resumptionToken/text())')
+        token = xpaths.token(tree)
         if token.strip() == '':
             token = None  
-        set_nodes = evaluator.evaluate(
-            '/oai:OAI-PMH/oai:ListSets/oai:set')
+        set_nodes = xpaths.sets(tree)
         sets = []
         for set_node in set_nodes:
-            e = etree.XPathEvaluator(set_node, 
-                                     namespaces=namespaces).evaluate
             # make sure we get back unicode strings instead
             # of lxml.etree._ElementUnicodeResult objects.
-            setSpec = unicode(e('string(oai:setSpec/text())'))
-            setName = unicode(e('string(oai:setName/text())'))
+            setSpec = unicode(xpaths.set_spec(set_node))
+            setName = unicode(xpaths.set_name(set_node))
             # XXX setDescription nodes
             sets.append((setSpec, setName, None))
+        if event is not None:
+            self.finishRequestEvent(event, len(sets), time.time() - start)
         return sets, token
 
     def makeRequestErrorHandling(self, **kw):
+        tree, event = self.makeRequestBuilding(**kw)
+        if event is not None:
+            self.finishRequestEvent(event)
+        return tree
+
+    def makeRequestBuilding(self, **kw):
+        """Make a request whose results are still to be built.
+
+        Returns the tree of the response and the RequestEvent of the
+        request, which is None without request listeners. The event is
+        to be passed on to buildRecords, buildIdentifiers or buildSets,
+        which report it once the results are built. Failed requests are
+        reported right away.
+        """
+        if not self._request_listeners:
+            return self.makeRequestCached(kw), None
+        event = RequestEvent(kw['verb'], kw)
+        self._request_events.current = event
+        try:
+            tree = self.makeRequestCached(kw)
+        except Exception, e:
+            event.error = e
+            self.finishRequestEvent(event)
+            raise
+        finally:
+            self._request_events.current = None
+        return tree, event
+
+    def makeRequestCached(self, kw):
+        """Make a request, using the response cache if there is one.
+        """
+        response_cache = self._response_cache
+        if response_cache is None or 'resumptionToken' in kw:
+            xml = self.makeRequest(**kw)
+            return self.parseErrorHandling(xml, kw)
+        key = (self.getBaseURL(),) + tuple(sorted(kw.items()))
+        xml = response_cache.get(key, kw['verb'])
+        if xml is not None:
+            return self.parseErrorHandling(xml, kw)
         xml = self.makeRequest(**kw)
+        tree = self.parseErrorHandling(xml, kw)
+        # later pages can not be requested with a cached token
+        if not self.getXPaths().token(tree):
+            response_cache.set(key, kw['verb'], xml)
+        return tree
+
+    def parseErrorHandling(self, xml, kw):
+        """Parse the response to a request, raising errors it reports.
+        """
+        event = self.currentRequestEvent()
+        if event is not None:
+            event.bytes_received = len(xml)
+            start = time.time()
         try:
             tree = self.parse(xml)
         except SyntaxError:
             raise error.XMLSyntaxError(kw)
+        if event is not None:
+            event.parse_time = time.time() - start
         # check whether there are errors first
-        e_errors = tree.xpath('/oai:OAI-PMH/oai:error',
-                              namespaces=self.getNamespaces())
+        e_errors = self.getXPaths().errors(tree)
         if e_errors:
             # XXX right now only raise first error found, does not
             # collect error info
             for e_error in e_errors:
-                code = e_error.get('code')
-                msg = e_error.text
-                if code not in ['badArgument', 'badResumptionToken',
-                                'badVerb', 'cannotDisseminateFormat',
-                                'idDoesNotExist', 'noRecordsMatch',
-                                'noMetadataFormats', 'noSetHierarchy']:
-                    raise error.UnknownError,\
-                          "Unknown error code from server: %s, message: %s" % (
-                        code, msg)
-                # find exception in error module and raise with msg
-                raise getattr(error, code[0].upper() + code[1:] + 'Error'), msg
+                raiseServerError(e_error)
         return tree
+
+    def makeRequestStreaming(self, item_name, **kw):
+        """Make a list request and parse the response while it is read.
+
+        item_name - local name of the elements listed by the verb
+                    ('header' or 'record')
+
+        returns - a StreamingPage yielding the item elements
+        """
+        stream = self.makeRequestStream(**kw)
+        if self._ignore_bad_character_hack:
+            # the hack needs to see the whole page at once
+            xml = stream.read()
+            closeStream(stream)
+            stream = StringIO(self.replaceBadCharacters(xml))
+        return StreamingPage(stream, kw['verb'], item_name, kw,
+                             self.getNamespaces()['oai'])
     
     def makeRequest(self, **kw):
         raise NotImplementedError
+
+    def makeRequestStream(self, **kw):
+        """Return a file-like object to read the response from.
+
+        The default reads the whole response using makeRequest. Clients
+        that can read the response incrementally should override this.
+        """
+        return StringIO(self.makeRequest(**kw))
     
 class Client(BaseClient):
     def __init__(
-            self, base_url, metadata_registry=None, credentials=None, local_file=False):
+            self, base_url, metadata_registry=None, credentials=None, local_file=False,
+            connection_pool=None):
         BaseClient.__init__(self, metadata_registry)
         self._base_url = base_url
         self._local_file = local_file
+        # a connection.ConnectionPool to keep connections alive with,
+        # if None every request opens a new connection through urllib2
+        self._connection_pool = connection_pool
+        # content codings to ask the server for
+        self._accept_encodings = []
+        self._connect_timeout = None
+        self._read_timeout = None
+        self._hedger = None
         if credentials is not None:
             self._credentials = base64.encodestring('%s:%s' % credentials)
         else:
             self._credentials = None
             
+    def updateCompression(self):
+        """Ask for compressed responses if the server says it can send them.
+
+        Uses the compression methods the server lists in Identify that
+        we know how to decompress.
+        """
+        compression = self.identify().compression()
+        self._accept_encodings = [
+            encoding for encoding in connection.SUPPORTED_ENCODINGS
+            if encoding in compression]
+
+    def setTimeouts(self, connect=None, read=None):
+        """Set how long to wait for the server, in seconds.
+
+        connect - to wait for a connection at most
+        read - to wait at most for the server to send anything, while
+               waiting for a response and while reading it
+
+        None means to wait as long as it takes, which is the default.
+        A request that times out raises socket.timeout or
+        urllib2.URLError. Without a connection pool urllib2 has only a
+        single timeout, so the longer of the two is used for both.
+        """
+        self._connect_timeout = connect
+        self._read_timeout = read
+
+    def hedgeRequests(self, true_or_false, percentile=HEDGE_PERCENTILE):
+        """Send a request again when the server is slow to answer it.
+
+        When a request takes longer than the given part of the
+        requests before it (by default 95%), the same request is sent
+        a second time, and whichever answer comes first is used. This
+        cuts the time spent waiting for the slowest pages of a harvest,
+        at the cost of a few more requests. Only complete responses are
+        hedged, not streamed ones (see streamRecords). Use timeouts as
+        well, so that the request that lost does not wait forever.
+
+        Only use this with servers whose resumption tokens can be used
+        more than once.
+        """
+        if true_or_false:
+            self._hedger = Hedger(percentile)
+        else:
+            self._hedger = None
+
+    def getBaseURL(self):
+        return self._base_url
+
     def makeRequest(self, **kw):
         """Either load a local XML file or actually retrieve XML from a server.
         """
@@ -316,27 +943,136 @@ class Client(BaseClient):
             with codecs.open(self._base_url, 'r', 'utf-8') as xmlfile:
                 text = xmlfile.read()
             return text.encode('ascii', 'replace')
-        else:
-            # XXX include From header?
-            headers = {'User-Agent': 'pyoai'}
-            if self._credentials is not None:
-                headers['Authorization'] = 'Basic ' + self._credentials.strip()
-            request = urllib2.Request(
-                self._base_url, data=urlencode(kw), headers=headers)
-            return retrieveFromUrlWaiting(request)
+        request = self.buildRequest(**kw)
+        urlopen = self.getUrlOpener()
+        def retrieve(event):
+            return retrieveFromUrlWaiting(request, urlopen=urlopen,
+                                          event=event)
+        if self._hedger is not None:
+            return self._hedger.retrieve(retrieve,
+                                         self.currentRequestEvent())
+        return retrieve(self.currentRequestEvent())
+
+    def makeRequestStream(self, **kw):
+        """Open the response of the server for incremental reading.
+        """
+        if self._local_file:
+            return BaseClient.makeRequestStream(self, **kw)
+        return openUrlWaiting(self.buildRequest(**kw),
+                              urlopen=self.getUrlOpener())
+
+    def getUrlOpener(self):
+        """Return the function to open requests with.
+
+        Responses it opens are decompressed while they are read.
+        """
+        connect_timeout = self._connect_timeout
+        read_timeout = self._read_timeout
+        pool = self._connection_pool
+        def urlopen(request):
+            if pool is not None:
+                return pool.urlopen(request, connect_timeout, read_timeout)
+            if connect_timeout is None and read_timeout is None:
+                return urllib2.urlopen(request)
+            return urllib2.urlopen(request,
+                                   timeout=max(connect_timeout, read_timeout))
+        def openDecompressing(request):
+            return connection.decompressResponse(urlopen(request))
+        return openDecompressing
+
+    def buildRequest(self, **kw):
+        """Create the HTTP request for an OAI-PMH request.
+        """
+        # XXX include From header?
+        headers = {'User-Agent': 'pyoai'}
+        if self._credentials is not None:
+            headers['Authorization'] = 'Basic ' + self._credentials.strip()
+        if self._accept_encodings:
+            headers['Accept-Encoding'] = ', '.join(self._accept_encodings)
+        return urllib2.Request(
+            self._base_url, data=urlencode(kw), headers=headers)
 
 def buildHeader(header_node, namespaces):
-    e = etree.XPathEvaluator(header_node, 
-                            namespaces=namespaces).evaluate
-    identifier = e('string(oai:identifier/text())')
+    return readHeader(header_node, compiledXPaths(namespaces))
+
+def readHeader(header_node, xpaths):
+    """Like buildHeader, with the XPaths for the namespaces at hand.
+    """
+    identifier = xpaths.identifier(header_node)
     datestamp = datestamp_to_datetime(
-        str(e('string(oai:datestamp/text())')))
-    setspec = [str(s) for s in e('oai:setSpec/text()')]
-    deleted = e("@status = 'deleted'") 
+        str(xpaths.datestamp(header_node)))
+    setspec = [str(s) for s in xpaths.setspecs(header_node)]
+    deleted = xpaths.deleted(header_node)
     return common.Header(header_node, identifier, datestamp, setspec, deleted)
 
+def buildRawRecord(record_node, namespaces):
+    xpaths = compiledXPaths(namespaces)
+    header_node = xpaths.record_header(record_node)[0]
+    identifier = xpaths.identifier(header_node)
+    try:
+        identifier = str(identifier)
+    except UnicodeEncodeError:
+        identifier = unicode(identifier)
+    datestamp = datestamp_to_datetime(str(xpaths.datestamp(header_node)))
+    deleted = xpaths.deleted(header_node)
+    metadata_list = xpaths.record_metadata(record_node)
+    element_list = metadata_list and xpaths.metadata_element(metadata_list[0])
+    if element_list:
+        xml = serializeMetadata(element_list[0], namespaces)
+    else:
+        xml = None
+    return identifier, datestamp, deleted, xml
+
+def serializeMetadata(element, namespaces):
+    """Serialize the element of metadata as it is in the page.
+
+    The start tag of a serialized element declares all namespaces in
+    scope, so that it can be parsed on its own. Declarations of the
+    OAI-PMH namespace, which the page has, are left out unless the
+    metadata uses it.
+    """
+    xml = etree.tostring(element, with_tail=False)
+    ns_oai = namespaces['oai']
+    inherited = [prefix for prefix, uri in element.nsmap.items()
+                 if uri == ns_oai]
+    if not inherited or compiledXPaths(namespaces).uses_oai(element):
+        return xml
+    # attribute values are serialized with > escaped
+    end = xml.index('>')
+    start_tag = xml[:end]
+    for prefix in inherited:
+        if prefix is None:
+            declaration = ' xmlns="%s"' % ns_oai
+        else:
+            declaration = ' xmlns:%s="%s"' % (prefix, ns_oai)
+        start_tag = start_tag.replace(declaration, '', 1)
+    return start_tag + xml[end:]
+
+def recordIdentifier(record):
+    """Return the identifier of a record, also one of rawRecords.
+    """
+    if isinstance(record[0], common.Header):
+        return record[0].identifier()
+    # (identifier, datestamp, deleted, xml)
+    return record[0]
+
+def recordDatestamp(record):
+    """Return the datestamp of a record, also one of rawRecords.
+    """
+    if isinstance(record[0], common.Header):
+        return record[0].datestamp()
+    return record[1]
+
+def detachHeader(header):
+    """Return a copy of a header without its element.
+    """
+    return common.Header(None, header.identifier(), header.datestamp(),
+                         header.setSpec(), header.isDeleted())
+
 def ResumptionListGenerator(firstBatch, nextBatch):
     result, token = firstBatch()
+    # firstBatch may refer to the tree of the first page
+    del firstBatch
     while 1:
         itemFound = False
         for item in result:
@@ -346,15 +1082,289 @@ def ResumptionListGenerator(firstBatch, nextBatch):
             break
         result, token = nextBatch(token)
 
+def PrefetchingResumptionListGenerator(firstBatch, nextBatch, depth):
+    """Like ResumptionListGenerator, but retrieves batches ahead of time.
+
+    A worker thread calls nextBatch as soon as a resumption token is
+    known, staying at most depth batches ahead of the consumer.
+    Exceptions raised while retrieving a batch are raised again in the
+    consumer when it reaches that batch.
+    """
+    result, token = firstBatch()
+    del firstBatch
+    batches = Queue.Queue(depth)
+    stop = threading.Event()
+    worker = threading.Thread(target=_prefetchBatches,
+                              args=(nextBatch, result, token, batches, stop))
+    worker.setDaemon(True)
+    worker.start()
+    try:
+        while 1:
+            for item in result:
+                yield item
+            if token is None or not result:
+                break
+            result, token, exc_info = batches.get()
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+    finally:
+        # let the worker go if the consumer stops early
+        stop.set()
+
+def _prefetchBatches(nextBatch, result, token, batches, stop):
+    try:
+        while token is not None and result:
+            result, token = nextBatch(token)
+            if not _putUnlessStopped(batches, (result, token, None), stop):
+                return
+    except:
+        _putUnlessStopped(batches, (None, None, sys.exc_info()), stop)
+
+def _putUnlessStopped(queue, item, stop):
+    while not stop.isSet():
+        try:
+            queue.put(item, True, 0.1)
+            return True
+        except Queue.Full:
+            pass
+    return False
+
+def ParallelPartitionsGenerator(listPartition, partitions, workers,
+                                error_class):
+    """Generate the records of the parts of a harvest, in parallel.
+
+    listPartition returns the records of one of the partitions, which
+    are harvested by at most workers threads. Records are generated in
+    the order they arrive, each identifier only once. Errors are
+    collected per partition and raised as error_class after all other
+    partitions are done.
+    """
+    tasks = Queue.Queue()
+    for partition in partitions:
+        tasks.put(partition)
+    results = Queue.Queue(workers * PARTITION_RECORDS_QUEUED)
+    stop = threading.Event()
+    for i in range(min(workers, len(partitions))):
+        worker = threading.Thread(
+            target=_harvestPartitions,
+            args=(listPartition, tasks, results, stop))
+        worker.setDaemon(True)
+        worker.start()
+    seen = set()
+    failures = {}
+    remaining = len(partitions)
+    try:
+        while remaining:
+            partition, record, exception = results.get()
+            if record is None:
+                # the harvest of this partition is done
+                remaining -= 1
+                if exception is not None:
+                    failures[partition] = exception
+                continue
+            identifier = recordIdentifier(record)
+            if identifier in seen:
+                continue
+            seen.add(identifier)
+            yield record
+    finally:
+        # let the workers go if the consumer stops early
+        stop.set()
+    if failures:
+        raise error_class(failures)
+
+def _harvestPartitions(listPartition, tasks, results, stop):
+    while not stop.isSet():
+        try:
+            partition = tasks.get_nowait()
+        except Queue.Empty:
+            return
+        exception = None
+        try:
+            for record in listPartition(partition):
+                if not _putUnlessStopped(
+                    results, (partition, record, None), stop):
+                    return
+        except error.NoRecordsMatchError:
+            pass
+        except Exception, e:
+            exception = e
+        _putUnlessStopped(results, (partition, None, exception), stop)
+
+def PoolResumptionListGenerator(first_page, nextPage, decode, pages_ahead):
+    """Generate items from pages that are decoded asynchronously.
+
+    first_page and the result of nextPage are (page, token) tuples,
+    with page None if it has no items. decode starts decoding a page
+    and returns an object whose get method returns the list of items.
+    At most pages_ahead pages are being decoded at a time.
+    """
+    page, token = first_page
+    pending = deque()
+    while 1:
+        if page is not None:
+            pending.append(decode(page))
+        else:
+            # an empty page ends the list
+            token = None
+        if token is not None and len(pending) < pages_ahead:
+            page, token = nextPage(token)
+            continue
+        if not pending:
+            break
+        for item in pending.popleft().get():
+            yield item
+        if token is not None:
+            page, token = nextPage(token)
+        else:
+            page = None
+
+def buildRecordsInProcess(xml, metadata_prefix, metadata_registry,
+                          ignore_bad_characters=False, namespaces=None):
+    """Build the records of a ListRecords page in a worker process.
+
+    namespaces - the getNamespaces of the client the page is for, by
+                 default those of BaseClient
+
+    Returns a list of (header, metadata, about) tuples that can be
+    pickled: the elements of headers and metadata are left out.
+    """
+    client = BaseClient(metadata_registry)
+    client.ignoreBadCharacters(ignore_bad_characters)
+    if namespaces is None:
+        namespaces = client.getNamespaces()
+    records, token = client.buildRecords(
+        metadata_prefix, namespaces, metadata_registry,
+        client.parse(xml))
+    result = []
+    for header, metadata, about in records:
+        header = detachHeader(header)
+        if isinstance(metadata, common.Metadata):
+            metadata = common.Metadata(None, metadata.getMap())
+        result.append((header, metadata, about))
+    return result
+
+def StreamingResumptionListGenerator(firstPage, nextPage, build):
+    """Generate items from list pages that are parsed while being read.
+
+    firstPage and nextPage return StreamingPage objects, build turns
+    an item element into the item to generate.
+
+    The first page is started right away, so that errors reported by
+    the server are raised when the request is made, like they are
+    for pages that are parsed as a whole.
+    """
+    page = firstPage()
+    nodes = iter(page)
+    return _streamingResumptionList(page, nodes, next(nodes, None),
+                                    nextPage, build)
+
+def _streamingResumptionList(page, nodes, first_node, nextPage, build):
+    while first_node is not None:
+        yield build(first_node)
+        for node in nodes:
+            yield build(node)
+        if page.token is None:
+            break
+        page = nextPage(page.token)
+        nodes = iter(page)
+        first_node = next(nodes, None)
+
+class StreamingPage(object):
+    """A list response page that is parsed incrementally from a stream.
+
+    Iterating over the page yields the item elements (headers or
+    records) of the page as soon as each is complete. Every item is
+    removed from the page tree before it is yielded, so it is freed
+    once the consumer lets go of it. After iteration the resumption
+    token of the page, or None, is available as the token attribute.
+    """
+    def __init__(self, stream, verb, item_name, request_kw, ns_oai):
+        self._stream = stream
+        self._request_kw = request_kw
+        self._verb_tag = '{%s}%s' % (ns_oai, verb)
+        self._item_tag = '{%s}%s' % (ns_oai, item_name)
+        self._token_tag = '{%s}resumptionToken' % ns_oai
+        self._error_tag = '{%s}error' % ns_oai
+        self.token = None
+
+    def __iter__(self):
+        try:
+            for event, node in etree.iterparse(self._stream,
+                                               events=('end',)):
+                tag = node.tag
+                if tag == self._item_tag:
+                    parent = node.getparent()
+                    if parent.tag == self._verb_tag:
+                        parent.remove(node)
+                        yield node
+                elif tag == self._token_tag:
+                    token = node.text
+                    if token is not None and token.strip() != '':
+                        self.token = token
+                elif tag == self._error_tag:
+                    # XXX like for complete pages, only the first
+                    # error is raised
+                    raiseServerError(node)
+        except etree.XMLSyntaxError:
+            raise error.XMLSyntaxError(self._request_kw)
+        finally:
+            closeStream(self._stream)
+
+def raiseServerError(e_error):
+    """Raise the exception for an oai:error element in a response.
+    """
+    code = e_error.get('code')
+    msg = e_error.text
+    if code not in ['badArgument', 'badResumptionToken',
+                    'badVerb', 'cannotDisseminateFormat',
+                    'idDoesNotExist', 'noRecordsMatch',
+                    'noMetadataFormats', 'noSetHierarchy']:
+        raise error.UnknownError,\
+              "Unknown error code from server: %s, message: %s" % (
+            code, msg)
+    # find exception in error module and raise with msg
+    raise getattr(error, code[0].upper() + code[1:] + 'Error'), msg
+
+def closeStream(stream):
+    close = getattr(stream, 'close', None)
+    if close is not None:
+        close()
+
 def retrieveFromUrlWaiting(request,
-                           wait_max=WAIT_MAX, wait_default=WAIT_DEFAULT):
+                           wait_max=WAIT_MAX, wait_default=WAIT_DEFAULT,
+                           urlopen=None, event=None):
     """Get text from URL, handling 503 Retry-After.
+
+    event - a RequestEvent to record the timing of the request in
+    """
+    f = openUrlWaiting(request, wait_max, wait_default, urlopen, event)
+    if event is not None:
+        start = time.time()
+    text = f.read()
+    f.close()
+    if event is not None:
+        event.download_time = time.time() - start
+    return text
+
+def openUrlWaiting(request, wait_max=WAIT_MAX, wait_default=WAIT_DEFAULT,
+                   urlopen=None, event=None):
+    """Open URL for reading, handling 503 Retry-After.
+
+    wait_max - how often to try at most
+    wait_default - seconds to wait at most when the server does not
+                   say how long to wait, see retryWait
+    urlopen - function to open the request with, urllib2.urlopen
+              by default
+    event - a RequestEvent to record the timing of the request in
     """
+    if urlopen is None:
+        urlopen = urllib2.urlopen
+    waited = 0
     for i in range(wait_max):
+        start = time.time()
         try:
-            f = urllib2.urlopen(request)
-            text = f.read()
-            f.close()
+            f = urlopen(request)
             # we successfully opened without having to wait
             break
         except urllib2.HTTPError, e:
@@ -364,15 +1374,146 @@ def retrieveFromUrlWaiting(request,
                 except TypeError:
                     retryAfter = None
                 if retryAfter is None:
-                    time.sleep(wait_default)
-                else:
-                    time.sleep(retryAfter)
+                    retryAfter = retryWait(i, wait_default)
+                waited += retryAfter
+                if event is not None:
+                    # counted before the wait is over, so that a Hedger
+                    # does not take the wait for a slow server
+                    event.wait_time = waited
+                time.sleep(retryAfter)
             else:
                 # reraise any other HTTP error
                 raise
     else:
         raise Error, "Waited too often (more than %s times)" % wait_max
-    return text
+    if event is not None:
+        event.time_to_first_byte = time.time() - start
+        event.wait_time = waited
+    return f
+
+def retryWait(attempt, wait_default=WAIT_DEFAULT):
+    """Return the seconds to wait before asking a busy server again.
+
+    For servers that answer 503 without a Retry-After header. The wait
+    doubles with every attempt, starting at WAIT_BACKOFF, up to
+    wait_default. A random part of up to half of it is left out, so
+    that harvesters that were turned away together do not all come
+    back together.
+    """
+    wait = min(WAIT_BACKOFF * 2 ** attempt, wait_default)
+    return wait / 2.0 + random.uniform(0, wait / 2.0)
+
+class Hedger(object):
+    """Sends a request again when it is slower than most requests.
+
+    percentile - part of the requests seen a request has to be slower
+                 than to be sent again
+    clock - function returning the current time in seconds, time.time
+            by default
+
+    Remembers how long the last HEDGE_HISTORY requests took. Requests
+    are not hedged until HEDGE_MIN_SAMPLES have been seen. Time spent
+    waiting to ask a busy server (503) again does not count, neither
+    for how long requests take nor for when to hedge a request.
+    """
+    def __init__(self, percentile=HEDGE_PERCENTILE, clock=time.time):
+        self._percentile = percentile
+        self._clock = clock
+        self._durations = deque(maxlen=HEDGE_HISTORY)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """Remember how long a request took.
+        """
+        self._lock.acquire()
+        try:
+            self._durations.append(seconds)
+        finally:
+            self._lock.release()
+
+    def delay(self):
+        """Return the seconds to wait before hedging a request.
+
+        Returns None if not enough requests have been seen yet.
+        """
+        self._lock.acquire()
+        try:
+            durations = sorted(self._durations)
+        finally:
+            self._lock.release()
+        if len(durations) < HEDGE_MIN_SAMPLES:
+            return None
+        index = int(len(durations) * self._percentile + 0.5) - 1
+        return durations[max(0, min(index, len(durations) - 1))]
+
+    def retrieve(self, retrieve, event=None):
+        """Call retrieve, and call it again if it takes too long.
+
+        retrieve - function that retrieves the response, taking the
+                   RequestEvent to record the timing of the request in
+        event - RequestEvent of the request, or None
+
+        Returns the first response retrieved. If the first attempt to
+        finish fails, the other one is waited for; the error of the
+        attempt that failed last is raised if both fail.
+        """
+        clock = self._clock
+        delay = self.delay()
+        if delay is None:
+            if event is None:
+                event = RequestEvent(None, None)
+            start = clock()
+            result = retrieve(event)
+            self.record(clock() - start - (event.wait_time or 0))
+            return result
+        results = Queue.Queue()
+        def attempt(attempt_event):
+            start = clock()
+            try:
+                result = retrieve(attempt_event)
+            except:
+                results.put((False, sys.exc_info(), attempt_event))
+                return
+            self.record(clock() - start - (attempt_event.wait_time or 0))
+            results.put((True, result, attempt_event))
+        def startAttempt():
+            if event is not None:
+                attempt_event = RequestEvent(event.verb, event.arguments)
+            else:
+                attempt_event = RequestEvent(None, None)
+            thread = threading.Thread(target=attempt, args=(attempt_event,))
+            thread.setDaemon(True)
+            thread.start()
+            return attempt_event
+        deadline = clock() + delay
+        first_event = startAttempt()
+        while 1:
+            # the deadline moves on while the server makes us wait; the
+            # wait is set before the time it takes passes, so read the
+            # time first
+            now = clock()
+            timeout = deadline + (first_event.wait_time or 0) - now
+            if timeout <= 0:
+                break
+            try:
+                success, result, attempt_event = results.get(True, timeout)
+                break
+            except Queue.Empty:
+                pass
+        if timeout <= 0:
+            if event is not None:
+                event.hedged = True
+            startAttempt()
+            success, result, attempt_event = results.get()
+            if not success:
+                success, result, attempt_event = results.get()
+        if event is not None:
+            event.time_to_first_byte = attempt_event.time_to_first_byte
+            event.download_time = attempt_event.download_time
+            event.wait_time = attempt_event.wait_time
+        if not success:
+            raise result[0], result[1], result[2]
+        return result
 
 class ServerClient(BaseClient):
     def __init__(self, server, metadata_registry=None):
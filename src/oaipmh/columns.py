@@ -0,0 +1,181 @@
+"""Harvest headers into columns of NumPy arrays.
+
+This module needs NumPy, which pyoai does not require otherwise; it can
+be installed with the 'numpy' extra.
+"""
+import numpy
+
+from oaipmh.common import HeaderBatch
+
+# rows the columns can hold at first, they double in size when needed
+INITIAL_ROWS = 1024
+
+class HeaderColumns(object):
+    """The headers of a harvest as columns.
+
+    identifiers - array of identifiers, of objects unless another
+                  dtype was asked for
+    datestamps - datetime64[s] array of datestamps
+    deleted - bool array, True for deleted records
+    sets - list of the setSpecs found
+    set_rows, set_indexes - set membership as a sparse index: header
+        set_rows[i] is in set sets[set_indexes[i]]. Together they are
+        the coordinates of a sparse (header, set) matrix.
+    """
+    def __init__(self, identifiers, datestamps, deleted, sets,
+                 set_rows, set_indexes):
+        self.identifiers = identifiers
+        self.datestamps = datestamps
+        self.deleted = deleted
+        self.sets = sets
+        self.set_rows = set_rows
+        self.set_indexes = set_indexes
+
+    def __len__(self):
+        return len(self.identifiers)
+
+def listIdentifierColumns(client, identifier_dtype=object, **kw):
+    """Harvest ListIdentifiers into HeaderColumns.
+
+    client - the client to harvest with
+    identifier_dtype - NumPy dtype to keep identifiers as, for instance
+                       'S64' for fixed width byte strings, which hold
+                       identifiers encoded as UTF-8, or 'U64' for
+                       fixed width unicode strings; longer identifiers
+                       are cut off
+    kw - arguments of the ListIdentifiers request
+
+    The columns are filled a page at a time. This is much faster if
+    the client keeps pages as HeaderBatch objects (see
+    BaseClient.compactHeaders), as other pages have to be put in one
+    first.
+    """
+    builder = ColumnsBuilder(identifier_dtype)
+    for headers, token in client.listBatches('ListIdentifiers', **kw):
+        builder.addPage(headers)
+    return builder.columns()
+
+def headerColumns(headers, identifier_dtype=object):
+    """Turn a sequence of headers, or a HeaderBatch, into HeaderColumns.
+    """
+    builder = ColumnsBuilder(identifier_dtype)
+    builder.addPage(headers)
+    return builder.columns()
+
+class ColumnsBuilder(object):
+    """Fills columns page by page.
+
+    The arrays are allocated ahead and double in size when they are
+    full. Pages are copied into them from the arrays of a HeaderBatch
+    (see BaseClient.compactHeaders) with whole-array operations; only
+    identifiers are still sliced out one by one, as they differ in
+    length. Pages of Header objects are put in a HeaderBatch first.
+    """
+    def __init__(self, identifier_dtype=object):
+        self._rows = 0
+        self._identifiers = numpy.empty(INITIAL_ROWS, identifier_dtype)
+        # byte strings can not hold unicode that is not ASCII, so they
+        # keep the UTF-8 of the batch
+        self._encode = self._identifiers.dtype.kind == 'S'
+        self._seconds = numpy.empty(INITIAL_ROWS, numpy.int64)
+        self._deleted = numpy.empty(INITIAL_ROWS, numpy.bool_)
+        self._sets = []
+        self._set_index = {}
+        self._memberships = 0
+        self._set_rows = numpy.empty(INITIAL_ROWS, numpy.int64)
+        self._set_indexes = numpy.empty(INITIAL_ROWS, numpy.int32)
+
+    def addPage(self, headers):
+        if not isinstance(headers, HeaderBatch):
+            headers = HeaderBatch(headers)
+        count = len(headers)
+        if not count:
+            return
+        (identifier_bytes, offsets, datestamps, deleted,
+         setspec_indexes, setspecs) = headers.arrays()
+        self._reserve(self._rows + count)
+        start = self._rows
+        end = start + count
+        data = identifier_bytes.tostring()
+        identifiers = [data[offsets[i]:offsets[i + 1]]
+                       for i in xrange(count)]
+        if not self._encode:
+            try:
+                data.decode('ascii')
+            except UnicodeDecodeError:
+                identifiers = [identifier.decode('UTF-8')
+                               for identifier in identifiers]
+        self._identifiers[start:end] = identifiers
+        self._seconds[start:end] = numpy.frombuffer(datestamps,
+                                                    numpy.dtype('l'))
+        self._deleted[start:end] = numpy.frombuffer(deleted, numpy.int8)
+        self._addMemberships(
+            start, numpy.frombuffer(setspec_indexes, numpy.dtype('l')),
+            setspecs)
+        self._rows = end
+
+    def columns(self):
+        rows = self._rows
+        memberships = self._memberships
+        return HeaderColumns(
+            self._identifiers[:rows].copy(),
+            self._seconds[:rows].astype('datetime64[s]'),
+            self._deleted[:rows].copy(),
+            list(self._sets),
+            self._set_rows[:memberships].copy(),
+            self._set_indexes[:memberships].copy())
+
+    def _addMemberships(self, start, setspec_indexes, setspecs):
+        # the indexes in self._sets of each distinct list of setSpecs,
+        # one after another
+        flat = []
+        list_starts = []
+        for setspec in setspecs:
+            list_starts.append(len(flat))
+            for spec in setspec:
+                index = self._set_index.get(spec)
+                if index is None:
+                    index = self._set_index[spec] = len(self._sets)
+                    self._sets.append(spec)
+                flat.append(index)
+        if not flat:
+            return
+        flat = numpy.array(flat, numpy.int32)
+        lengths = numpy.array([len(setspec) for setspec in setspecs],
+                              numpy.int64)
+        # how many sets each row is in, and where its sets are in flat
+        row_lengths = lengths[setspec_indexes]
+        row_starts = numpy.array(list_starts, numpy.int64)[setspec_indexes]
+        total = int(row_lengths.sum())
+        # the position of each membership among those of its row
+        ends = numpy.cumsum(row_lengths)
+        within = (numpy.arange(total) -
+                  numpy.repeat(ends - row_lengths, row_lengths))
+        memberships = self._memberships
+        needed = memberships + total
+        if needed > len(self._set_rows):
+            capacity = len(self._set_rows)
+            while capacity < needed:
+                capacity *= 2
+            self._set_rows = _grown(self._set_rows, capacity)
+            self._set_indexes = _grown(self._set_indexes, capacity)
+        self._set_rows[memberships:needed] = numpy.repeat(
+            numpy.arange(start, start + len(setspec_indexes)), row_lengths)
+        self._set_indexes[memberships:needed] = flat[
+            numpy.repeat(row_starts, row_lengths) + within]
+        self._memberships = needed
+
+    def _reserve(self, rows):
+        capacity = len(self._seconds)
+        if rows <= capacity:
+            return
+        while capacity < rows:
+            capacity *= 2
+        self._identifiers = _grown(self._identifiers, capacity)
+        self._seconds = _grown(self._seconds, capacity)
+        self._deleted = _grown(self._deleted, capacity)
+
+def _grown(column, capacity):
+    result = numpy.empty(capacity, column.dtype)
+    result[:len(column)] = column
+    return result
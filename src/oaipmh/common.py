@@ -1,8 +1,13 @@
 import pkg_resources
+from array import array
+from datetime import datetime, timedelta
 
 from oaipmh import error
 
 class Header(object):
+    __slots__ = ('_element', '_identifier', '_datestamp', '_setspec',
+                 '_deleted')
+
     def __init__(self, element, identifier, datestamp, setspec, deleted):
         self._element = element
         # force identifier to be a string, it might be 
@@ -30,7 +35,116 @@ class Header(object):
     def isDeleted(self):
         return self._deleted
 
+    def __getstate__(self):
+        return (self._element, self._identifier, self._datestamp,
+                self._setspec, self._deleted)
+
+    def __setstate__(self, state):
+        (self._element, self._identifier, self._datestamp,
+         self._setspec, self._deleted) = state
+
+# header batches keep datestamps as seconds since this time
+EPOCH = datetime(1970, 1, 1)
+
+class HeaderBatch(object):
+    """A list of headers kept in parallel arrays.
+
+    Identifiers are kept as UTF-8 in a single character array,
+    datestamps as seconds since the epoch and deleted flags as bytes.
+    Each distinct list of setSpecs is kept once, and headers refer to
+    it by index. This takes a fraction of the memory of Header
+    objects, so many more headers can be kept.
+
+    Indexing or iterating over a batch gives Header objects without
+    element, created when they are asked for. The values of a single
+    header can also be read without creating one, using identifier,
+    datestamp, setSpec and isDeleted with the index of the header.
+    """
+    def __init__(self, headers=()):
+        self._identifiers = array('c')
+        self._offsets = array('l', [0])
+        self._datestamps = array('l')
+        self._deleted = array('b')
+        self._setspec_indexes = array('l')
+        self._setspecs = []
+        self._setspec_index = {}
+        self.extend(headers)
+
+    def append(self, header):
+        self.add(header.identifier(), header.datestamp(), header.setSpec(),
+                 header.isDeleted())
+
+    def add(self, identifier, datestamp, setspec, deleted):
+        """Add a header by its values.
+        """
+        if isinstance(identifier, unicode):
+            identifier = identifier.encode('UTF-8')
+        self._identifiers.fromstring(identifier)
+        self._offsets.append(len(self._identifiers))
+        delta = datestamp - EPOCH
+        self._datestamps.append(delta.days * 86400 + delta.seconds)
+        self._deleted.append(bool(deleted))
+        setspec = tuple(setspec)
+        index = self._setspec_index.get(setspec)
+        if index is None:
+            index = self._setspec_index[setspec] = len(self._setspecs)
+            self._setspecs.append([intern(str(spec)) for spec in setspec])
+        self._setspec_indexes.append(index)
+
+    def extend(self, headers):
+        for header in headers:
+            self.append(header)
+
+    def arrays(self):
+        """Return the arrays the headers are kept in, not copies of them.
+
+        Returns (identifiers, offsets, datestamps, deleted,
+        setspec_indexes, setspecs). identifiers holds the UTF-8 encoded
+        identifiers one after another, that of header i running from
+        offsets[i] to offsets[i + 1]. datestamps are seconds since
+        EPOCH and deleted holds 1 for deleted headers. setspecs is the
+        list of distinct lists of setSpecs, and setspec_indexes gives
+        the one of each header.
+        """
+        return (self._identifiers, self._offsets, self._datestamps,
+                self._deleted, self._setspec_indexes, self._setspecs)
+
+    def identifier(self, index):
+        identifier = self._identifiers[
+            self._offsets[index]:self._offsets[index + 1]].tostring()
+        try:
+            identifier.decode('ascii')
+        except UnicodeDecodeError:
+            return identifier.decode('UTF-8')
+        return identifier
+
+    def datestamp(self, index):
+        return EPOCH + timedelta(seconds=self._datestamps[index])
+
+    def setSpec(self, index):
+        return list(self._setspecs[self._setspec_indexes[index]])
+
+    def isDeleted(self, index):
+        return bool(self._deleted[index])
+
+    def __len__(self):
+        return len(self._datestamps)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return Header(None, self.identifier(index), self.datestamp(index),
+                      self.setSpec(index), self.isDeleted(index))
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
 class Metadata(object):
+    __slots__ = ('_element', '_map')
+
     def __init__(self, element, map):
         self._element = element
         self._map = map
@@ -46,6 +160,12 @@ class Metadata(object):
 
     __getitem__ = getField
 
+    def __getstate__(self):
+        return (self._element, self._map)
+
+    def __setstate__(self, state):
+        self._element, self._map = state
+
 class Identify(object):
     def __init__(self, repositoryName, baseURL, protocolVersion, adminEmails,
                  earliestDatestamp, deletedRecord, granularity, compression,
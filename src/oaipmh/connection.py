@@ -0,0 +1,253 @@
+"""HTTP transport helpers for the client.
+
+urllib2 opens a new connection, and for HTTPS does a new handshake, for
+every request. A harvest consists of many requests to the same host, so
+a ConnectionPool keeps connections open and reuses them for the next
+request to that host.
+
+Responses compressed with one of the content codings OAI-PMH allows
+are decompressed while they are read by DecompressingResponse.
+"""
+import httplib
+import socket
+import threading
+import urllib2
+import zlib
+from StringIO import StringIO
+
+class ConnectionPool(object):
+    """A pool of keep-alive HTTP connections, kept per host.
+
+    A connection is taken from the pool for the duration of a request,
+    and goes back once its response has been read completely, so
+    several threads and several clients can share a pool.
+
+    The urlopen method can be used instead of urllib2.urlopen. Unlike
+    urllib2 it does not follow redirects or use proxies.
+    """
+    def __init__(self, max_idle=4):
+        self._max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def urlopen(self, request, connect_timeout=None, read_timeout=None):
+        """Send a urllib2.Request over a pooled connection.
+
+        connect_timeout - seconds to wait for a new connection at most
+        read_timeout - seconds to wait for the server to send anything
+                       at most, while waiting for the response and
+                       while reading it
+
+        Returns a file-like response like urllib2.urlopen does, and like
+        it raises urllib2.HTTPError if the server does not answer with
+        a success status. Raises socket.timeout when a timeout passes.
+        """
+        key = (request.get_type(), request.get_host())
+        headers = dict(request.header_items())
+        data = request.get_data()
+        if data is not None:
+            headers.setdefault('Content-Type',
+                               'application/x-www-form-urlencoded')
+        args = (request.get_method(), request.get_selector(), data, headers)
+        timeouts = (connect_timeout, read_timeout)
+        connection, reused = self._acquire(key)
+        try:
+            response = self._send(connection, args, timeouts)
+        except socket.timeout:
+            # a slow server is not a dropped connection, don't try again
+            connection.close()
+            raise
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if not reused:
+                raise
+            # the server dropped the idle connection, try a fresh one
+            connection = self._connect(key)
+            try:
+                response = self._send(connection, args, timeouts)
+            except:
+                connection.close()
+                raise
+        pooled = PooledResponse(self, key, connection, response)
+        if not 200 <= response.status < 300:
+            # read the body so the connection can be used again
+            body = pooled.read()
+            pooled.close()
+            raise urllib2.HTTPError(request.get_full_url(), response.status,
+                                    response.reason, response.msg,
+                                    StringIO(body))
+        return pooled
+
+    def close(self):
+        """Close all idle connections.
+        """
+        self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = {}
+        finally:
+            self._lock.release()
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def release(self, key, connection):
+        """Put a connection that is done with its response back.
+        """
+        self._lock.acquire()
+        try:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self._max_idle:
+                connections.append(connection)
+                return
+        finally:
+            self._lock.release()
+        connection.close()
+
+    def _acquire(self, key):
+        self._lock.acquire()
+        try:
+            connections = self._idle.get(key)
+            if connections:
+                return connections.pop(), True
+        finally:
+            self._lock.release()
+        return self._connect(key), False
+
+    def _connect(self, key):
+        scheme, host = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host)
+        elif scheme == 'http':
+            return httplib.HTTPConnection(host)
+        raise urllib2.URLError('unknown url type: %s' % scheme)
+
+    def _send(self, connection, args, timeouts):
+        connect_timeout, read_timeout = timeouts
+        if connection.sock is None:
+            if connect_timeout is not None:
+                connection.timeout = connect_timeout
+            connection.connect()
+        if read_timeout is None:
+            read_timeout = socket.getdefaulttimeout()
+        # set every time, a pooled connection still has the timeout of
+        # the request it was used for before
+        connection.sock.settimeout(read_timeout)
+        connection.request(*args)
+        return connection.getresponse()
+
+class PooledResponse(object):
+    """A file-like HTTP response on a pooled connection.
+
+    The connection goes back to the pool as soon as the response has
+    been read to the end. Closing a response that has not been read
+    completely closes its connection instead.
+    """
+    def __init__(self, pool, key, connection, response):
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self.code = response.status
+        self.msg = response.reason
+
+    def read(self, amt=None):
+        if self._connection is None:
+            return ''
+        if amt is None:
+            data = self._response.read()
+        else:
+            data = self._response.read(amt)
+        if self._response.isclosed():
+            self._done()
+        return data
+
+    def info(self):
+        return self._response.msg
+
+    def close(self):
+        if self._connection is None:
+            return
+        if self._response.isclosed():
+            self._done()
+        else:
+            self._connection.close()
+            self._connection = None
+
+    def _done(self):
+        connection = self._connection
+        self._connection = None
+        if self._response.will_close:
+            connection.close()
+        else:
+            self._pool.release(self._key, connection)
+
+# content codings we can decompress, in order of preference
+SUPPORTED_ENCODINGS = ['gzip', 'deflate']
+
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+def decompressResponse(response):
+    """Wrap a response so that its content coding is undone when read.
+
+    Responses that are not compressed are returned as they are.
+    """
+    encoding = response.info().get('Content-Encoding', 'identity')
+    encoding = encoding.strip().lower()
+    if encoding in SUPPORTED_ENCODINGS:
+        return DecompressingResponse(response, encoding)
+    return response
+
+class DecompressingResponse(object):
+    """A file-like response that decompresses its data while it is read.
+
+    Supports the gzip and deflate content codings. deflate is meant to
+    be zlib-wrapped, but as some servers send raw deflate data both
+    are accepted.
+    """
+    def __init__(self, response, encoding):
+        self._response = response
+        self._encoding = encoding
+        if encoding == 'gzip':
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+        self._started = False
+        self._buffer = ''
+        self._eof = False
+        self.code = getattr(response, 'code', None)
+        self.msg = getattr(response, 'msg', None)
+
+    def read(self, amt=None):
+        if amt is None or amt < 0:
+            chunks = [self._buffer]
+            while not self._eof:
+                chunks.append(self._decompressNext())
+            self._buffer = ''
+            return ''.join(chunks)
+        while len(self._buffer) < amt and not self._eof:
+            self._buffer += self._decompressNext()
+        data = self._buffer[:amt]
+        self._buffer = self._buffer[amt:]
+        return data
+
+    def info(self):
+        return self._response.info()
+
+    def close(self):
+        self._response.close()
+
+    def _decompressNext(self):
+        chunk = self._response.read(DECOMPRESS_CHUNK_SIZE)
+        if not chunk:
+            self._eof = True
+            return self._decompressor.flush()
+        if self._started or self._encoding != 'deflate':
+            return self._decompressor.decompress(chunk)
+        self._started = True
+        try:
+            return self._decompressor.decompress(chunk)
+        except zlib.error:
+            # raw deflate data without zlib header
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decompressor.decompress(chunk)
@@ -79,3 +79,37 @@ def tolerant_datestamp_to_datetime(datestamp):
         raise DatestampError(datestamp)
     return datetime.datetime(
         int(YYYY), int(MM), int(DD), int(hh), int(mm), int(ss))
+
+def split_datetime_range(start, end, count, day_granularity=False):
+    """Split the range from start up to and including end into windows.
+
+    Returns a list of at most count (from_, until) tuples. They are
+    meant for the inclusive from and until arguments of OAI-PMH, so
+    the windows are aligned to the granularity: every datestamp in the
+    range is in exactly one window.
+    """
+    if day_granularity:
+        unit = datetime.timedelta(days=1)
+        start = datetime.datetime.combine(start.date(), datetime.time(0))
+        end = datetime.datetime.combine(end.date(), datetime.time(0))
+    else:
+        unit = datetime.timedelta(seconds=1)
+        start = start.replace(microsecond=0)
+        end = end.replace(microsecond=0)
+    if end < start:
+        return [(start, end)]
+    units = _units(end - start, unit) + 1
+    count = max(1, min(count, units))
+    # round up, so that count windows cover all units
+    span = unit * ((units + count - 1) // count)
+    result = []
+    from_ = start
+    while from_ <= end:
+        until = min(from_ + span - unit, end)
+        result.append((from_, until))
+        from_ = until + unit
+    return result
+
+def _units(delta, unit):
+    return int((delta.days * 86400 + delta.seconds) //
+               (unit.days * 86400 + unit.seconds))
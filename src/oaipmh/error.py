@@ -59,3 +59,35 @@ class DatestampError(ClientError):
     def details(self):
         return ("An illegal datestamp was encountered: %s" % self.datestamp)
     
+
+class PartialHarvestError(ClientError):
+    """Harvesting some parts of a harvest that was split up failed,
+    while the other parts succeeded.
+    """
+    def __init__(self, failures):
+        # maps each failed part to the exception harvesting it raised
+        self.failures = failures
+
+    def details(self):
+        return ("Harvesting these parts failed: %s" %
+                ', '.join([str(part) for part in sorted(self.failures)]))
+
+class SetHarvestError(PartialHarvestError):
+    """Harvesting one or more sets failed, while other sets succeeded.
+
+    The failures are keyed by setSpec.
+    """
+    def details(self):
+        return ("Harvesting these sets failed: %s" %
+                ', '.join(sorted(self.failures.keys())))
+
+class WindowHarvestError(PartialHarvestError):
+    """Harvesting one or more datestamp windows failed, while other
+    windows succeeded.
+
+    The failures are keyed by (from_, until) tuples.
+    """
+    def details(self):
+        return ("Harvesting these datestamp windows failed: %s" %
+                ', '.join(['%s - %s' % window
+                           for window in sorted(self.failures)]))
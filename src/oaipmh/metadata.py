@@ -1,3 +1,4 @@
+import re
 from lxml import etree
 from lxml.etree import SubElement
 from oaipmh import common
@@ -49,39 +50,120 @@ global_metadata_registry = MetadataRegistry()
 class Error(Exception):
     pass
 
+# an XPath step selecting child elements by (prefixed) name
+_child_step = re.compile(r'^(?:([A-Za-z_][\w.-]*):)?([A-Za-z_][\w.-]*)$')
+
 class MetadataReader(object):
     """A default implementation of a reader based on fields.
+
+    The field expressions are compiled once, when the reader is
+    created. List fields that select the text of child elements, like
+    'oai_dc:dc/dc:title/text()', are not evaluated as XPath at all:
+    all of them are collected in a single walk over the children.
     """
     def __init__(self, fields, namespaces=None):
         self._fields = fields
         self._namespaces = namespaces or {}
+        # parent path -> child tag -> list of (field_name, field_type)
+        self._child_fields = {}
+        # list of (field_name, field_type, compiled expression)
+        self._xpath_fields = []
+        for field_name, (field_type, expr) in fields.items():
+            path = None
+            if field_type in ['bytesList', 'textList']:
+                path = self._childTextPath(expr)
+            if path is None:
+                self._xpath_fields.append(
+                    (field_name, field_type,
+                     etree.XPath(expr, namespaces=self._namespaces)))
+                continue
+            parent_path, tag = path[:-1], path[-1]
+            self._child_fields.setdefault(parent_path, {}).setdefault(
+                tag, []).append((field_name, field_type))
+
+    def __getstate__(self):
+        # compiled expressions can not be pickled, they are compiled
+        # again when unpickling
+        return {'fields': self._fields, 'namespaces': self._namespaces}
+
+    def __setstate__(self, state):
+        self.__init__(state['fields'], state['namespaces'])
+
+    def _childTextPath(self, expr):
+        """Get the tags of a 'a/b/text()' expression as a tuple.
+
+        Returns None if the expression is not of that form.
+        """
+        steps = expr.split('/')
+        if len(steps) < 2 or steps[-1] != 'text()':
+            return None
+        path = []
+        for step in steps[:-1]:
+            match = _child_step.match(step)
+            if match is None:
+                return None
+            prefix, name = match.groups()
+            if prefix is None:
+                path.append(name)
+            elif prefix in self._namespaces:
+                path.append('{%s}%s' % (self._namespaces[prefix], name))
+            else:
+                return None
+        return tuple(path)
 
     def __call__(self, element):
         map = {}
-        # create XPathEvaluator for this element
-        xpath_evaluator = etree.XPathEvaluator(element, 
-                                               namespaces=self._namespaces)
-        
-        e = xpath_evaluator.evaluate
+        # collect the text of the child elements we're interested in
+        for parent_path, tag_fields in self._child_fields.items():
+            texts = {}
+            for tag in tag_fields:
+                texts[tag] = []
+            for parent in _childrenByPath(element, parent_path):
+                for child in parent:
+                    values = texts.get(child.tag)
+                    if values is None:
+                        continue
+                    # the text nodes directly inside the child
+                    if child.text is not None:
+                        values.append(child.text)
+                    for grandchild in child:
+                        if grandchild.tail is not None:
+                            values.append(grandchild.tail)
+            for tag, fields in tag_fields.items():
+                for field_name, field_type in fields:
+                    if field_type == 'bytesList':
+                        value = [str(item) for item in texts[tag]]
+                    else:
+                        value = [unicode(v) for v in texts[tag]]
+                    map[field_name] = value
         # now extra field info according to xpath expr
-        for field_name, (field_type, expr) in self._fields.items():
+        for field_name, field_type, e in self._xpath_fields:
             if field_type == 'bytes':
-                value = str(e(expr))
+                value = str(e(element))
             elif field_type == 'bytesList':
-                value = [str(item) for item in e(expr)]
+                value = [str(item) for item in e(element)]
             elif field_type == 'text':
                 # make sure we get back unicode strings instead
                 # of lxml.etree._ElementUnicodeResult objects.
-                value = unicode(e(expr))
+                value = unicode(e(element))
             elif field_type == 'textList':
                 # make sure we get back unicode strings instead
                 # of lxml.etree._ElementUnicodeResult objects.
-                value = [unicode(v) for v in e(expr)]
+                value = [unicode(v) for v in e(element)]
             else:
                 raise Error, "Unknown field type: %s" % field_type
             map[field_name] = value
         return common.Metadata(element, map)
 
+def _childrenByPath(element, path):
+    """Get the elements a path of child steps leads to, in document order.
+    """
+    nodes = [element]
+    for tag in path:
+        nodes = [child for node in nodes for child in node
+                 if child.tag == tag]
+    return nodes
+
 oai_dc_reader = MetadataReader(
     fields={
     'title':       ('textList', 'oai_dc:dc/dc:title/text()'),
@@ -0,0 +1,143 @@
+"""Harvesting from recorded responses.
+
+A recording is a directory with a response page per file, and a
+mapping.txt file that maps requests to the files holding their
+responses: for every request a line with its arguments, urlencoded in
+sorted order, followed by a line with the name of the file. This is the
+format used by the test suite.
+
+A ReplayClient answers requests from a recording without a server. The
+files are memory-mapped, so a recording can be much larger than the
+available memory, and is read by the operating system as it is used.
+"""
+import os
+import mmap
+import threading
+from urllib import urlencode
+
+from oaipmh import client
+
+class Error(Exception):
+    pass
+
+def requestKey(kw):
+    """Return the key a request is recorded under.
+    """
+    items = kw.items()
+    items.sort()
+    return urlencode(items)
+
+class Recording(object):
+    """The responses in a recording directory, memory-mapped.
+
+    Files are mapped when they are first asked for, and stay mapped
+    until the recording is closed.
+    """
+    def __init__(self, directory):
+        self._directory = directory
+        self._filenames = readMapping(directory)
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    def response(self, kw):
+        """Return the mapped response to a request.
+
+        Raises Error if there is no response for it in the recording.
+        """
+        filename = self._filenames.get(requestKey(kw))
+        if filename is None:
+            raise Error, "No response recorded for %s" % requestKey(kw)
+        self._lock.acquire()
+        try:
+            page = self._maps.get(filename)
+            if page is None:
+                page = self._maps[filename] = mapFile(
+                    os.path.join(self._directory, filename))
+            return page
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            maps = self._maps
+            self._maps = {}
+        finally:
+            self._lock.release()
+        for page in maps.values():
+            if isinstance(page, mmap.mmap):
+                page.close()
+
+class ReplayClient(client.BaseClient):
+    """A client that answers requests from a recording.
+
+    directory - the directory of the recording
+
+    Responses are handed to the parser as they are stored, in their
+    own encoding. lxml only parses strings, so the bytes are copied out
+    of the mapped file: streamed pages (see streamRecords) a chunk at a
+    time, so that a page is never in memory whole, other pages whole.
+    """
+    def __init__(self, directory, metadata_registry=None):
+        client.BaseClient.__init__(self, metadata_registry)
+        self._recording = Recording(directory)
+
+    def makeRequest(self, **kw):
+        return self._recording.response(kw)[:]
+
+    def makeRequestStream(self, **kw):
+        return MappedResponse(self._recording.response(kw))
+
+    def close(self):
+        """Unmap the files of the recording.
+        """
+        self._recording.close()
+
+class MappedResponse(object):
+    """A file-like object reading a mapped response.
+
+    Each response has its own position, so a mapping can be read by
+    several responses at the same time. read returns copies of the
+    bytes read.
+    """
+    def __init__(self, page):
+        self._page = page
+        self._position = 0
+
+    def read(self, amt=None):
+        start = self._position
+        if amt is None or amt < 0:
+            end = len(self._page)
+        else:
+            end = min(start + amt, len(self._page))
+        self._position = end
+        return self._page[start:end]
+
+    def close(self):
+        pass
+
+def readMapping(directory):
+    """Read the mapping.txt of a recording into a dictionary.
+    """
+    f = open(os.path.join(directory, 'mapping.txt'), 'r')
+    try:
+        lines = [line.strip() for line in f]
+    finally:
+        f.close()
+    result = {}
+    for i in range(0, len(lines) - 1, 2):
+        request, filename = lines[i], lines[i + 1]
+        if not request or not filename:
+            break
+        result[request] = filename
+    return result
+
+def mapFile(path):
+    f = open(path, 'rb')
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            # empty files can not be mapped
+            return ''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
@@ -2,7 +2,9 @@ from lxml.etree import ElementTree, Element, SubElement
 from lxml import etree
 from datetime import datetime
 from urllib import quote, unquote, urlencode
-import sys, cgi
+from itertools import chain, islice
+from collections import OrderedDict
+import sys, cgi, time, threading, uuid
 
 from oaipmh import common, metadata, validation, error
 from oaipmh.datestamp import datestamp_to_datetime, datetime_to_datestamp, DatestampError
@@ -16,6 +18,18 @@ NSMAP = {
     None: NS_OAIPMH,
     }
 
+# bytes of a streamed response to collect before handing them on
+STREAM_CHUNK_SIZE = 16 * 1024
+STREAM_MARKER = 'oaipmh-stream-items'
+
+# verbs whose responses can be streamed item by item
+STREAMED_VERBS = ['ListIdentifiers', 'ListRecords', 'ListSets']
+
+# seconds a resumption session is kept after it was last used
+SESSION_TTL = 60 * 60
+# items kept in all resumption sessions together at most
+SESSION_MAX_ITEMS = 100000
+
 class XMLTreeServer(object):
     """A server that responds to messages by returning XML trees.
 
@@ -23,8 +37,13 @@ class XMLTreeServer(object):
     to the outside world.
 
     Takes a server object conforming to the ResumptionOAIPMH interface.
+
+    Every response includes the base URL from Identify. If identify_ttl
+    is given, the Identify of the server is kept for that many seconds
+    instead of asking the server for it for every response.
     """
-    def __init__(self, server, metadata_registry, nsmap=None):
+    def __init__(self, server, metadata_registry, nsmap=None,
+                 identify_ttl=None):
         if nsmap is None:
             nsmap = {}
         self._nsmap = NSMAP.copy()
@@ -32,7 +51,29 @@ class XMLTreeServer(object):
         self._server = server
         self._metadata_registry = (
             metadata_registry or metadata.global_metadata_registry)
-        
+        self._identify_ttl = identify_ttl
+        # (identify, time it expires), replaced as a whole so that
+        # threads always see a consistent pair
+        self._identify_cache = None
+
+    def getIdentify(self):
+        """Get the Identify of the server, from the cache if it is kept.
+        """
+        if self._identify_ttl is None:
+            return self._server.identify()
+        cache = self._identify_cache
+        now = time.time()
+        if cache is not None and now < cache[1]:
+            return cache[0]
+        identify = self._server.identify()
+        self._identify_cache = identify, now + self._identify_ttl
+        return identify
+
+    def invalidateIdentify(self):
+        """Forget the kept Identify, so the server is asked again.
+        """
+        self._identify_cache = None
+
     def getRecord(self, **kw):
         envelope, e_getRecord = self._outputEnvelope(
             verb='GetRecord', **kw)
@@ -53,7 +94,7 @@ class XMLTreeServer(object):
         
     def identify(self):
         envelope, e_identify = self._outputEnvelope(verb='Identify')
-        identify = self._server.identify()
+        identify = self.getIdentify()
         e_repositoryName = SubElement(e_identify, nsoai('repositoryName'))
         e_repositoryName.text = identify.repositoryName()
         e_baseURL = SubElement(e_identify, nsoai('baseURL'))
@@ -119,12 +160,8 @@ class XMLTreeServer(object):
             verb="ListRecords", **kw)
         def outputFunc(element, records, token_kw):
             metadataPrefix = token_kw['metadataPrefix']
-            for header, metadata, about in records:
-                e_record = SubElement(e_listRecords, nsoai('record'))
-                self._outputHeader(e_record, header)
-                if not header.isDeleted():
-                    self._outputMetadata(e_record, metadataPrefix, metadata)
-                # XXX about
+            for record in records:
+                self._outputRecord(element, metadataPrefix, record)
         self._outputResuming(
             e_listRecords,
             self._server.listRecords,
@@ -136,13 +173,8 @@ class XMLTreeServer(object):
         envelope, e_listSets = self._outputEnvelope(
             verb='ListSets', **kw)
         def outputFunc(element, sets, token_kw):
-            for setSpec, setName, setDescription in sets:
-                e_set = SubElement(e_listSets, nsoai('set'))
-                e_setSpec = SubElement(e_set, nsoai('setSpec'))
-                e_setSpec.text = setSpec
-                e_setName = SubElement(e_set, nsoai('setName'))
-                e_setName.text = setName
-                # XXX ignore setDescription
+            for set in sets:
+                self._outputSet(element, set)
         self._outputResuming(
             e_listSets,
             self._server.listSets,
@@ -150,6 +182,49 @@ class XMLTreeServer(object):
             kw)
         return envelope
 
+    def listStream(self, verb, **kw):
+        """Get a list response as its envelope and the elements of its items.
+
+        For ListIdentifiers, ListRecords and ListSets. Returns the
+        envelope tree, the empty element of the verb in it, and an
+        iterator over the elements that go in there: the headers,
+        records or sets, and the resumption token if there is one.
+        Each element is only built when the iterator gets to it.
+
+        The repository is asked for the items before this returns, so
+        its errors are raised here.
+        """
+        envelope, e_list = self._outputEnvelope(verb=verb, **kw)
+        if verb == 'ListIdentifiers':
+            input_func = self._server.listIdentifiers
+            def outputFunc(element, header, token_kw):
+                self._outputHeader(element, header)
+        elif verb == 'ListRecords':
+            input_func = self._server.listRecords
+            def outputFunc(element, record, token_kw):
+                self._outputRecord(element, token_kw['metadataPrefix'],
+                                   record)
+        elif verb == 'ListSets':
+            input_func = self._server.listSets
+            def outputFunc(element, set, token_kw):
+                self._outputSet(element, set)
+        else:
+            raise error.BadVerbError, "Can not stream %s" % verb
+        result, token, token_kw = self._callResuming(input_func, kw)
+        def items():
+            # build each element in a parent of its own, so that it
+            # can be dropped once it has been written
+            for item in result:
+                e_parent = Element(e_list.tag, nsmap=self._nsmap)
+                outputFunc(e_parent, item, token_kw)
+                yield e_parent[0]
+            if token is not None:
+                e_resumptionToken = Element(nsoai('resumptionToken'),
+                                            nsmap=self._nsmap)
+                e_resumptionToken.text = token
+                yield e_resumptionToken
+        return envelope, e_list, items()
+
     def handleException(self, exception):
         if isinstance(exception, error.ErrorBase):
             envelope = self._outputErrors(
@@ -175,8 +250,7 @@ class XMLTreeServer(object):
             if key == 'from' or key == 'until':
                 value = datetime_to_datestamp(value)
             e_request.set(key, value)
-        # XXX this is potentially slow..
-        e_request.text = self._server.identify().baseURL()
+        e_request.text = self.getIdentify().baseURL()
         return e_tree, e_oaipmh
     
     def _outputEnvelope(self, **kw):
@@ -194,6 +268,15 @@ class XMLTreeServer(object):
         return e_tree
     
     def _outputResuming(self, element, input_func, output_func, kw):
+        result, token, token_kw = self._callResuming(input_func, kw)
+        output_func(element, result, token_kw)
+        if token is not None:
+            e_resumptionToken = SubElement(element, nsoai('resumptionToken'))
+            e_resumptionToken.text = token
+
+    def _callResuming(self, input_func, kw):
+        """Get a batch of a list, its resumption token and its arguments.
+        """
         if 'resumptionToken' in kw:
             resumptionToken = kw['resumptionToken']
             result, token = input_func(resumptionToken=resumptionToken)
@@ -211,11 +294,25 @@ class XMLTreeServer(object):
                       "No records match for request."
             # without resumption token keys are fine
             token_kw = kw
-        output_func(element, result, token_kw)
-        if token is not None:
-            e_resumptionToken = SubElement(element, nsoai('resumptionToken'))
-            e_resumptionToken.text = token
-            
+        return result, token, token_kw
+
+    def _outputRecord(self, element, metadata_prefix, record):
+        header, metadata, about = record
+        e_record = SubElement(element, nsoai('record'))
+        self._outputHeader(e_record, header)
+        if not header.isDeleted():
+            self._outputMetadata(e_record, metadata_prefix, metadata)
+        # XXX about
+
+    def _outputSet(self, element, set):
+        setSpec, setName, setDescription = set
+        e_set = SubElement(element, nsoai('set'))
+        e_setSpec = SubElement(e_set, nsoai('setSpec'))
+        e_setSpec.text = setSpec
+        e_setName = SubElement(e_set, nsoai('setName'))
+        e_setName.text = setName
+        # XXX ignore setDescription
+
     def _outputHeader(self, element, header):
         e_header = SubElement(element, nsoai('header'))
         if header.isDeleted():
@@ -240,9 +337,24 @@ class ServerBase(common.ResumptionOAIPMH):
     """A server that responds to messages by returning OAI-PMH compliant XML.
 
     Takes a server object complying with the ResumptionOAIPMH interface.
+
+    identify_ttl - seconds to keep the Identify of the server for, see
+                   XMLTreeServer. While it is kept, the Identify
+                   response is only rendered once.
     """
-    def __init__(self, server, metadata_registry=None, nsmap=None):
-        self._tree_server = XMLTreeServer(server, metadata_registry, nsmap)
+    def __init__(self, server, metadata_registry=None, nsmap=None,
+                 identify_ttl=None):
+        self._tree_server = XMLTreeServer(server, metadata_registry, nsmap,
+                                          identify_ttl)
+        self._identify_ttl = identify_ttl
+        # (identify, response before its responseDate, response after it)
+        self._identify_response = None
+
+    def invalidateIdentify(self):
+        """Forget the kept Identify, for instance after it changed.
+        """
+        self._tree_server.invalidateIdentify()
+        self._identify_response = None
 
     def handleRequest(self, request_kw):
         """Handles incoming OAI-PMH request.
@@ -250,72 +362,134 @@ class ServerBase(common.ResumptionOAIPMH):
         request_kw is a dictionary containing request parameters, including
         verb.
         """
-        # try to get verb, if not, we have an argument handling error
         try:
-            new_kw = {}
-            try:
-                for key, value in request_kw.items():
-                    new_kw[str(key)] = value
-            except UnicodeError:
-                raise error.BadVerbError,\
-                      "Non-ascii keys in request."
-            request_kw = new_kw
-            try:
-                verb = request_kw.pop('verb')
-            except KeyError:
-                verb = 'unknown'
-                raise error.BadVerbError,\
-                      "Required verb argument not found."
-            if verb not in ['GetRecord', 'Identify', 'ListIdentifiers',
-                            'GetMetadata', 'ListMetadataFormats',
-                            'ListRecords', 'ListSets']:
-                raise error.BadVerbError, "Illegal verb: %s" % verb
-            # replace from and until arguments if necessary
-            from_ = request_kw.get('from')
-            if from_ is not None:
-                # rename to from_ for internal use
-                try:
-                    request_kw['from_'] = datestamp_to_datetime(from_)
-                except DatestampError, err:
-                    raise error.BadArgumentError(
-                        "The value '%s' of the argument "
-                        "'%s' is not valid." %(from_, 'from'))
-                del request_kw['from']
-            until = request_kw.get('until')
-            if until is not None:
-                try:
-                    request_kw['until'] = datestamp_to_datetime(until,
-                                                                inclusive=True)
-                except DatestampError, err:
-                    raise error.BadArgumentError(
-                        "The value '%s' of the argument "
-                        "'%s' is not valid." %(until, 'until'))
-
-            if from_ is not None and until is not None:
-                if (('T' in from_ and not 'T' in until) or
-                    ('T' in until and not 'T' in from_)):
-                    raise error.BadArgumentError(
-                        "The request has different granularities for"
-                        " the from and until parameters")
-                
-            # now validate parameters
-            try:
-                validation.validateResumptionArguments(verb, request_kw)
-            except validation.BadArgumentError, e:
-                # have to raise this as a error.BadArgumentError
-                raise error.BadArgumentError, str(e)
-            # now handle verb
-            return self.handleVerb(verb, request_kw)            
+            verb, request_kw = self.checkRequest(request_kw)
+            return self.handleVerb(verb, request_kw)
         except:
             # in case of exception, call exception handler
             return self.handleException(request_kw, sys.exc_info())
-        
+
+    def handleRequestStream(self, request_kw, chunk_size=STREAM_CHUNK_SIZE):
+        """Handles incoming OAI-PMH request, streaming the response.
+
+        Like handleRequest, but returns an iterator over the response
+        in chunks of about chunk_size bytes. The items of lists are
+        serialized one at a time as the chunks are asked for, instead
+        of building the tree of the whole response first, so large
+        batches take little memory and their first bytes are ready
+        early. Other responses come in a single chunk.
+
+        Errors found before the first chunk give an OAI-PMH error
+        response, like handleRequest does. Errors while writing the
+        items are raised by the iterator, as the response has been
+        started by then.
+        """
+        try:
+            verb, request_kw = self.checkRequest(request_kw)
+            if verb not in STREAMED_VERBS:
+                return iter([self.handleVerb(verb, request_kw)])
+            envelope, e_list, items = self._tree_server.listStream(
+                verb, **request_kw)
+            # build the first item now, so its errors give an error
+            # response as well
+            first = list(islice(items, 1))
+        except:
+            return iter([self.handleException(request_kw, sys.exc_info())])
+        return streamResponse(envelope, e_list, chain(first, items),
+                              chunk_size)
+
+    def checkRequest(self, request_kw):
+        """Check the arguments of a request.
+
+        Returns the verb and the other arguments, with from and until
+        turned into datetimes as from_ and until. Raises an error.ErrorBase
+        exception if the request is not valid.
+        """
+        # try to get verb, if not, we have an argument handling error
+        new_kw = {}
+        try:
+            for key, value in request_kw.items():
+                new_kw[str(key)] = value
+        except UnicodeError:
+            raise error.BadVerbError,\
+                  "Non-ascii keys in request."
+        request_kw = new_kw
+        try:
+            verb = request_kw.pop('verb')
+        except KeyError:
+            verb = 'unknown'
+            raise error.BadVerbError,\
+                  "Required verb argument not found."
+        if verb not in ['GetRecord', 'Identify', 'ListIdentifiers',
+                        'GetMetadata', 'ListMetadataFormats',
+                        'ListRecords', 'ListSets']:
+            raise error.BadVerbError, "Illegal verb: %s" % verb
+        # replace from and until arguments if necessary
+        from_ = request_kw.get('from')
+        if from_ is not None:
+            # rename to from_ for internal use
+            try:
+                request_kw['from_'] = datestamp_to_datetime(from_)
+            except DatestampError, err:
+                raise error.BadArgumentError(
+                    "The value '%s' of the argument "
+                    "'%s' is not valid." %(from_, 'from'))
+            del request_kw['from']
+        until = request_kw.get('until')
+        if until is not None:
+            try:
+                request_kw['until'] = datestamp_to_datetime(until,
+                                                            inclusive=True)
+            except DatestampError, err:
+                raise error.BadArgumentError(
+                    "The value '%s' of the argument "
+                    "'%s' is not valid." %(until, 'until'))
+
+        if from_ is not None and until is not None:
+            if (('T' in from_ and not 'T' in until) or
+                ('T' in until and not 'T' in from_)):
+                raise error.BadArgumentError(
+                    "The request has different granularities for"
+                    " the from and until parameters")
+            
+        # now validate parameters
+        try:
+            validation.validateResumptionArguments(verb, request_kw)
+        except validation.BadArgumentError, e:
+            # have to raise this as a error.BadArgumentError
+            raise error.BadArgumentError, str(e)
+        return verb, request_kw
+
     def handleVerb(self, verb, kw):
+        if verb == 'Identify' and self._identify_ttl is not None:
+            return self.renderIdentify()
         method = common.getMethodForVerb(self._tree_server, verb)
         return etree.tostring(method(**kw).getroot(), 
                               encoding='UTF-8',
                               xml_declaration=True,
                               pretty_print=True)
+
+    def renderIdentify(self):
+        """Get the Identify response from the one rendered before.
+
+        Only the responseDate is filled in again, until the kept
+        Identify expires.
+        """
+        identify = self._tree_server.getIdentify()
+        rendered = self._identify_response
+        if rendered is None or rendered[0] is not identify:
+            tree = self._tree_server.identify()
+            xml = etree.tostring(tree.getroot(),
+                                 encoding='UTF-8',
+                                 xml_declaration=True,
+                                 pretty_print=True)
+            # the responseDate comes before anything else in the response
+            response_date = tree.getroot().findtext(nsoai('responseDate'))
+            before, after = xml.split(response_date, 1)
+            rendered = self._identify_response = identify, before, after
+        identify, before, after = rendered
+        return before + datetime_to_datestamp(
+            datetime.utcnow().replace(microsecond=0)) + after
   
     def handleException(self, kw, exc_info):
         type, value, traceback = exc_info
@@ -327,36 +501,46 @@ class ServerBase(common.ResumptionOAIPMH):
 
 class Server(ServerBase):
     """Expects to be initialized with a IOAI server implementation.
+
+    resumption_sessions - a ResumptionSessions store to keep the lists
+                          the server returns in, so that they are not
+                          asked for again for every resumption token
     """
     def __init__(self, server, metadata_registry=None, nsmap=None,
-                 resumption_batch_size=10):
+                 resumption_batch_size=10, identify_ttl=None,
+                 resumption_sessions=None):
         super(Server, self).__init__(
-            Resumption(server, resumption_batch_size),
+            Resumption(server, resumption_batch_size, resumption_sessions),
             metadata_registry,
-            nsmap)
+            nsmap,
+            identify_ttl)
 
 class BatchingServer(ServerBase):
     """Expects to be initialized with a IBatchingOAI server implementation.
     """
     def __init__(self, server, metadata_registry=None, nsmap=None,
-                 resumption_batch_size=10):
+                 resumption_batch_size=10, identify_ttl=None):
         super(BatchingServer, self).__init__(
             BatchingResumption(server, resumption_batch_size),
             metadata_registry,
-            nsmap)
+            nsmap,
+            identify_ttl)
 
 class Resumption(common.ResumptionOAIPMH):
     """
     The Resumption class can turn a plain IOAIPMH interface into
     a ResumptionOAIPMH interface
 
-    This implementation is not particularly efficient for large
-    result sets, as the complete result set needs to be reconstructed each
-    time.
+    Without sessions this implementation is not particularly efficient
+    for large result sets, as the complete result set needs to be
+    reconstructed each time. Given a ResumptionSessions store, the
+    result of the first request is kept in a session, and resumption
+    tokens continue it, so a harvest takes linear time.
     """
-    def __init__(self, server, batch_size=10):
+    def __init__(self, server, batch_size=10, sessions=None):
         self._server = server
         self._batch_size = batch_size
+        self._sessions = sessions
     
     def handleVerb(self, verb, kw):
         # do original query
@@ -365,6 +549,15 @@ class Resumption(common.ResumptionOAIPMH):
         if 'resumptionToken' in kw:
             kw, cursor = decodeResumptionToken(
                 kw['resumptionToken'])
+            session_id = kw.pop('session', None)
+            if session_id is not None:
+                if self._sessions is None:
+                    raise error.BadResumptionTokenError,\
+                          "Resumption token expired"
+                batch, more = self._sessions.batch(
+                    session_id, cursor, self._batch_size)
+                return batch, self._token(kw, session_id, cursor, batch,
+                                          more)
             end_batch = cursor + self._batch_size
             # do query again with original parameters
             result = method(**kw)
@@ -382,6 +575,10 @@ class Resumption(common.ResumptionOAIPMH):
 
         # now handle resumption system
         if verb in ['ListSets', 'ListIdentifiers', 'ListRecords']:
+            if self._sessions is not None:
+                session_id, batch, more = self._sessions.start(
+                    result, self._batch_size)
+                return batch, self._token(kw, session_id, 0, batch, more)
             # XXX defeat the laziness effect of any generators..
             result = list(result)
             end_batch = self._batch_size
@@ -393,6 +590,165 @@ class Resumption(common.ResumptionOAIPMH):
             return result[0:end_batch], resumptionToken
         return result
 
+    def _token(self, kw, session_id, cursor, batch, more):
+        if not more:
+            return None
+        if session_id is not None:
+            kw = kw.copy()
+            kw['session'] = session_id
+        return encodeResumptionToken(kw, cursor + len(batch))
+
+class ResumptionSessions(object):
+    """Keeps the results of list requests for their resumption tokens.
+
+    ttl - seconds a session is kept after it was last used
+    max_items - items kept in all sessions together at most; when there
+                are more, the sessions used least recently are dropped
+
+    A result that is a list is kept as it is, a snapshot of the list
+    that any batch can be taken from. Any other result, like a
+    generator, is kept as a live iterator. It is only read as far as
+    the batches asked for, so it can only be continued in order,
+    though the last batch can be asked for again.
+
+    Results too large to keep are not kept in a session; their
+    resumption tokens work without one, by asking the server for the
+    result again. A token of a session that expired or was dropped
+    gives a badResumptionToken error, so a store can only be used by
+    a single process.
+    """
+    def __init__(self, ttl=SESSION_TTL, max_items=SESSION_MAX_ITEMS):
+        self._ttl = ttl
+        self._max_items = max_items
+        # session id -> (session, expires, items kept by it), least
+        # recently used first
+        self._sessions = OrderedDict()
+        self._items = 0
+        self._lock = threading.Lock()
+
+    def start(self, result, batch_size):
+        """Take the first batch of a result, keeping the rest if needed.
+
+        Returns the id of the session, or None if there is no session,
+        the batch, and whether there is more after it.
+        """
+        session = ResumptionSession(result)
+        batch, more = session.batch(0, batch_size)
+        if not more or session.size() > self._max_items:
+            return None, batch, more
+        session_id = uuid.uuid4().hex
+        self._lock.acquire()
+        try:
+            self._expire()
+            self._put(session_id, session)
+        finally:
+            self._lock.release()
+        return session_id, batch, more
+
+    def batch(self, session_id, cursor, batch_size):
+        """Take the batch at cursor of a session.
+
+        Returns the batch, and whether there is more after it. Raises
+        error.BadResumptionTokenError if there is no such session.
+        """
+        self._lock.acquire()
+        try:
+            self._expire()
+            entry = self._sessions.get(session_id)
+        finally:
+            self._lock.release()
+        if entry is None:
+            raise error.BadResumptionTokenError,\
+                  "Resumption token expired"
+        session = entry[0]
+        result = session.batch(cursor, batch_size)
+        self._lock.acquire()
+        try:
+            # unless it was dropped meanwhile, it is the most recently
+            # used now, and may keep fewer items
+            if self._remove(session_id) is not None:
+                self._put(session_id, session)
+        finally:
+            self._lock.release()
+        return result
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _put(self, session_id, session):
+        size = session.size()
+        self._sessions[session_id] = session, time.time() + self._ttl, size
+        self._items += size
+        while self._items > self._max_items:
+            self._remove(next(self._sessions.iterkeys()))
+
+    def _remove(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._items -= entry[2]
+        return entry
+
+    def _expire(self):
+        now = time.time()
+        # sessions expire in the order they were used
+        while self._sessions:
+            session_id, (session, expires, size) = next(
+                self._sessions.iteritems())
+            if expires > now:
+                break
+            self._remove(session_id)
+
+class ResumptionSession(object):
+    """What is left of the result of a list request.
+    """
+    def __init__(self, result):
+        if isinstance(result, list):
+            self._snapshot = result
+        else:
+            self._snapshot = None
+            self._iterator = iter(result)
+            # the item read to know whether there is more
+            self._ahead = []
+            # the position of the iterator, and the last batch
+            self._cursor = 0
+            self._last = None
+            self._lock = threading.Lock()
+
+    def size(self):
+        """Return how many items are kept.
+        """
+        if self._snapshot is not None:
+            return len(self._snapshot)
+        if self._last is None:
+            return len(self._ahead)
+        return len(self._ahead) + len(self._last[1])
+
+    def batch(self, cursor, batch_size):
+        """Return the batch at cursor, and whether there is more.
+        """
+        if self._snapshot is not None:
+            end_batch = cursor + batch_size
+            return (self._snapshot[cursor:end_batch],
+                    end_batch < len(self._snapshot))
+        self._lock.acquire()
+        try:
+            if self._last is not None and self._last[0] == cursor:
+                # the last batch again, the client is probably retrying
+                return self._last[1], self._last[2]
+            if cursor != self._cursor:
+                raise error.BadResumptionTokenError,\
+                      "Resumption token can not be used anymore"
+            batch = self._ahead + list(islice(
+                self._iterator, batch_size + 1 - len(self._ahead)))
+            self._ahead = batch[batch_size:]
+            batch = batch[:batch_size]
+            more = bool(self._ahead)
+            self._cursor += len(batch)
+            self._last = cursor, batch, more
+            return batch, more
+        finally:
+            self._lock.release()
+
 class BatchingResumption(common.ResumptionOAIPMH):
     """
     The BatchingResumption class can turn a IBatchingOAIPMH interface into
@@ -436,6 +792,55 @@ class BatchingResumption(common.ResumptionOAIPMH):
             return result, resumptionToken
         return method(**kw)
     
+def streamResponse(envelope, e_list, items, chunk_size=STREAM_CHUNK_SIZE):
+    """Serialize a response item by item, generating chunks of bytes.
+
+    envelope - the tree of the response without its items
+    e_list - the empty element in the envelope the items go in
+    items - iterator over the elements of the items
+
+    This is not an incremental writer: the envelope is rendered once
+    around a marker to find where the items go, and then once more
+    for each item, with only that item in it, to cut out the item's
+    bytes. The envelope is small, and rendering the item in it means
+    it does not declare the namespaces of the envelope again, so the
+    chunks add up to what handleRequest gives for the whole response.
+    """
+    root = envelope.getroot()
+    def render():
+        return etree.tostring(root,
+                              encoding='UTF-8',
+                              xml_declaration=True,
+                              pretty_print=True)
+    # the envelope goes around a marker where the items are
+    marker = etree.Comment(STREAM_MARKER)
+    e_list.append(marker)
+    before, after = render().split(etree.tostring(marker), 1)
+    e_list.remove(marker)
+    # items after the first start on a line of their own
+    separator = before[before.rfind('\n'):]
+    chunk = [before]
+    size = len(before)
+    empty = True
+    for element in items:
+        e_list.append(element)
+        xml = render()
+        e_list.remove(element)
+        if not empty:
+            chunk.append(separator)
+        empty = False
+        chunk.append(xml[len(before):len(xml) - len(after)])
+        size += len(xml) - len(before) - len(after)
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    if empty:
+        yield render()
+        return
+    chunk.append(after)
+    yield ''.join(chunk)
+
 def encodeResumptionToken(kw, cursor):
     kw = kw.copy()
     kw['cursor'] = str(cursor)
@@ -1,7 +1,6 @@
-from oaipmh import client, common
+from oaipmh import client, common, replay
 import os.path
 from datetime import datetime
-from urllib import urlencode
 from string import zfill
 
 class FakeClient(client.BaseClient):
@@ -13,7 +12,7 @@ class FakeClient(client.BaseClient):
         # this is a complete fake, and can only deal with a number of
         # fixed requests that are mapped to files
         # sort it to get stable behavior
-        return self._mapping[getRequestKey(kw)]
+        return self._mapping[replay.requestKey(kw)]
 
 class TestError(Exception):
     def __init__(self, kw):
@@ -36,13 +35,6 @@ class GranularityFakeClient(client.BaseClient):
             datetime(2005, 1, 1), 'no', self._granularity,
             None)
 
-def getRequestKey(kw):
-    """Create stable key for request dictionary to use in file.
-    """
-    items = kw.items()
-    items.sort()
-    return urlencode(items)
-
 def createMapping(mapping_path):
     f = open(os.path.join(mapping_path, 'mapping.txt'), 'r')
     result = {}
@@ -68,7 +60,7 @@ class FakeCreaterClient(client.Client):
     def makeRequest(self, **kw):
         print kw
         text = client.Client.makeRequest(self, **kw)
-        self._mapping[getRequestKey(kw)] = text
+        self._mapping[replay.requestKey(kw)] = text
         return text
 
     def save(self):
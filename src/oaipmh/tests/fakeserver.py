@@ -74,8 +74,8 @@ def createFakeData():
         minute = i % 60
         second = i % 60
         datestamp = datetime(year, month, day, hour, minute, second)
-        data.append((common.Header(str(i), datestamp, '', False),
-                     common.Metadata({'title': ['Title %s' % i]}),
+        data.append((common.Header(None, str(i), datestamp, '', False),
+                     common.Metadata(None, {'title': ['Title %s' % i]}),
                      None))
     return data
     
@@ -98,8 +98,8 @@ class FakeServerWithDeletions(FakeServerBase):
             month = i + 1
             day = 1
             datestamp = datetime(year, month, day, 12, 30, 0)
-            data.append((common.Header(str(i), datestamp, '', False),
-                         common.Metadata({'title': ['Title %s' % i]}),
+            data.append((common.Header(None, str(i), datestamp, '', False),
+                         common.Metadata(None, {'title': ['Title %s' % i]}),
                          None))
         self._data = data
         
@@ -112,8 +112,48 @@ class FakeServerWithDeletions(FakeServerBase):
             month = i + 1
             day = 1
             datestamp = datetime(year, month, day, 12, 35, 0)
-            data.append((common.Header(str(i), datestamp, '', True),
+            data.append((common.Header(None, str(i), datestamp, '', True),
                          None,
                          None))
         # replace first half with deleted records
         self._data = data + self._data[6:]
+
+class FakeServerWithSets(FakeServerBase):
+    """Records are in set 'even' or 'odd', and some also in 'three'.
+
+    Asking for set 'broken' results in an error.
+    """
+    def __init__(self):
+        data = []
+        for header, metadata, about in createFakeData():
+            i = int(header.identifier())
+            setspec = [['even', 'odd'][i % 2]]
+            if i % 3 == 0:
+                setspec.append('three')
+            header = common.Header(None, header.identifier(),
+                                   header.datestamp(), setspec, False)
+            data.append((header, metadata, about))
+        self._data = data
+
+    def listSets(self):
+        return [('even', 'Even', None),
+                ('odd', 'Odd', None),
+                ('three', 'Three', None),
+                ('broken', 'Broken', None)]
+
+    def listIdentifiers(self, metadataPrefix=None, from_=None, until=None,
+                        set=None):
+        return [header for header in FakeServerBase.listIdentifiers(
+            self, metadataPrefix, from_, until)
+                if inSet(header, set)]
+
+    def listRecords(self, metadataPrefix=None, from_=None, until=None,
+                    set=None):
+        return [record for record in FakeServerBase.listRecords(
+            self, metadataPrefix, from_, until)
+                if inSet(record[0], set)]
+
+def inSet(header, set):
+    if set == 'broken':
+        raise error.BadArgumentError, "Broken set"
+    return set is None or set in header.setSpec()
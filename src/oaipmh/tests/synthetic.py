@@ -0,0 +1,338 @@
+"""Synthetic repositories of any size, for benchmarks and tests.
+
+A SyntheticRepository implements IBatchingOAI, so it can be served by
+a BatchingServer. Its records are generated from their position when
+they are asked for, so a repository of millions of records takes only
+a few bytes of memory per record, and the same arguments always give
+the same repository.
+
+responses harvests a repository in memory, and writeRecording into a
+directory of response pages that replay.ReplayClient can replay.
+
+usage: python synthetic.py directory [record_count] [batch_size]
+"""
+import os
+import sys
+import random
+from bisect import bisect_left, bisect_right
+from array import array
+from datetime import datetime, timedelta
+
+from oaipmh import common, error, metadata, replay, server
+
+NS_OAIDC = 'http://www.openarchives.org/OAI/2.0/oai_dc/'
+
+WORDS = ('open archives initiative protocol metadata harvesting record '
+         'repository set datestamp identifier header library collection '
+         'thesis article journal dataset image letter map').split()
+
+def uniform(rand):
+    """Datestamps spread evenly between start and end.
+    """
+    return rand.random()
+
+def recent(rand):
+    """Most datestamps close to the end, as when records are often updated.
+    """
+    return rand.random() ** 0.25
+
+DISTRIBUTIONS = {'uniform': uniform, 'recent': recent}
+
+class SyntheticRepository(object):
+    """A repository with generated oai_dc records.
+
+    record_count - number of records
+    set_fanout - sets per level of the set hierarchy; (4, 3) gives
+                 four top level sets with three subsets each. Every
+                 record is in one of the sets at the lowest level.
+                 An empty tuple gives a repository without sets.
+    deleted_ratio - fraction of records that are deleted
+    metadata_size - approximate size in bytes of the description of
+                    each record
+    distribution - how datestamps are spread between start and end:
+                   'uniform', 'recent' or a function that takes a
+                   random.Random and returns a number between 0 and 1
+    start, end - the range of datestamps
+    seed - seed of the random numbers the repository is made from
+    """
+    def __init__(self, record_count=1000, set_fanout=(4, 3),
+                 deleted_ratio=0.0, metadata_size=200,
+                 distribution='uniform',
+                 start=datetime(2000, 1, 1), end=datetime(2010, 1, 1),
+                 seed=0):
+        self._record_count = record_count
+        self._deleted_ratio = deleted_ratio
+        self._metadata_size = metadata_size
+        self._start = start
+        self._seed = seed
+        # the sets, and the range of leaf sets below each of them
+        self._sets = []
+        self._leaf_ranges = {}
+        self._leaves = []
+        self._createSets((), set_fanout)
+        # datestamps in seconds after start, in record order
+        rand = random.Random(seed)
+        distribution = DISTRIBUTIONS.get(distribution, distribution)
+        delta = end - start
+        seconds = delta.days * 86400 + delta.seconds
+        offsets = [int(distribution(rand) * seconds)
+                   for i in xrange(record_count)]
+        offsets.sort()
+        self._offsets = array('l', offsets)
+
+    def _createSets(self, path, fanout):
+        if not fanout:
+            if path:
+                self._leaves.append(':'.join(path))
+            return
+        for i in range(fanout[0]):
+            sub_path = path + ('%s%s' % ('abcdefghijklmnopqrstuvwxyz'[
+                len(path) % 26], i), )
+            spec = ':'.join(sub_path)
+            self._sets.append((spec, 'Set %s' % spec, None))
+            first = len(self._leaves)
+            self._createSets(sub_path, fanout[1:])
+            self._leaf_ranges[spec] = (first, len(self._leaves))
+
+    # IBatchingOAI
+
+    def identify(self):
+        return common.Identify(
+            repositoryName='Synthetic',
+            baseURL='http://synthetic.example.org/oai',
+            protocolVersion='2.0',
+            adminEmails=['admin@example.org'],
+            earliestDatestamp=self._start,
+            deletedRecord=self._deleted_ratio and 'persistent' or 'no',
+            granularity='YYYY-MM-DDThh:mm:ssZ',
+            compression=['identity'],
+            toolkit_description=False)
+
+    def listMetadataFormats(self, identifier=None):
+        if identifier is not None:
+            self._index(identifier)
+        return [('oai_dc', 'http://www.openarchives.org/OAI/2.0/oai_dc.xsd',
+                 NS_OAIDC)]
+
+    def listSets(self, cursor=0, batch_size=10):
+        if not self._sets:
+            raise error.NoSetHierarchyError, "Repository has no sets"
+        return self._sets[cursor:cursor + batch_size]
+
+    def getRecord(self, metadataPrefix, identifier):
+        self._checkMetadataPrefix(metadataPrefix)
+        return self.record(self._index(identifier))
+
+    def listIdentifiers(self, metadataPrefix, set=None, from_=None,
+                        until=None, cursor=0, batch_size=10):
+        return [self.header(i) for i in self._select(
+            metadataPrefix, set, from_, until, cursor, batch_size)]
+
+    def listRecords(self, metadataPrefix, set=None, from_=None,
+                    until=None, cursor=0, batch_size=10):
+        return [self.record(i) for i in self._select(
+            metadataPrefix, set, from_, until, cursor, batch_size)]
+
+    # records
+
+    def header(self, i):
+        if self._leaves:
+            setspec = [self._leaves[i % len(self._leaves)]]
+        else:
+            setspec = []
+        return common.Header(
+            None, 'oai:synthetic:%s' % i,
+            self._start + timedelta(seconds=self._offsets[i]),
+            setspec, self.isDeleted(i))
+
+    def record(self, i):
+        header = self.header(i)
+        if header.isDeleted():
+            return header, None, None
+        rand = random.Random(self._seed * 1000003 + i)
+        words = []
+        # no space before the first word
+        size = -1
+        while size < self._metadata_size:
+            word = rand.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        map = {
+            'title': [u'Record %s' % i],
+            'creator': [u'Creator %s' % rand.randrange(1000)],
+            'subject': [unicode(rand.choice(WORDS)) for j in range(3)],
+            'description': [u' '.join(words)],
+            'date': [unicode(header.datestamp().strftime('%Y-%m-%d'))],
+            'identifier': [u'http://synthetic.example.org/%s' % i],
+            }
+        for name in ['publisher', 'contributor', 'type', 'format',
+                     'source', 'language', 'relation', 'coverage',
+                     'rights']:
+            map.setdefault(name, [])
+        return header, common.Metadata(None, map), None
+
+    def isDeleted(self, i):
+        # spread deleted records evenly, but not regularly
+        return (i * 2654435761 + self._seed) % 1000 < (
+            self._deleted_ratio * 1000)
+
+    def _index(self, identifier):
+        prefix = 'oai:synthetic:'
+        try:
+            if not identifier.startswith(prefix):
+                raise ValueError
+            i = int(identifier[len(prefix):])
+            if not 0 <= i < self._record_count:
+                raise ValueError
+        except ValueError:
+            raise error.IdDoesNotExistError, \
+                  "Id does not exist: %s" % identifier
+        return i
+
+    def _checkMetadataPrefix(self, metadataPrefix):
+        if metadataPrefix != 'oai_dc':
+            raise error.CannotDisseminateFormatError, \
+                  "Unknown metadata format: %s" % metadataPrefix
+
+    def _select(self, metadataPrefix, set, from_, until, cursor, batch_size):
+        """Get the positions of a batch of records that match.
+        """
+        self._checkMetadataPrefix(metadataPrefix)
+        # the records in the datestamp range
+        first, last = 0, self._record_count
+        if from_ is not None:
+            first = bisect_left(self._offsets, self._seconds(from_))
+        if until is not None:
+            last = bisect_right(self._offsets, self._seconds(until))
+        if set is None:
+            return range(first + cursor, min(first + cursor + batch_size,
+                                             last))
+        leaf_range = self._leaf_ranges.get(set)
+        if leaf_range is None:
+            return []
+        # members of a set have positions that are an arithmetic
+        # series per leaf, so they can be counted without a scan
+        leaf_count = len(self._leaves)
+        low, high = leaf_range
+        width = high - low
+        def countBelow(position):
+            full, rest = divmod(position, leaf_count)
+            return full * width + max(0, min(rest, high) - low)
+        result = []
+        n = countBelow(first) + cursor
+        end = countBelow(last)
+        while n < end and len(result) < batch_size:
+            block, offset = divmod(n, width)
+            result.append(block * leaf_count + low + offset)
+            n += 1
+        return result
+
+    def _seconds(self, dt):
+        delta = dt - self._start
+        return delta.days * 86400 + delta.seconds
+
+class UnbatchedRepository(object):
+    """Serves a SyntheticRepository through IOAI, for a Server.
+
+    Lists are returned whole, as IOAI has no batches.
+    """
+    def __init__(self, repository):
+        self._repository = repository
+
+    def identify(self):
+        return self._repository.identify()
+
+    def listMetadataFormats(self, identifier=None):
+        return self._repository.listMetadataFormats(identifier)
+
+    def listSets(self):
+        return self._repository.listSets(0, sys.maxint)
+
+    def getRecord(self, metadataPrefix, identifier):
+        return self._repository.getRecord(metadataPrefix, identifier)
+
+    def listIdentifiers(self, metadataPrefix, set=None, from_=None,
+                        until=None):
+        return self._repository.listIdentifiers(
+            metadataPrefix, set, from_, until, 0, sys.maxint)
+
+    def listRecords(self, metadataPrefix, set=None, from_=None, until=None):
+        return self._repository.listRecords(
+            metadataPrefix, set, from_, until, 0, sys.maxint)
+
+def createServer(repository, batch_size=100, batching=True):
+    """Create a server serving a repository in oai_dc.
+
+    This is a BatchingServer, or a Server if batching is False.
+    """
+    registry = metadata.MetadataRegistry()
+    registry.registerWriter('oai_dc', server.oai_dc_writer)
+    if not batching:
+        return server.Server(UnbatchedRepository(repository), registry,
+                             resumption_batch_size=batch_size)
+    return server.BatchingServer(repository, registry,
+                                 resumption_batch_size=batch_size)
+
+def responses(repository, batch_size=100):
+    """Harvest a repository, generating (request, response) pairs.
+
+    Harvests Identify, ListMetadataFormats, and all pages of ListSets,
+    ListIdentifiers and ListRecords in oai_dc. Requests are dictionaries
+    of their arguments, including the verb.
+    """
+    oaiserver = createServer(repository, batch_size)
+    requests = [{'verb': 'Identify'}, {'verb': 'ListMetadataFormats'},
+                {'verb': 'ListSets'},
+                {'verb': 'ListIdentifiers', 'metadataPrefix': 'oai_dc'},
+                {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'}]
+    while requests:
+        kw = requests.pop(0)
+        response = oaiserver.handleRequest(kw.copy())
+        yield kw, response
+        token = resumptionToken(response)
+        if token:
+            requests.insert(0, {'verb': kw['verb'],
+                                'resumptionToken': token})
+
+def writeRecording(repository, directory, batch_size=100):
+    """Harvest a repository into a directory that ReplayClient can replay.
+
+    See responses for what is harvested.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    mapping = open(os.path.join(directory, 'mapping.txt'), 'w')
+    try:
+        count = 0
+        for kw, response in responses(repository, batch_size):
+            filename = '%05d.xml' % count
+            f = open(os.path.join(directory, filename), 'wb')
+            f.write(response)
+            f.close()
+            mapping.write('%s\n%s\n' % (replay.requestKey(kw), filename))
+            count += 1
+    finally:
+        mapping.close()
+    return count
+
+def resumptionToken(response):
+    start = response.find('<resumptionToken>')
+    if start == -1:
+        return None
+    start += len('<resumptionToken>')
+    return response[start:response.index('</resumptionToken>', start)]
+
+def main(args):
+    if not args:
+        print __doc__
+        return 1
+    directory = args[0]
+    record_count = len(args) > 1 and int(args[1]) or 1000
+    batch_size = len(args) > 2 and int(args[2]) or 100
+    pages = writeRecording(SyntheticRepository(record_count), directory,
+                           batch_size)
+    print "wrote %s pages to %s" % (pages, directory)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -3,7 +3,7 @@ from datetime import datetime
 from unittest import TestCase, TestSuite, makeSuite
 
 from fakeclient import FakeClient
-from oaipmh import metadata, error
+from oaipmh import client, metadata, error
 
 test_directory = os.path.dirname(__file__)
 
@@ -27,5 +27,86 @@ class BrokenDataTestCase(TestCase):
         fakeclient = self.createFakeClient('fake5')
         self.assertRaises(error.DatestampError, fakeclient.identify)
 
+IDENTIFY = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+    '<responseDate>2006-02-10T13:21:17Z</responseDate>'
+    '<request verb="Identify">http://test/oai</request>'
+    '<Identify><repositoryName>%s</repositoryName>'
+    '<baseURL>http://test/oai</baseURL>'
+    '<protocolVersion>2.0</protocolVersion>'
+    '<adminEmail>test@example.org</adminEmail>'
+    '<earliestDatestamp>2001-01-01T00:00:00Z</earliestDatestamp>'
+    '<deletedRecord>no</deletedRecord>'
+    '<granularity>YYYY-MM-DDThh:mm:ssZ</granularity>'
+    '</Identify></OAI-PMH>')
+
+class PageClient(client.BaseClient):
+    def __init__(self, page):
+        client.BaseClient.__init__(self)
+        self._page = page
+
+    def makeRequest(self, **kw):
+        return self._page
+
+class BadCharactersTestCase(TestCase):
+    def assertRepositoryName(self, name, page):
+        oaiclient = PageClient(page)
+        self.assertRaises(error.XMLSyntaxError, oaiclient.identify)
+        oaiclient.ignoreBadCharacters(True)
+        self.assertEquals(name, oaiclient.identify().repositoryName())
+
+    def test_form_feed(self):
+        self.assertRepositoryName(u'Form?feed', IDENTIFY % 'Form\x0cfeed')
+
+    def test_bad_utf8(self):
+        self.assertRepositoryName(u'Bad \ufffd UTF-8',
+                                  IDENTIFY % 'Bad \xe9 UTF-8')
+
+    def test_notwellformed(self):
+        # the undefined entity is dropped
+        self.assertRepositoryName(u'Nonbreaking',
+                                  IDENTIFY % 'Non&nbsp;breaking')
+
+    def test_wellformed(self):
+        # other encodings are left alone
+        page = (IDENTIFY % 'Caf\xe9').replace('UTF-8', 'ISO-8859-1')
+        oaiclient = PageClient(page)
+        oaiclient.ignoreBadCharacters(True)
+        self.assertEquals(u'Caf\xe9', oaiclient.identify().repositoryName())
+
+    def test_truncated(self):
+        # recovering drops what follows the error, with the token
+        page = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            '<responseDate>2006-02-10T13:21:17Z</responseDate>'
+            '<request verb="ListIdentifiers">http://test/oai</request>'
+            '<ListIdentifiers><header><identifier>a</identifier>'
+            '<datestamp>2004-01-01</datestamp></header>%s'
+            '<resumptionToken>next</resumptionToken>'
+            '</ListIdentifiers></OAI-PMH>')
+        oaiclient = PageClient(page % '')
+        oaiclient.ignoreBadCharacters(True)
+        self.assertEquals('next', oaiclient.getXPaths().token(
+            oaiclient.parse(oaiclient.makeRequest())))
+        oaiclient = PageClient(page % '<header><identifier>b</identifier>'
+                               '<datestamp 2004-01-01</datestamp></header>')
+        oaiclient.ignoreBadCharacters(True)
+        self.assertRaises(error.XMLSyntaxError, oaiclient.listIdentifiers,
+                          metadataPrefix='oai_dc')
+
+    def test_no_response(self):
+        oaiclient = PageClient(
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            '<responseDate>2006-02-10T13:21:17Z</responseDate>'
+            '<request verb="Identify"  http://test/oai</request>'
+            '<Identify><repositoryName>a</repositoryName></Identify>'
+            '</OAI-PMH>')
+        oaiclient.ignoreBadCharacters(True)
+        self.assertRaises(error.XMLSyntaxError, oaiclient.identify)
+
 def test_suite():
-    return TestSuite((makeSuite(BrokenDataTestCase), ))
+    return TestSuite((makeSuite(BrokenDataTestCase),
+                      makeSuite(BadCharactersTestCase)))
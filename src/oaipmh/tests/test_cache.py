@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, TestSuite, main, makeSuite
+
+import fakeserver
+from oaipmh import cache, client, metadata, server
+
+class CountingServerClient(client.ServerClient):
+    def __init__(self, server, metadata_registry=None):
+        client.ServerClient.__init__(self, server, metadata_registry)
+        self.verbs = []
+
+    def makeRequest(self, **kw):
+        self.verbs.append(kw['verb'])
+        return client.ServerClient.makeRequest(self, **kw)
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def createCache(self, **kw):
+        return cache.MemoryCache(**kw)
+
+    def createClient(self, response_cache, resumption_batch_size=10):
+        metadata_registry = metadata.MetadataRegistry()
+        metadata_registry.registerWriter('oai_dc', server.oai_dc_writer)
+        metadata_registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        oaiserver = server.Server(
+            fakeserver.FakeServerWithSets(), metadata_registry,
+            resumption_batch_size=resumption_batch_size)
+        oaiclient = CountingServerClient(oaiserver, metadata_registry)
+        oaiclient.useResponseCache(response_cache)
+        return oaiclient
+
+    def test_cached(self):
+        oaiclient = self.createClient(self.createCache())
+        for i in range(3):
+            self.assertEquals('Fake', oaiclient.identify().repositoryName())
+            oaiclient.updateGranularity()
+            self.assertEquals(4, len(list(oaiclient.listSets())))
+        self.assertEquals(['Identify', 'ListSets'], oaiclient.verbs)
+
+    def test_not_cached(self):
+        oaiclient = self.createClient(self.createCache())
+        for i in range(2):
+            list(oaiclient.listIdentifiers(metadataPrefix='oai_dc'))
+        self.assertEquals(['ListIdentifiers'] * 20, oaiclient.verbs)
+
+    def test_arguments(self):
+        oaiclient = self.createClient(
+            self.createCache(ttls={'ListIdentifiers': 60}),
+            resumption_batch_size=100)
+        for setSpec in ['even', 'odd', 'even']:
+            list(oaiclient.listIdentifiers(metadataPrefix='oai_dc',
+                                           set=setSpec))
+        self.assertEquals(['ListIdentifiers'] * 2, oaiclient.verbs)
+
+    def test_resumption(self):
+        oaiclient = self.createClient(self.createCache(),
+                                      resumption_batch_size=3)
+        for i in range(2):
+            self.assertEquals(4, len(list(oaiclient.listSets())))
+        self.assertEquals(['ListSets'] * 4, oaiclient.verbs)
+
+    def test_expired(self):
+        oaiclient = self.createClient(self.createCache(ttls={'Identify': 0}))
+        oaiclient.identify()
+        oaiclient.identify()
+        list(oaiclient.listSets())
+        list(oaiclient.listSets())
+        self.assertEquals(['Identify', 'Identify', 'ListSets', 'ListSets'],
+                          oaiclient.verbs)
+
+    def test_shared(self):
+        response_cache = self.createCache()
+        self.createClient(response_cache).identify()
+        oaiclient = self.createClient(response_cache)
+        oaiclient.identify()
+        self.assertEquals([], oaiclient.verbs)
+
+    def test_evict(self):
+        response_cache = self.createCache(max_size=25)
+        response_cache.set(('a',), 'Identify', 'a' * 10)
+        response_cache.set(('b',), 'Identify', 'b' * 10)
+        self.assertEquals('a' * 10, response_cache.get(('a',), 'Identify'))
+        # b was used least recently
+        response_cache.set(('c',), 'Identify', 'c' * 10)
+        self.assertEquals(None, response_cache.get(('b',), 'Identify'))
+        self.assertEquals('a' * 10, response_cache.get(('a',), 'Identify'))
+        self.assertEquals('c' * 10, response_cache.get(('c',), 'Identify'))
+        # too big to cache at all
+        response_cache.set(('d',), 'Identify', 'd' * 30)
+        self.assertEquals(None, response_cache.get(('d',), 'Identify'))
+
+class DiskCacheTestCase(ResponseCacheTestCase):
+    def createCache(self, **kw):
+        # every cache created in a test shares the directory
+        return cache.DiskCache(self._dir, **kw)
+
+    def test_evict(self):
+        # the size of a file includes its expiry time
+        response_cache = self.createCache(max_size=60)
+        response_cache.set(('a',), 'Identify', 'a' * 10)
+        response_cache.set(('b',), 'Identify', 'b' * 10)
+        self.assertEquals('a' * 10, response_cache.get(('a',), 'Identify'))
+        # b was used least recently
+        response_cache.set(('c',), 'Identify', 'c' * 10)
+        self.assertEquals(None, response_cache.get(('b',), 'Identify'))
+        self.assertEquals('a' * 10, response_cache.get(('a',), 'Identify'))
+        self.assertEquals('c' * 10, response_cache.get(('c',), 'Identify'))
+        # too big to cache at all
+        response_cache.set(('d',), 'Identify', 'd' * 100)
+        self.assertEquals(None, response_cache.get(('d',), 'Identify'))
+
+    def test_other_files(self):
+        # files the cache did not write are not evicted or cleared
+        other = os.path.join(self._dir, 'other.xml')
+        f = open(other, 'wb')
+        f.write('x' * 100)
+        f.close()
+        response_cache = self.createCache(max_size=60)
+        response_cache.set(('a',), 'Identify', 'a' * 10)
+        self.assertEquals('a' * 10, response_cache.get(('a',), 'Identify'))
+        response_cache.clear()
+        self.assertEquals(None, response_cache.get(('a',), 'Identify'))
+        self.assertEquals(['other.xml'], os.listdir(self._dir))
+
+    def test_corrupt(self):
+        response_cache = self.createCache()
+        response_cache.set(('a',), 'Identify', 'a' * 10)
+        [name] = os.listdir(self._dir)
+        f = open(os.path.join(self._dir, name), 'wb')
+        f.write('<?xml vers')
+        f.close()
+        self.assertEquals(None, response_cache.get(('a',), 'Identify'))
+        self.assertEquals([], os.listdir(self._dir))
+
+    def test_replaceFile(self):
+        path = os.path.join(self._dir, 'file')
+        cache.replaceFile(path, 'old')
+        cache.replaceFile(path, 'new', sync=True)
+        self.assertEquals(['file'], os.listdir(self._dir))
+        f = open(path, 'rb')
+        self.assertEquals('new', f.read())
+        f.close()
+
+def test_suite():
+    return TestSuite((makeSuite(ResponseCacheTestCase),
+                      makeSuite(DiskCacheTestCase)))
+
+if __name__=='__main__':
+    main(defaultTest='test_suite')
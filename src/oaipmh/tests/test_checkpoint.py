@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from unittest import TestCase, TestSuite, main, makeSuite
+
+import fakeserver
+from oaipmh import checkpoint, client, metadata, server
+from oaipmh.datestamp import datetime_to_datestamp
+
+class CheckpointHarvesterTestCase(TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._store = checkpoint.JSONCheckpointStore(
+            os.path.join(self._dir, 'checkpoint.json'))
+        metadata_registry = metadata.MetadataRegistry()
+        metadata_registry.registerWriter('oai_dc', server.oai_dc_writer)
+        metadata_registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        self._server = server.BatchingServer(
+            fakeserver.BatchingFakeServer(), metadata_registry,
+            resumption_batch_size=7)
+        self._client = client.ServerClient(self._server, metadata_registry)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def createHarvester(self, **kw):
+        return checkpoint.CheckpointHarvester(
+            self._client, self._store, 'ListRecords',
+            metadataPrefix='oai_dc', **kw)
+
+    def harvestPartially(self, count, **kw):
+        headers = []
+        for header, metadata, about in self.createHarvester(**kw):
+            headers.append(header)
+            if len(headers) == count:
+                break
+        return headers
+
+    def test_complete(self):
+        records = list(self.createHarvester())
+        self.assertEquals(100, len(records))
+        self.assertEquals(None, self._store.load())
+
+    def test_resume(self):
+        headers = self.harvestPartially(20)
+        self.assertEquals([str(i) for i in range(20)],
+                          [header.identifier() for header in headers])
+        saved = self._store.load()
+        # two complete pages of seven records
+        self.assertEquals(2, saved['page'])
+        watermark = max([header.datestamp() for header in headers[:14]])
+        self.assertEquals(datetime_to_datestamp(watermark),
+                          saved['watermark'])
+        # the third page is harvested again
+        identifiers = [header.identifier() for header, metadata, about
+                       in self.createHarvester()]
+        self.assertEquals([str(i) for i in range(14, 100)], identifiers)
+        self.assertEquals(None, self._store.load())
+
+    def test_other_request(self):
+        self.harvestPartially(20)
+        # a checkpoint for other arguments is not used
+        records = list(self.createHarvester(from_=datetime(2004, 1, 1)))
+        self.assertEquals(100, len(records))
+
+    def test_expired_token(self):
+        headers = self.harvestPartially(20)
+        saved = self._store.load()
+        saved['token'] = 'expired'
+        self._store.save(saved)
+        watermark = max([header.datestamp() for header in headers[:14]])
+        records = list(self.createHarvester())
+        self.assert_(0 < len(records) < 100)
+        for header, metadata, about in records:
+            self.assert_(header.datestamp() >= watermark)
+
+    def test_raw(self):
+        self._client.rawRecords(True)
+        identifiers = []
+        for identifier, datestamp, deleted, xml in self.createHarvester():
+            identifiers.append(identifier)
+            if len(identifiers) == 20:
+                break
+        saved = self._store.load()
+        self.assertEquals(2, saved['page'])
+        records = list(self.createHarvester())
+        self.assertEquals([str(i) for i in range(14, 100)],
+                          [record[0] for record in records])
+        self.assertEquals(None, self._store.load())
+
+def test_suite():
+    return TestSuite((makeSuite(CheckpointHarvesterTestCase), ))
+
+if __name__=='__main__':
+    main(defaultTest='test_suite')
@@ -1,8 +1,14 @@
 from unittest import TestCase, TestSuite, main, makeSuite
 from fakeclient import FakeClient, GranularityFakeClient, TestError
 import os
+import time
+import threading
+import urllib2
+from StringIO import StringIO
 from datetime import datetime
-from oaipmh import common, metadata, validation
+from lxml import etree
+from oaipmh import client, common, metadata, validation
+from oaipmh.error import DatestampError
 
 directory = os.path.dirname(__file__)
 fake1 = os.path.join(directory, 'fake1')
@@ -122,6 +128,187 @@ class ClientTestCase(TestCase):
             ['Kijken in het brein: Over de mogelijkheden van neuromarketing'],
             metadata.getField('title'))
             
+    def test_listRecords_streaming(self):
+        streamclient = FakeClient(fake1)
+        streamclient.streamRecords(True)
+        records = list(streamclient.listRecords(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+        expected = list(fakeclient.listRecords(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+        self.assertEquals(len(expected), len(records))
+        for (header, metadata, about), (e_header, e_metadata, e_about) in zip(
+            records, expected):
+            self.assertEquals(e_header.identifier(), header.identifier())
+            self.assertEquals(e_header.datestamp(), header.datestamp())
+            self.assertEquals(e_header.setSpec(), header.setSpec())
+            self.assertEquals(e_metadata.getMap(), metadata.getMap())
+            # records are detached from the page tree
+            self.assert_(header.element().getparent().getparent() is None)
+
+    def test_listRecords_raw(self):
+        rawclient = FakeClient(fake1)
+        rawclient.rawRecords(True)
+        # no reader is needed
+        rawclient._metadata_registry = metadata.MetadataRegistry()
+        records = list(rawclient.listRecords(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+        expected = list(fakeclient.listRecords(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+        self.assertEquals(len(expected), len(records))
+        for (identifier, datestamp, deleted, xml), (e_header, e_metadata,
+                                                    e_about) in zip(
+            records, expected):
+            self.assertEquals(e_header.identifier(), identifier)
+            self.assertEquals(e_header.datestamp(), datestamp)
+            self.assertEquals(e_header.isDeleted(), deleted)
+            # without the tail and the namespace of the page
+            self.assertEquals(
+                etree.tostring(e_metadata.element()[0], with_tail=False
+                               ).replace(' xmlns="%s"' % client.NS_OAIPMH,
+                                         ''), xml)
+        # the metadata can be parsed on its own
+        tree = etree.XML(records[0][3])
+        self.assertEquals(
+            ['Kijken in het brein: Over de mogelijkheden van neuromarketing'],
+            tree.xpath('dc:title/text()', namespaces={
+                        'dc': 'http://purl.org/dc/elements/1.1/'}))
+        rawclient.streamRecords(True)
+        streamed = list(rawclient.listRecords(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+        self.assertEquals([record[:3] for record in records],
+                          [record[:3] for record in streamed])
+        # streamed records may declare unused namespaces differently
+        self.assertEquals(
+            [canonical(record[3]) for record in records],
+            [canonical(record[3]) for record in streamed])
+
+    def test_getRecord_raw(self):
+        rawclient = FakeClient(fake1)
+        rawclient.rawRecords(True)
+        identifier, datestamp, deleted, xml = rawclient.getRecord(
+            metadataPrefix='oai_dc', identifier='hdl:1765/315')
+        self.assertEquals('hdl:1765/315', identifier)
+        self.assert_(not deleted)
+        self.assert_(xml.startswith('<oai_dc:dc'))
+
+    def test_namespaces(self):
+        # responses are read with the namespaces of getNamespaces
+        class OtherNamespaceClient(client.BaseClient):
+            def getNamespaces(self):
+                return {'oai': 'urn:other'}
+            def makeRequest(self, **kw):
+                return (
+                    '<OAI-PMH xmlns="urn:other"><ListIdentifiers><header>'
+                    '<identifier>a</identifier>'
+                    '<datestamp>2004-01-01</datestamp>'
+                    '<setSpec>s</setSpec></header>'
+                    '</ListIdentifiers></OAI-PMH>')
+        headers = list(OtherNamespaceClient().listIdentifiers(
+            metadataPrefix='oai_dc'))
+        self.assertEquals(['a'], [header.identifier() for header in headers])
+        self.assertEquals(['s'], headers[0].setSpec())
+        # as does buildHeader with the namespaces it is given
+        header_node = headers[0].element()
+        self.assertEquals(
+            'a', client.buildHeader(header_node,
+                                    {'oai': 'urn:other'}).identifier())
+        self.assertRaises(DatestampError, client.buildHeader,
+                          header_node, {'oai': client.NS_OAIPMH})
+        self.assert_(client.compiledXPaths({'oai': 'urn:other'}) is
+                     client.compiledXPaths({'oai': 'urn:other'}))
+
+    def test_raw_xml(self):
+        page = etree.XML(
+            '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            '<GetRecord><record><header><identifier>a</identifier>'
+            '<datestamp>2004-01-01</datestamp></header><metadata>\n'
+            '  <x:dc xmlns:x="urn:x">t</x:dc>\n  '
+            '</metadata></record></GetRecord></OAI-PMH>')
+        record_node = page[0][0]
+        namespaces = {'oai': client.NS_OAIPMH}
+        self.assertEquals(
+            ('a', datetime(2004, 1, 1), False,
+             '<x:dc xmlns:x="urn:x">t</x:dc>'),
+            client.buildRawRecord(record_node, namespaces))
+        # comments and processing instructions before it are skipped
+        metadata_node = record_node[1]
+        metadata_node.insert(0, etree.Comment(' c '))
+        metadata_node.insert(0, etree.ProcessingInstruction('pi'))
+        self.assertEquals('<x:dc xmlns:x="urn:x">t</x:dc>',
+                          client.buildRawRecord(record_node, namespaces)[3])
+        # the namespace of the page is kept where the metadata uses it
+        metadata_node.remove(metadata_node[2])
+        etree.SubElement(metadata_node, '{%s}x' % client.NS_OAIPMH)
+        self.assertEquals('<x xmlns="%s"/>' % client.NS_OAIPMH,
+                          client.buildRawRecord(record_node, namespaces)[3])
+
+    def test_listRecords_detached(self):
+        detachedclient = FakeClient(fake1)
+        detachedclient.detachRecords(True)
+        records = list(detachedclient.listRecords(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+        expected = list(fakeclient.listRecords(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+        self.assertEquals(len(expected), len(records))
+        for (header, metadata, about), (e_header, e_metadata, e_about) in zip(
+            records, expected):
+            self.assertEquals(e_header.identifier(), header.identifier())
+            self.assertEquals(e_header.datestamp(), header.datestamp())
+            self.assertEquals(e_header.setSpec(), header.setSpec())
+            self.assertEquals(e_metadata.getMap(), metadata.getMap())
+            self.assertEquals(None, header.element())
+            # metadata has a copy of its element in a tree of its own
+            element = metadata.element()
+            self.assert_(element.getroottree().getroot() is element)
+            self.assertEquals(etree.tostring(e_metadata.element()[0]),
+                              etree.tostring(element[0]))
+
+    def test_listIdentifiers_detached(self):
+        detachedclient = FakeClient(fake1)
+        detachedclient.detachRecords(True)
+        for stream in [False, True]:
+            detachedclient.streamRecords(stream)
+            headers = list(detachedclient.listIdentifiers(
+                from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+            self.assertEquals(16, len(headers))
+            for header in headers:
+                self.assertEquals(None, header.element())
+
+    def test_listIdentifiers_compact(self):
+        compactclient = FakeClient(fake1)
+        compactclient.compactHeaders(True)
+        headers = list(compactclient.listIdentifiers(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+        expected = list(fakeclient.listIdentifiers(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+        self.assertEquals(
+            [(h.identifier(), h.datestamp(), h.setSpec(), h.isDeleted())
+             for h in expected],
+            [(h.identifier(), h.datestamp(), h.setSpec(), h.isDeleted())
+             for h in headers])
+        batches = [batch for batch, token in compactclient.listBatches(
+            'ListIdentifiers', from_=datetime(2003, 04, 10),
+            metadataPrefix='oai_dc')]
+        for batch in batches:
+            self.assert_(isinstance(batch, common.HeaderBatch))
+        self.assertEquals(
+            [header.identifier() for header in expected],
+            [header.identifier() for batch in batches for header in batch])
+
+    def test_listIdentifiers_streaming(self):
+        streamclient = FakeClient(fake1)
+        streamclient.streamRecords(True)
+        headers = list(streamclient.listIdentifiers(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+        expected = list(fakeclient.listIdentifiers(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+        self.assertEquals(
+            [header.identifier() for header in expected],
+            [header.identifier() for header in headers])
+        self.assertEquals(
+            [header.datestamp() for header in expected],
+            [header.datestamp() for header in headers])
+
     def test_listMetadataFormats(self):
         formats = fakeclient.listMetadataFormats()
         metadataPrefix, schema, metadataNamespace = formats[0]
@@ -166,8 +353,220 @@ class ClientTestCase(TestCase):
             self.assertEquals('2003-04-10', e.kw['from'])
             self.assertEquals('2004-06-17', e.kw['until'])
             
+def canonical(xml):
+    return etree.tostring(etree.XML(xml), method='c14n', exclusive=True)
+
+class RequestListenerTestCase(TestCase):
+    def setUp(self):
+        self._client = FakeClient(fake1)
+        self._events = []
+        self._client.addRequestListener(self._events.append)
+
+    def test_listRecords(self):
+        records = list(self._client.listRecords(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+        self.assertEquals(1, len(self._events))
+        event = self._events[0]
+        self.assertEquals('ListRecords', event.verb)
+        self.assertEquals('oai_dc', event.arguments['metadataPrefix'])
+        self.assertEquals(len(records), event.record_count)
+        self.assert_(event.bytes_received > 0)
+        self.assert_(event.parse_time >= 0)
+        self.assert_(event.build_time >= 0)
+        self.assertEquals(None, event.error)
+
+    def test_identify(self):
+        self._client.identify()
+        list(self._client.listSets())
+        self.assertEquals(['Identify', 'ListSets'],
+                          [event.verb for event in self._events])
+        self.assertEquals(None, self._events[0].record_count)
+        self.assert_(self._events[1].record_count > 0)
+
+    def test_interleaved(self):
+        # each page is reported with what was built from it, whichever
+        # list is built first
+        records = self._client.listRecords(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc')
+        sets = self._client.listSets()
+        self.assertEquals([], self._events)
+        records = list(records)
+        sets = list(sets)
+        self.assertEquals(['ListRecords', 'ListSets'],
+                          [event.verb for event in self._events])
+        self.assertEquals([len(records), len(sets)],
+                          [event.record_count for event in self._events])
+
+    def test_error(self):
+        # the fake client has no response to this request
+        self.assertRaises(KeyError, self._client.listRecords,
+                          from_=datetime(2004, 01, 01),
+                          metadataPrefix='oai_dc')
+        self.assertEquals(1, len(self._events))
+        self.assert_(isinstance(self._events[0].error, KeyError))
+
+    def test_remove(self):
+        self._client.removeRequestListener(self._events.append)
+        self._client.identify()
+        self.assertEquals([], self._events)
+
+    def test_wait(self):
+        responses = [
+            urllib2.HTTPError('http://test/oai', 503, 'Busy',
+                              {'Retry-After': '0'}, None),
+            StringIO('<OAI-PMH/>')]
+        def urlopen(request):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        event = client.RequestEvent('Identify', {'verb': 'Identify'})
+        self.assertEquals('<OAI-PMH/>', client.retrieveFromUrlWaiting(
+            None, urlopen=urlopen, event=event))
+        self.assertEquals(0, event.wait_time)
+        self.assert_(event.time_to_first_byte >= 0)
+        self.assert_(event.download_time >= 0)
+
+    def test_wait_backoff(self):
+        # without Retry-After the client backs off
+        responses = [
+            urllib2.HTTPError('http://test/oai', 503, 'Busy', {}, None),
+            StringIO('<OAI-PMH/>')]
+        def urlopen(request):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        self.assertEquals('<OAI-PMH/>', client.retrieveFromUrlWaiting(
+            None, wait_default=0, urlopen=urlopen))
+
+class RetryWaitTestCase(TestCase):
+    def test_backoff(self):
+        for attempt in range(8):
+            wait = min(client.WAIT_BACKOFF * 2 ** attempt,
+                       client.WAIT_DEFAULT)
+            for i in range(20):
+                self.assert_(wait / 2.0 <= client.retryWait(attempt) <= wait)
+
+    def test_wait_default(self):
+        self.assert_(client.retryWait(10, wait_default=1) <= 1)
+
+class FakeClock(object):
+    """A clock that only moves when it is told to.
+    """
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+class HedgerTestCase(TestCase):
+    # the hedger runs on a fake clock, and events decide the order in
+    # which attempts finish, so no test depends on how fast it runs
+
+    def setUp(self):
+        self._clock = FakeClock()
+        self._hedger = client.Hedger(clock=self._clock)
+        self._calls = []
+
+    def train(self, seconds=0.01):
+        for i in range(client.HEDGE_MIN_SAMPLES):
+            self._hedger.record(seconds)
+
+    def test_delay(self):
+        self.assertEquals(None, self._hedger.delay())
+        for i in range(client.HEDGE_MIN_SAMPLES * 2):
+            self._hedger.record(i)
+        self.assertEquals(37, self._hedger.delay())
+
+    def test_untrained(self):
+        # nothing is hedged before enough requests were seen
+        def retrieve(event):
+            self._calls.append(event)
+            self._clock.advance(1)
+            return 'slow'
+        self.assertEquals('slow', self._hedger.retrieve(retrieve))
+        self.assertEquals(1, len(self._calls))
+        self.assertEquals(1, self._hedger._durations[-1])
+
+    def test_hedge(self):
+        self.train()
+        done = threading.Event()
+        def retrieve(event):
+            self._calls.append(event)
+            if len(self._calls) == 1:
+                # takes longer than the delay, and does not finish
+                # before the test does
+                self._clock.advance(1)
+                done.wait()
+                return 'slow'
+            return 'fast'
+        event = client.RequestEvent('Identify', {'verb': 'Identify'})
+        try:
+            result = self._hedger.retrieve(retrieve, event)
+        finally:
+            done.set()
+        self.assertEquals('fast', result)
+        self.assertEquals(2, len(self._calls))
+        self.assert_(event.hedged)
+        # each attempt records its timing in an event of its own
+        self.assert_(self._calls[0] is not event)
+        self.assertEquals('Identify', self._calls[1].verb)
+
+    def test_fast(self):
+        self.train()
+        event = client.RequestEvent('Identify', {'verb': 'Identify'})
+        self.assertEquals('fast', self._hedger.retrieve(
+            lambda event: 'fast', event))
+        self.failIf(event.hedged)
+
+    def test_busy(self):
+        # waiting for a busy server neither counts nor gets hedged
+        self.train()
+        def retrieve(event):
+            self._calls.append(event)
+            # the wait is known before it starts
+            event.wait_time = 300
+            self._clock.advance(300.005)
+            return 'waited'
+        event = client.RequestEvent('Identify', {'verb': 'Identify'})
+        self.assertEquals('waited', self._hedger.retrieve(retrieve, event))
+        self.assertEquals(1, len(self._calls))
+        self.failIf(event.hedged)
+        self.assertEquals(300, event.wait_time)
+        self.assertAlmostEquals(0.005, self._hedger._durations[-1])
+        # also before hedging starts
+        hedger = client.Hedger(clock=self._clock)
+        self.assertEquals('waited', hedger.retrieve(retrieve))
+        self.assertAlmostEquals(0.005, hedger._durations[-1])
+
+    def test_error(self):
+        # if the hedged request fails, the first one is waited for
+        self.train()
+        failed = threading.Event()
+        def retrieve(event):
+            self._calls.append(event)
+            if len(self._calls) == 1:
+                self._clock.advance(1)
+                failed.wait()
+                return 'slow'
+            failed.set()
+            raise urllib2.URLError('refused')
+        self.assertEquals('slow', self._hedger.retrieve(retrieve))
+        self.assertEquals(2, len(self._calls))
+        # and if both fail the error is raised
+        def fail(event):
+            raise urllib2.URLError('refused')
+        self.assertRaises(urllib2.URLError, self._hedger.retrieve, fail)
+
 def test_suite():
-    return TestSuite((makeSuite(ClientTestCase), ))
+    return TestSuite((makeSuite(ClientTestCase),
+                      makeSuite(RequestListenerTestCase),
+                      makeSuite(RetryWaitTestCase),
+                      makeSuite(HedgerTestCase)))
 
 if __name__=='__main__':
     main(defaultTest='test_suite')
@@ -0,0 +1,95 @@
+from datetime import datetime
+from unittest import TestCase, TestSuite, main, makeSuite, skipIf
+
+import fakeserver
+from oaipmh import client, common, metadata, server
+try:
+    import numpy
+    from oaipmh import columns
+except ImportError:
+    numpy = None
+
+@skipIf(numpy is None, 'NumPy is not installed')
+class ColumnsTestCase(TestCase):
+    def setUp(self):
+        # make the columns grow while harvesting
+        self._initial_rows = columns.INITIAL_ROWS
+        columns.INITIAL_ROWS = 8
+        metadata_registry = metadata.MetadataRegistry()
+        metadata_registry.registerWriter('oai_dc', server.oai_dc_writer)
+        self._server = server.Server(fakeserver.FakeServerWithSets(),
+                                     metadata_registry,
+                                     resumption_batch_size=7)
+        self._client = client.ServerClient(self._server, metadata_registry)
+
+    def tearDown(self):
+        columns.INITIAL_ROWS = self._initial_rows
+
+    def assertColumns(self, headers, result):
+        self.assertEquals(len(headers), len(result))
+        self.assertEquals([header.identifier() for header in headers],
+                          list(result.identifiers))
+        self.assertEquals(
+            [numpy.datetime64(header.datestamp(), 's') for header in headers],
+            list(result.datestamps))
+        self.assertEquals([header.isDeleted() for header in headers],
+                          list(result.deleted))
+        membership = [[] for header in headers]
+        for row, index in zip(result.set_rows, result.set_indexes):
+            membership[row].append(result.sets[index])
+        self.assertEquals([header.setSpec() for header in headers],
+                          membership)
+
+    def test_listIdentifierColumns(self):
+        result = columns.listIdentifierColumns(
+            self._client, metadataPrefix='oai_dc')
+        headers = list(self._client.listIdentifiers(metadataPrefix='oai_dc'))
+        self.assertEquals(100, len(headers))
+        self.assertColumns(headers, result)
+        self.assertEquals(numpy.dtype('datetime64[s]'),
+                          result.datestamps.dtype)
+        self.assertEquals(['even', 'three', 'odd'], result.sets)
+        # set membership can be counted without a loop
+        counts = numpy.bincount(result.set_indexes)
+        self.assertEquals([50, 34, 50], list(counts))
+
+    def test_compact(self):
+        # pages of HeaderBatch give the same columns
+        headers = list(self._client.listIdentifiers(metadataPrefix='oai_dc'))
+        self._client.compactHeaders(True)
+        self.assertColumns(headers, columns.listIdentifierColumns(
+            self._client, metadataPrefix='oai_dc'))
+
+    def test_fixed_width(self):
+        self._client.compactHeaders(True)
+        result = columns.listIdentifierColumns(
+            self._client, identifier_dtype='S1', metadataPrefix='oai_dc')
+        self.assertEquals(numpy.dtype('S1'), result.identifiers.dtype)
+        # longer identifiers are cut off
+        self.assertEquals(['8', '9', '1'], list(result.identifiers[8:11]))
+
+    def test_unicode(self):
+        headers = [
+            common.Header(None, u'caf\xe9', datetime(2004, 1, 1), [], False),
+            common.Header(None, 'b', datetime(2004, 1, 2), [], False)]
+        for dtype, expected in [
+            (object, [u'caf\xe9', 'b']),
+            ('U8', [u'caf\xe9', u'b']),
+            ('S8', ['caf\xc3\xa9', 'b'])]:
+            result = columns.headerColumns(headers, identifier_dtype=dtype)
+            self.assertEquals(expected, list(result.identifiers))
+
+    def test_headerColumns(self):
+        headers = [
+            common.Header(None, 'a', datetime(1969, 1, 1), [], True),
+            common.Header(None, 'b', datetime(2004, 1, 1, 12), ['x'], False)]
+        self.assertColumns(headers, columns.headerColumns(headers))
+        self.assertColumns(headers, columns.headerColumns(
+            common.HeaderBatch(headers)))
+        self.assertEquals(0, len(columns.headerColumns([])))
+
+def test_suite():
+    return TestSuite((makeSuite(ColumnsTestCase), ))
+
+if __name__=='__main__':
+    main(defaultTest='test_suite')
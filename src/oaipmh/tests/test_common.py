@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import cPickle
+from datetime import datetime
+from unittest import TestCase, TestSuite, main, makeSuite
+
+from oaipmh import common
+
+class HeaderTestCase(TestCase):
+    def test_pickle(self):
+        header = common.Header(None, 'a', datetime(2004, 1, 1), ['x'], True)
+        metadata = common.Metadata(None, {'title': [u'A']})
+        for protocol in [0, 2]:
+            h, m = cPickle.loads(cPickle.dumps((header, metadata), protocol))
+            self.assertEquals('a', h.identifier())
+            self.assertEquals(datetime(2004, 1, 1), h.datestamp())
+            self.assertEquals(['x'], h.setSpec())
+            self.assert_(h.isDeleted())
+            self.assertEquals([u'A'], m['title'])
+
+    def test_slots(self):
+        header = common.Header(None, 'a', datetime(2004, 1, 1), [], False)
+        self.assertRaises(AttributeError, setattr, header, 'foo', 1)
+
+class HeaderBatchTestCase(TestCase):
+    headers = [
+        common.Header(None, 'oai:a:1', datetime(2004, 1, 1, 12, 30, 5),
+                      ['x', 'x:y'], False),
+        common.Header(None, u'oai:a:\xe9', datetime(1969, 7, 20, 20, 17),
+                      [], True),
+        common.Header(None, 'oai:a:3', datetime(2011, 12, 31),
+                      ['x', 'x:y'], False),
+        ]
+
+    def assertHeadersEqual(self, expected, headers):
+        self.assertEquals(len(expected), len(headers))
+        for e_header, header in zip(expected, headers):
+            self.assertEquals(e_header.identifier(), header.identifier())
+            self.assertEquals(type(e_header.identifier()),
+                              type(header.identifier()))
+            self.assertEquals(e_header.datestamp(), header.datestamp())
+            self.assertEquals(e_header.setSpec(), header.setSpec())
+            self.assertEquals(e_header.isDeleted(), header.isDeleted())
+            self.assertEquals(None, header.element())
+
+    def test_headers(self):
+        batch = common.HeaderBatch(self.headers)
+        self.assertEquals(3, len(batch))
+        self.assertHeadersEqual(self.headers, list(batch))
+        self.assertHeadersEqual(self.headers[-1:], [batch[-1]])
+        self.assertRaises(IndexError, batch.__getitem__, 3)
+
+    def test_values(self):
+        batch = common.HeaderBatch(self.headers)
+        self.assertEquals(u'oai:a:\xe9', batch.identifier(1))
+        self.assertEquals(datetime(1969, 7, 20, 20, 17), batch.datestamp(1))
+        self.assert_(batch.isDeleted(1))
+        self.assertEquals(['x', 'x:y'], batch.setSpec(2))
+        # changing the list returned does not change the batch
+        batch.setSpec(2).append('z')
+        self.assertEquals(['x', 'x:y'], batch.setSpec(0))
+
+    def test_extend(self):
+        batch = common.HeaderBatch(self.headers[:1])
+        batch.extend(common.HeaderBatch(self.headers[1:]))
+        self.assertHeadersEqual(self.headers, list(batch))
+
+def test_suite():
+    return TestSuite((makeSuite(HeaderTestCase),
+                      makeSuite(HeaderBatchTestCase)))
+
+if __name__=='__main__':
+    main(defaultTest='test_suite')
@@ -0,0 +1,192 @@
+import os
+import sys
+import time
+import socket
+import urllib2
+import threading
+import cgi
+import gzip
+import zlib
+from StringIO import StringIO
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from datetime import datetime
+from unittest import TestCase, TestSuite, main, makeSuite
+
+from fakeclient import createMapping
+from oaipmh import client, connection, metadata, replay
+
+directory = os.path.dirname(__file__)
+fake1 = os.path.join(directory, 'fake1')
+
+class FakeHandler(BaseHTTPRequestHandler):
+    # keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connection_count += 1
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length'))
+        kw = dict([(key, value[0]) for key, value in
+                   cgi.parse_qs(self.rfile.read(length)).items()])
+        text = self.server.mapping[replay.requestKey(kw)]
+        time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        if 'gzip' in (self.headers.getheader('Accept-Encoding') or ''):
+            self.server.compressed_count += 1
+            text = gzipped(text)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeHTTPServer(HTTPServer):
+    def handle_error(self, request, client_address):
+        # clients that timed out have gone away before the answer
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+class ConnectionPoolTestCase(TestCase):
+    def setUp(self):
+        self._httpd = FakeHTTPServer(('127.0.0.1', 0), FakeHandler)
+        self._httpd.mapping = createMapping(fake1)
+        self._httpd.connection_count = 0
+        self._httpd.compressed_count = 0
+        self._httpd.delay = 0
+        thread = threading.Thread(target=self._httpd.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self._url = 'http://127.0.0.1:%s/oai' % self._httpd.server_port
+        self._pool = connection.ConnectionPool()
+
+    def tearDown(self):
+        self._pool.close()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def createClient(self):
+        registry = metadata.MetadataRegistry()
+        registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        return client.Client(self._url, registry,
+                             connection_pool=self._pool)
+
+    def test_reuse(self):
+        oaiclient = self.createClient()
+        self.assertEquals('2.0', oaiclient.identify().protocolVersion())
+        oaiclient.listMetadataFormats()
+        records = list(oaiclient.listRecords(from_=datetime(2003, 04, 10),
+                                             metadataPrefix='oai_dc'))
+        self.assert_(records)
+        self.assertEquals(1, self._httpd.connection_count)
+
+    def test_shared_pool(self):
+        self.createClient().identify()
+        self.createClient().listSets()
+        self.assertEquals(1, self._httpd.connection_count)
+
+    def test_streaming(self):
+        oaiclient = self.createClient()
+        oaiclient.streamRecords(True)
+        for i in range(2):
+            headers = list(oaiclient.listIdentifiers(
+                from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+            self.assertEquals(16, len(headers))
+        self.assertEquals(1, self._httpd.connection_count)
+
+    def test_compression(self):
+        oaiclient = self.createClient()
+        oaiclient.updateCompression()
+        self.assertEquals(0, self._httpd.compressed_count)
+        records = list(oaiclient.listRecords(from_=datetime(2003, 04, 10),
+                                             metadataPrefix='oai_dc'))
+        self.assertEquals(1, self._httpd.compressed_count)
+        self.assertEquals('hdl:1765/308', records[0][0].identifier())
+        oaiclient.streamRecords(True)
+        headers = list(oaiclient.listIdentifiers(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+        self.assertEquals(2, self._httpd.compressed_count)
+        self.assertEquals(16, len(headers))
+        self.assertEquals(1, self._httpd.connection_count)
+
+    def test_timeout(self):
+        self._httpd.delay = 0.5
+        oaiclient = self.createClient()
+        oaiclient.setTimeouts(connect=5, read=0.1)
+        self.assertRaises(socket.timeout, oaiclient.identify)
+        # without a connection pool
+        oaiclient = client.Client(self._url, metadata.MetadataRegistry())
+        oaiclient.setTimeouts(read=0.1)
+        self.assertRaises((socket.timeout, urllib2.URLError),
+                          oaiclient.identify)
+        self._httpd.delay = 0
+        oaiclient.setTimeouts(read=5)
+        self.assertEquals('2.0', oaiclient.identify().protocolVersion())
+
+    def test_timeout_reused(self):
+        # the timeout of a request does not stay on its connection
+        oaiclient = self.createClient()
+        oaiclient.setTimeouts(read=0.1)
+        oaiclient.identify()
+        self._httpd.delay = 0.3
+        oaiclient.setTimeouts()
+        self.assertEquals('2.0', oaiclient.identify().protocolVersion())
+        self.assertEquals(1, self._httpd.connection_count)
+
+class FakeResponse(StringIO):
+    def __init__(self, data, encoding):
+        StringIO.__init__(self, data)
+        self._headers = {'Content-Encoding': encoding}
+
+    def info(self):
+        return self._headers
+
+class DecompressTestCase(TestCase):
+    text = '<OAI-PMH>%s</OAI-PMH>' % ('<record/>' * 10000)
+
+    def assertDecompresses(self, data, encoding):
+        response = connection.decompressResponse(
+            FakeResponse(data, encoding))
+        chunks = []
+        while 1:
+            chunk = response.read(1000)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.assertEquals(self.text, ''.join(chunks))
+        response = connection.decompressResponse(
+            FakeResponse(data, encoding))
+        self.assertEquals(self.text, response.read())
+
+    def test_gzip(self):
+        self.assertDecompresses(gzipped(self.text), 'gzip')
+
+    def test_deflate(self):
+        self.assertDecompresses(zlib.compress(self.text), 'deflate')
+
+    def test_raw_deflate(self):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        data = compressor.compress(self.text) + compressor.flush()
+        self.assertDecompresses(data, 'deflate')
+
+    def test_identity(self):
+        response = FakeResponse(self.text, 'identity')
+        self.assert_(connection.decompressResponse(response) is response)
+
+def gzipped(text):
+    f = StringIO()
+    gzip_file = gzip.GzipFile(fileobj=f, mode='wb')
+    gzip_file.write(text)
+    gzip_file.close()
+    return f.getvalue()
+
+def test_suite():
+    return TestSuite((makeSuite(ConnectionPoolTestCase),
+                      makeSuite(DecompressTestCase)))
+
+if __name__=='__main__':
+    main(defaultTest='test_suite')
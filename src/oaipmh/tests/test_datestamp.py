@@ -1,7 +1,7 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest import TestCase, TestSuite, makeSuite
 from oaipmh.datestamp import datestamp_to_datetime,\
-     tolerant_datestamp_to_datetime
+     tolerant_datestamp_to_datetime, split_datetime_range
 from oaipmh.error import DatestampError
 
 class DatestampTestCase(TestCase):
@@ -63,5 +63,34 @@ class DatestampTestCase(TestCase):
             datetime(2005, 2, 1),
             f('2005-02'))
         
+    def test_split_datetime_range(self):
+        start = datetime(2005, 1, 1, 10, 0, 0, 500)
+        end = datetime(2005, 1, 1, 10, 0, 9)
+        windows = split_datetime_range(start, end, 4)
+        self.assertEquals(
+            [(datetime(2005, 1, 1, 10, 0, 0), datetime(2005, 1, 1, 10, 0, 2)),
+             (datetime(2005, 1, 1, 10, 0, 3), datetime(2005, 1, 1, 10, 0, 5)),
+             (datetime(2005, 1, 1, 10, 0, 6), datetime(2005, 1, 1, 10, 0, 8)),
+             (datetime(2005, 1, 1, 10, 0, 9), datetime(2005, 1, 1, 10, 0, 9))],
+            windows)
+        # fewer seconds than windows
+        self.assertEquals(
+            [(datetime(2005, 1, 1), datetime(2005, 1, 1)),
+             (datetime(2005, 1, 1, 0, 0, 1), datetime(2005, 1, 1, 0, 0, 1))],
+            split_datetime_range(datetime(2005, 1, 1),
+                                 datetime(2005, 1, 1, 0, 0, 1), 10))
+
+    def test_split_datetime_range_days(self):
+        windows = split_datetime_range(datetime(2005, 1, 1, 12, 0),
+                                       datetime(2005, 12, 31, 8, 0), 7,
+                                       day_granularity=True)
+        self.assertEquals(7, len(windows))
+        self.assertEquals(datetime(2005, 1, 1), windows[0][0])
+        self.assertEquals(datetime(2005, 12, 31), windows[-1][1])
+        # windows are adjacent days
+        for (from1, until1), (from2, until2) in zip(windows, windows[1:]):
+            self.assertEquals(timedelta(days=1), from2 - until1)
+            self.assertEquals(0, from2.hour)
+
 def test_suite():
     return TestSuite((makeSuite(DatestampTestCase), ))
@@ -0,0 +1,92 @@
+import os
+import pickle
+from unittest import TestCase, TestSuite, main, makeSuite
+from lxml import etree
+
+from oaipmh import metadata
+
+directory = os.path.dirname(__file__)
+
+NS_OAIPMH = 'http://www.openarchives.org/OAI/2.0/'
+
+def evaluateFields(fields, namespaces, element):
+    """Evaluate reader fields one XPath at a time, for comparison.
+    """
+    e = etree.XPathEvaluator(element, namespaces=namespaces).evaluate
+    result = {}
+    for field_name, (field_type, expr) in fields.items():
+        if field_type == 'bytes':
+            value = str(e(expr))
+        elif field_type == 'bytesList':
+            value = [str(item) for item in e(expr)]
+        elif field_type == 'text':
+            value = unicode(e(expr))
+        else:
+            value = [unicode(v) for v in e(expr)]
+        result[field_name] = value
+    return result
+
+class MetadataReaderTestCase(TestCase):
+    namespaces = {'a': 'http://a', 'b': 'http://b'}
+
+    fields = {
+        'title': ('textList', 'a:x/b:title/text()'),
+        'title_again': ('bytesList', 'a:x/b:title/text()'),
+        'other': ('textList', 'a:x/b:other/text()'),
+        'deep': ('textList', 'a:x/a:y/b:deep/text()'),
+        'plain': ('textList', 'plain/text()'),
+        'first': ('text', 'string(a:x/b:title/text())'),
+        'attribute': ('bytes', 'string(a:x/@id)'),
+        'attributes': ('textList', 'a:x/b:title/@lang'),
+        }
+
+    xml = '''<metadata xmlns:a="http://a" xmlns:b="http://b">
+      <a:x id="1">
+        <b:title lang="en">One</b:title>
+        <b:title>Two<!-- comment -->Three<b:i>in</b:i>Four</b:title>
+        <b:title/>
+        <a:y><b:deep>Deep</b:deep></a:y>
+        <b:title>  spaced  </b:title>
+      </a:x>
+      <plain>Plain</plain>
+      <a:x id="2"><b:title lang="nl">Five</b:title><b:other>Other</b:other></a:x>
+    </metadata>'''
+
+    def test_fields(self):
+        element = etree.XML(self.xml)
+        reader = metadata.MetadataReader(self.fields, self.namespaces)
+        self.assertEquals(
+            evaluateFields(self.fields, self.namespaces, element),
+            reader(element).getMap())
+        self.assertEquals(
+            [u'One', u'Two', u'Three', u'Four', u'  spaced  ', u'Five'],
+            reader(element)['title'])
+
+    def test_unknown_field_type(self):
+        reader = metadata.MetadataReader(
+            {'foo': ('foo', 'string(foo)')})
+        self.assertRaises(metadata.Error, reader, etree.XML('<foo/>'))
+
+    def test_pickle(self):
+        element = etree.XML(self.xml)
+        reader = metadata.MetadataReader(self.fields, self.namespaces)
+        unpickled = pickle.loads(pickle.dumps(reader))
+        self.assertEquals(reader(element).getMap(),
+                          unpickled(element).getMap())
+
+    def test_oai_dc(self):
+        tree = etree.parse(os.path.join(directory, 'fake2', '00002.xml'))
+        elements = tree.xpath('//oai:metadata',
+                              namespaces={'oai': NS_OAIPMH})
+        self.assert_(elements)
+        reader = metadata.oai_dc_reader
+        for element in elements:
+            self.assertEquals(
+                evaluateFields(reader._fields, reader._namespaces, element),
+                reader(element).getMap())
+
+def test_suite():
+    return TestSuite((makeSuite(MetadataReaderTestCase), ))
+
+if __name__=='__main__':
+    main(defaultTest='test_suite')
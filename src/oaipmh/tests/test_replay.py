@@ -0,0 +1,67 @@
+import os
+from datetime import datetime
+from unittest import TestCase, TestSuite, main, makeSuite
+
+from fakeclient import FakeClient
+from oaipmh import metadata, replay
+
+directory = os.path.dirname(__file__)
+fake1 = os.path.join(directory, 'fake1')
+
+class ReplayClientTestCase(TestCase):
+    def setUp(self):
+        registry = metadata.MetadataRegistry()
+        registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        self._client = replay.ReplayClient(fake1, registry)
+        self._fakeclient = FakeClient(fake1)
+        # not the global registry, which other tests fill
+        self._fakeclient._metadata_registry = registry
+
+    def tearDown(self):
+        self._client.close()
+
+    def assertSameRecords(self, expected, records):
+        self.assertEquals(len(expected), len(records))
+        for (header, metadata, about), (e_header, e_metadata, e_about) in zip(
+            records, expected):
+            self.assertEquals(e_header.identifier(), header.identifier())
+            self.assertEquals(e_header.datestamp(), header.datestamp())
+            self.assertEquals(e_metadata.getMap(), metadata.getMap())
+
+    def test_identify(self):
+        identify = self._client.identify()
+        self.assertEquals(self._fakeclient.identify().repositoryName(),
+                          identify.repositoryName())
+
+    def test_listRecords(self):
+        expected = list(self._fakeclient.listRecords(
+            from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+        for stream in [False, True]:
+            self._client.streamRecords(stream)
+            records = list(self._client.listRecords(
+                from_=datetime(2003, 04, 10), metadataPrefix='oai_dc'))
+            self.assertSameRecords(expected, records)
+
+    def test_unrecorded(self):
+        self.assertRaises(replay.Error, self._client.listRecords,
+                          from_=datetime(2001, 1, 1), metadataPrefix='oai_dc')
+
+    def test_read(self):
+        f = open(os.path.join(fake1, '00001.xml'), 'rb')
+        text = f.read()
+        f.close()
+        response = self._client.makeRequestStream(verb='Identify')
+        chunks = []
+        while 1:
+            chunk = response.read(100)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.assertEquals(text, ''.join(chunks))
+        self.assertEquals(text, self._client.makeRequest(verb='Identify'))
+
+def test_suite():
+    return TestSuite((makeSuite(ReplayClientTestCase), ))
+
+if __name__=='__main__':
+    main(defaultTest='test_suite')
@@ -1,5 +1,6 @@
 import unittest
 import os
+import multiprocessing
 from StringIO import StringIO
 from oaipmh import server, client, common, metadata, error
 from lxml import etree
@@ -233,7 +234,165 @@ class ClientServerTestCase(unittest.TestCase):
                           metadataPrefix='oai_dc', from_=datetime(2003, 1, 1),
                           until=datetime(2003, 7, 1))        
         
-        
+    def test_listRecords_streaming(self):
+        self._client.streamRecords(True)
+        records = self._client.listRecords(metadataPrefix='oai_dc')
+        result = [metadata.getField('title')[0]
+                  for (header, metadata, about) in records]
+        expected = ['Title %s' % i for i in range(100)]
+        self.assertEquals(expected, result)
+
+    def test_listIdentifiersFromUntil_streaming(self):
+        self._client.streamRecords(True)
+        headers = self._client.listIdentifiers(metadataPrefix='oai_dc',
+                                               from_=datetime(2004, 1, 1),
+                                               until=datetime(2004, 7, 1))
+        self.assertEquals(52, len(list(headers)))
+
+    def test_listIdentifiersFromUntil_nothing_streaming(self):
+        self._client.streamRecords(True)
+        self.assertRaises(error.NoRecordsMatchError,
+                          self._client.listIdentifiers,
+                          metadataPrefix='oai_dc', from_=datetime(2003, 1, 1),
+                          until=datetime(2003, 7, 1))
+
+    def test_listRecords_prefetch(self):
+        self._client.prefetchBatches(2)
+        records = self._client.listRecords(metadataPrefix='oai_dc')
+        result = [metadata.getField('title')[0]
+                  for (header, metadata, about) in records]
+        expected = ['Title %s' % i for i in range(100)]
+        self.assertEquals(expected, result)
+
+    def test_listIdentifiers_prefetch_error(self):
+        # an error retrieving a later batch reaches the consumer
+        self._client.prefetchBatches(1)
+        makeRequest = self._client.makeRequest
+        def brokenMakeRequest(**kw):
+            if 'resumptionToken' in kw:
+                kw['resumptionToken'] = 'broken'
+            return makeRequest(**kw)
+        self._client.makeRequest = brokenMakeRequest
+        headers = self._client.listIdentifiers(metadataPrefix='oai_dc')
+        self.assertRaises(error.BadResumptionTokenError, list, headers)
+
+    def test_listRecords_process_pool(self):
+        pool = multiprocessing.Pool(2)
+        try:
+            self._client.useProcessPool(pool, pages_ahead=3)
+            records = list(self._client.listRecords(metadataPrefix='oai_dc'))
+        finally:
+            pool.terminate()
+        self.assertEquals([str(i) for i in range(100)],
+                          [header.identifier() for header, m, a in records])
+        self.assertEquals(['Title %s' % i for i in range(100)],
+                          [metadata.getField('title')[0]
+                           for h, metadata, a in records])
+
+    def test_listRecords_process_pool_events(self):
+        # pages fetched for the pool do not end up in the event of a
+        # list that is still to be built
+        events = []
+        self._client.addRequestListener(events.append)
+        headers = self._client.listIdentifiers(metadataPrefix='oai_dc')
+        pool = multiprocessing.Pool(1)
+        try:
+            self._client.useProcessPool(pool)
+            list(self._client.listRecords(metadataPrefix='oai_dc'))
+        finally:
+            pool.terminate()
+        self.assertEquals([], events)
+        first = headers.next()
+        self.assertEquals(1, len(events))
+        self.assertEquals('ListIdentifiers', events[0].verb)
+        self.assertEquals(
+            len(self._server.handleRequest(
+                {'verb': 'ListIdentifiers', 'metadataPrefix': 'oai_dc'})),
+            events[0].bytes_received)
+
+    def test_listRecords_process_pool_nothing(self):
+        pool = multiprocessing.Pool(1)
+        try:
+            self._client.useProcessPool(pool)
+            self.assertRaises(error.NoRecordsMatchError,
+                              self._client.listRecords,
+                              metadataPrefix='oai_dc',
+                              from_=datetime(2003, 1, 1),
+                              until=datetime(2003, 7, 1))
+        finally:
+            pool.terminate()
+
+
+class SetHarvestTestCase(unittest.TestCase):
+    def setUp(self):
+        metadata_registry = metadata.MetadataRegistry()
+        metadata_registry.registerWriter('oai_dc', server.oai_dc_writer)
+        metadata_registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        self._server = server.Server(fakeserver.FakeServerWithSets(),
+                                     metadata_registry,
+                                     resumption_batch_size=7)
+        self._client = client.ServerClient(self._server, metadata_registry)
+
+    def test_listRecordsPerSet(self):
+        records = self._client.listRecordsPerSet(
+            workers=2, sets=['even', 'odd', 'three'],
+            metadataPrefix='oai_dc')
+        identifiers = [header.identifier() for header, m, a in records]
+        # every record once, though some are in two sets
+        self.assertEquals(sorted([str(i) for i in range(100)]),
+                          sorted(identifiers))
+
+    def test_listRecordsPerSet_errors(self):
+        records = self._client.listRecordsPerSet(
+            workers=3, metadataPrefix='oai_dc',
+            from_=datetime(2004, 1, 1), until=datetime(2004, 7, 1))
+        identifiers = []
+        try:
+            for header, metadata, about in records:
+                identifiers.append(header.identifier())
+        except error.SetHarvestError, e:
+            self.assertEquals(['broken'], e.failures.keys())
+            self.assert_(isinstance(e.failures['broken'],
+                                    error.BadArgumentError))
+        else:
+            self.fail('SetHarvestError not raised')
+        # the other sets were harvested completely
+        self.assertEquals(52, len(identifiers))
+        self.assertEquals(52, len(set(identifiers)))
+
+    def test_listRecordsPerWindow(self):
+        records = self._client.listRecordsPerWindow(
+            windows=6, metadataPrefix='oai_dc',
+            until=datetime(2004, 12, 31))
+        identifiers = [header.identifier() for header, m, a in records]
+        self.assertEquals(sorted([str(i) for i in range(100)]),
+                          sorted(identifiers))
+
+    def test_listRecordsPerWindow_open(self):
+        records = self._client.listRecordsPerWindow(
+            windows=3, workers=2, metadataPrefix='oai_dc',
+            from_=datetime(2004, 7, 1, 23, 0))
+        identifiers = [header.identifier() for header, m, a in records]
+        expected = [header.identifier() for header, m, a in
+                    self._client.listRecords(
+                        metadataPrefix='oai_dc',
+                        from_=datetime(2004, 7, 1, 23, 0))]
+        self.assertEquals(sorted(expected), sorted(identifiers))
+
+    def test_raw(self):
+        self._client.rawRecords(True)
+        for records in [
+            self._client.listRecordsPerSet(
+                workers=2, sets=['even', 'odd', 'three'],
+                metadataPrefix='oai_dc'),
+            self._client.listRecordsPerWindow(
+                windows=6, metadataPrefix='oai_dc',
+                until=datetime(2004, 12, 31))]:
+            identifiers = [identifier for identifier, datestamp, deleted, xml
+                           in records]
+            self.assertEquals(sorted([str(i) for i in range(100)]),
+                              sorted(identifiers))
+
 class ErrorTestCase(unittest.TestCase):
     def setUp(self):
         self._fakeserver = fakeserver.FakeServer()
@@ -400,8 +559,299 @@ class NsMapTestCase(unittest.TestCase):
         self.assertEquals(
             'http://www.cow.com',
             tree.getroot().nsmap['cow'])
-        
-        
+
+def withoutResponseDate(xml):
+    # the responses may have been made in different seconds
+    before, rest = xml.split('<responseDate>', 1)
+    return before + rest.split('</responseDate>', 1)[1]
+
+class StreamingClient(client.BaseClient):
+    def __init__(self, server, metadata_registry=None):
+        client.BaseClient.__init__(self, metadata_registry)
+        self._server = server
+
+    def makeRequest(self, **kw):
+        return ''.join(self._server.handleRequestStream(kw))
+
+class StreamingTestCase(unittest.TestCase):
+    def setUp(self):
+        metadata_registry = metadata.MetadataRegistry()
+        metadata_registry.registerWriter('oai_dc', server.oai_dc_writer)
+        metadata_registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        self._metadata_registry = metadata_registry
+        self._server = server.BatchingServer(
+            fakeserver.BatchingFakeServer(), metadata_registry,
+            resumption_batch_size=7)
+        self._client = client.ServerClient(self._server, metadata_registry)
+        self._streaming_client = StreamingClient(self._server,
+                                                 metadata_registry)
+
+    def test_listRecords(self):
+        expected = list(self._client.listRecords(metadataPrefix='oai_dc'))
+        records = list(self._streaming_client.listRecords(
+            metadataPrefix='oai_dc'))
+        self.assertEquals(len(expected), len(records))
+        for (header, metadata, about), (e_header, e_metadata, e_about) in \
+                zip(records, expected):
+            self.assertEquals(e_header.identifier(), header.identifier())
+            self.assertEquals(e_metadata.getMap(), metadata.getMap())
+
+    def test_listIdentifiers(self):
+        headers = self._streaming_client.listIdentifiers(
+            metadataPrefix='oai_dc')
+        self.assertEquals([str(i) for i in range(100)],
+                          [header.identifier() for header in headers])
+
+    def test_listSets(self):
+        sets_server = server.Server(fakeserver.FakeServerWithSets(),
+                                    self._metadata_registry,
+                                    resumption_batch_size=2)
+        self.assertEquals(
+            list(client.ServerClient(sets_server).listSets()),
+            list(StreamingClient(sets_server).listSets()))
+        xml = ''.join(sets_server.handleRequestStream({'verb': 'ListSets'}))
+        self.assert_(oaischema.validate(etree.parse(StringIO(xml))))
+
+    def test_valid(self):
+        for kw in [{'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'},
+                   {'verb': 'ListIdentifiers', 'metadataPrefix': 'oai_dc'},
+                   {'verb': 'Identify'}]:
+            xml = ''.join(self._server.handleRequestStream(kw))
+            tree = etree.parse(StringIO(xml))
+            self.assert_(oaischema.validate(tree))
+
+    def test_same_bytes(self):
+        # streaming gives what handleRequest gives, namespaces and all
+        sets_server = server.Server(fakeserver.FakeServerWithSets(),
+                                    self._metadata_registry,
+                                    resumption_batch_size=2)
+        for oai_server, kw in [
+                (self._server,
+                 {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'}),
+                (self._server,
+                 {'verb': 'ListIdentifiers', 'metadataPrefix': 'oai_dc'}),
+                (sets_server, {'verb': 'ListSets'})]:
+            expected = oai_server.handleRequest(kw)
+            for chunk_size in [0, server.STREAM_CHUNK_SIZE]:
+                xml = ''.join(oai_server.handleRequestStream(kw, chunk_size))
+                self.assertEquals(len(expected), len(xml))
+                self.assertEquals(withoutResponseDate(expected),
+                                  withoutResponseDate(xml))
+
+    def test_empty(self):
+        envelope, e_list, items = self._server._tree_server.listStream(
+            'ListIdentifiers', metadataPrefix='oai_dc')
+        self.assertEquals(
+            [etree.tostring(envelope, encoding='UTF-8',
+                            xml_declaration=True, pretty_print=True)],
+            list(server.streamResponse(envelope, e_list, iter([]))))
+
+    def test_chunks(self):
+        # the records are written one at a time
+        chunks = list(self._server.handleRequestStream(
+            {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'},
+            chunk_size=0))
+        # a chunk per record, and for the resumption token and the end
+        self.assertEquals(9, len(chunks))
+        self.assertEquals(1, len(list(self._server.handleRequestStream(
+            {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'}))))
+        self.assertEquals(1, len(list(self._server.handleRequestStream(
+            {'verb': 'Identify'}))))
+
+    def test_errors(self):
+        for kw, code in [
+            ({'verb': 'ListRecords', 'metadataPrefix': 'nonexistent'},
+             'cannotDisseminateFormat'),
+            ({'verb': 'ListRecords', 'resumptionToken': 'foobar'},
+             'badResumptionToken'),
+            ({'verb': 'Frotz'}, 'badVerb')]:
+            chunks = list(self._server.handleRequestStream(kw))
+            self.assertEquals(1, len(chunks))
+            tree = etree.XML(chunks[0])
+            self.assertEquals([code], tree.xpath(
+                '//oai:error/@code', namespaces={'oai': NS_OAIPMH}))
+
+class CountingFakeServer(fakeserver.FakeServer):
+    def __init__(self):
+        fakeserver.FakeServer.__init__(self)
+        self.identify_count = 0
+
+    def identify(self):
+        self.identify_count += 1
+        return fakeserver.FakeServer.identify(self)
+
+class IdentifyCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self._fakeserver = CountingFakeServer()
+        self._metadata_registry = metadata.MetadataRegistry()
+        self._metadata_registry.registerWriter('oai_dc',
+                                               server.oai_dc_writer)
+
+    def createServer(self, identify_ttl):
+        return server.Server(self._fakeserver, self._metadata_registry,
+                             identify_ttl=identify_ttl)
+
+    def handleRequests(self, oaiserver):
+        for kw in [{'verb': 'Identify'},
+                   {'verb': 'ListIdentifiers', 'metadataPrefix': 'oai_dc'},
+                   {'verb': 'Frotz'},
+                   {'verb': 'Identify'}]:
+            oaiserver.handleRequest(kw)
+
+    def test_uncached(self):
+        # Identify responses ask twice, for the envelope and the body
+        self.handleRequests(self.createServer(None))
+        self.assertEquals(6, self._fakeserver.identify_count)
+
+    def test_cached(self):
+        oaiserver = self.createServer(60)
+        self.handleRequests(oaiserver)
+        self.assertEquals(1, self._fakeserver.identify_count)
+        oaiserver.invalidateIdentify()
+        self.handleRequests(oaiserver)
+        self.assertEquals(2, self._fakeserver.identify_count)
+
+    def test_expired(self):
+        oaiserver = self.createServer(0)
+        for i in range(3):
+            oaiserver.handleRequest({'verb': 'ListIdentifiers',
+                                     'metadataPrefix': 'oai_dc'})
+        self.assertEquals(3, self._fakeserver.identify_count)
+
+    def test_rendered(self):
+        # the rendered response is the same as the one built every time
+        def withoutDate(xml):
+            tree = etree.XML(xml)
+            date = tree.find('{%s}responseDate' % NS_OAIPMH)
+            self.assertEquals(20, len(date.text))
+            date.text = ''
+            return etree.tostring(tree)
+        expected = self.createServer(None).handleRequest({'verb': 'Identify'})
+        oaiserver = self.createServer(60)
+        for i in range(2):
+            xml = oaiserver.handleRequest({'verb': 'Identify'})
+            self.assertEquals(withoutDate(expected), withoutDate(xml))
+        self.assert_(oaischema.validate(etree.parse(StringIO(xml))))
+
+class ListCountingFakeServer(fakeserver.FakeServer):
+    """Counts its lists, which are generators if generate is set.
+    """
+    def __init__(self, generate=False):
+        fakeserver.FakeServer.__init__(self)
+        self.list_count = 0
+        self._generate = generate
+
+    def listIdentifiers(self, **kw):
+        self.list_count += 1
+        result = fakeserver.FakeServer.listIdentifiers(self, **kw)
+        if self._generate:
+            return iter(result)
+        return result
+
+class ResumptionSessionsTestCase(unittest.TestCase):
+    def createResumption(self, fakeserver, **kw):
+        return server.Resumption(fakeserver, 10,
+                                 server.ResumptionSessions(**kw))
+
+    def harvest(self, resumption, **kw):
+        tokens = []
+        headers, token = resumption.listIdentifiers(metadataPrefix='oai_dc',
+                                                    **kw)
+        while token is not None:
+            tokens.append(token)
+            result, token = resumption.listIdentifiers(resumptionToken=token)
+            headers.extend(result)
+        return [header.identifier() for header in headers], tokens
+
+    def test_snapshot(self):
+        fakeserver = ListCountingFakeServer()
+        identifiers, tokens = self.harvest(self.createResumption(fakeserver))
+        self.assertEquals([str(i) for i in range(100)], identifiers)
+        self.assertEquals(9, len(tokens))
+        self.assertEquals(1, fakeserver.list_count)
+
+    def test_iterator(self):
+        fakeserver = ListCountingFakeServer(generate=True)
+        resumption = self.createResumption(fakeserver)
+        identifiers, tokens = self.harvest(resumption)
+        self.assertEquals([str(i) for i in range(100)], identifiers)
+        self.assertEquals(1, fakeserver.list_count)
+        # the last batch can be asked for again, but not an earlier one
+        headers, token = resumption.listIdentifiers(resumptionToken=tokens[-1])
+        self.assertEquals([str(i) for i in range(90, 100)],
+                          [header.identifier() for header in headers])
+        self.assertEquals(None, token)
+        self.assertRaises(error.BadResumptionTokenError,
+                          resumption.listIdentifiers,
+                          resumptionToken=tokens[0])
+
+    def test_arguments(self):
+        # the arguments of the request are kept in the tokens
+        fakeserver = ListCountingFakeServer()
+        identifiers, tokens = self.harvest(
+            self.createResumption(fakeserver), from_=datetime(2004, 1, 1),
+            until=datetime(2004, 6, 30))
+        self.assertEquals(
+            [header.identifier() for header in fakeserver.listIdentifiers(
+                from_=datetime(2004, 1, 1), until=datetime(2004, 6, 30))],
+            identifiers)
+        kw, cursor = server.decodeResumptionToken(tokens[0])
+        self.assertEquals(datetime(2004, 1, 1), kw['from_'])
+        self.assertEquals('oai_dc', kw['metadataPrefix'])
+        self.assertEquals(10, cursor)
+
+    def test_single_batch(self):
+        sessions = server.ResumptionSessions()
+        resumption = server.Resumption(ListCountingFakeServer(), 100,
+                                       sessions)
+        headers, token = resumption.listIdentifiers(metadataPrefix='oai_dc')
+        self.assertEquals(100, len(headers))
+        self.assertEquals(None, token)
+        self.assertEquals(0, len(sessions))
+
+    def test_too_large(self):
+        # a result larger than the store is asked for again
+        fakeserver = ListCountingFakeServer()
+        resumption = self.createResumption(fakeserver, max_items=50)
+        identifiers, tokens = self.harvest(resumption)
+        self.assertEquals([str(i) for i in range(100)], identifiers)
+        self.assertEquals(10, fakeserver.list_count)
+
+    def test_evicted(self):
+        sessions = server.ResumptionSessions(max_items=250)
+        resumption = server.Resumption(ListCountingFakeServer(), 10,
+                                       sessions)
+        tokens = [resumption.listIdentifiers(metadataPrefix='oai_dc')[1]
+                  for i in range(3)]
+        self.assertEquals(2, len(sessions))
+        # using the second session makes the first one the oldest
+        resumption.listIdentifiers(resumptionToken=tokens[1])
+        resumption.listIdentifiers(metadataPrefix='oai_dc')
+        self.assertEquals(2, len(sessions))
+        resumption.listIdentifiers(resumptionToken=tokens[1])
+        for token in tokens[0], tokens[2]:
+            self.assertRaises(error.BadResumptionTokenError,
+                              resumption.listIdentifiers,
+                              resumptionToken=token)
+
+    def test_expired(self):
+        metadata_registry = metadata.MetadataRegistry()
+        metadata_registry.registerWriter('oai_dc', server.oai_dc_writer)
+        oaiserver = server.Server(
+            ListCountingFakeServer(), metadata_registry,
+            resumption_sessions=server.ResumptionSessions(ttl=0))
+        xml = oaiserver.handleRequest({'verb': 'ListIdentifiers',
+                                       'metadataPrefix': 'oai_dc'})
+        tree = etree.XML(xml)
+        token = tree.xpath('//oai:resumptionToken/text()',
+                           namespaces={'oai': NS_OAIPMH})[0]
+        xml = oaiserver.handleRequest({'verb': 'ListIdentifiers',
+                                       'resumptionToken': token})
+        tree = etree.XML(xml)
+        self.assertEquals(['badResumptionToken'], tree.xpath(
+            '//oai:error/@code', namespaces={'oai': NS_OAIPMH}))
+        self.assert_(oaischema.validate(tree))
+
 def test_suite():
     return unittest.TestSuite([
         unittest.makeSuite(XMLTreeServerTestCase),
@@ -409,9 +859,13 @@ def test_suite():
         unittest.makeSuite(ResumptionTestCase),
         unittest.makeSuite(BatchingResumptionTestCase),
         unittest.makeSuite(ClientServerTestCase),
+        unittest.makeSuite(SetHarvestTestCase),
         unittest.makeSuite(ErrorTestCase),
         unittest.makeSuite(DeletionTestCase),
-        unittest.makeSuite(NsMapTestCase)])
+        unittest.makeSuite(NsMapTestCase),
+        unittest.makeSuite(StreamingTestCase),
+        unittest.makeSuite(IdentifyCacheTestCase),
+        unittest.makeSuite(ResumptionSessionsTestCase)])
 
 if __name__=='__main__':
     main(defaultTest='test_suite')
@@ -0,0 +1,138 @@
+import shutil
+import tempfile
+from datetime import datetime
+from unittest import TestCase, TestSuite, main, makeSuite
+
+import synthetic
+from oaipmh import client, error, metadata, replay
+
+def createRegistry():
+    registry = metadata.MetadataRegistry()
+    registry.registerReader('oai_dc', metadata.oai_dc_reader)
+    return registry
+
+class SyntheticRepositoryTestCase(TestCase):
+    def setUp(self):
+        self._repository = synthetic.SyntheticRepository(
+            record_count=500, set_fanout=(3, 2), deleted_ratio=0.1,
+            metadata_size=100)
+        self._client = client.ServerClient(
+            synthetic.createServer(self._repository, batch_size=30),
+            createRegistry())
+
+    def test_listRecords(self):
+        records = list(self._client.listRecords(metadataPrefix='oai_dc'))
+        self.assertEquals(500, len(records))
+        datestamps = [header.datestamp() for header, m, a in records]
+        self.assertEquals(sorted(datestamps), datestamps)
+        deleted = [header for header, m, a in records if header.isDeleted()]
+        self.assert_(30 < len(deleted) < 70)
+        for header, metadata, about in records:
+            if header.isDeleted():
+                self.assertEquals(None, metadata)
+            else:
+                self.assert_(len(metadata['description'][0]) >= 100)
+
+    def test_same(self):
+        # the same arguments give the same repository
+        other = synthetic.SyntheticRepository(
+            record_count=500, set_fanout=(3, 2), deleted_ratio=0.1,
+            metadata_size=100)
+        for i in [0, 17, 499]:
+            header, metadata, about = self._repository.record(i)
+            o_header, o_metadata, o_about = other.record(i)
+            self.assertEquals(header.datestamp(), o_header.datestamp())
+            self.assertEquals(header.isDeleted(), o_header.isDeleted())
+            if metadata is not None:
+                self.assertEquals(metadata.getMap(), o_metadata.getMap())
+
+    def test_sets(self):
+        sets = [setSpec for setSpec, setName, d in self._client.listSets()]
+        self.assertEquals(['a0', 'a0:b0', 'a0:b1', 'a1', 'a1:b0', 'a1:b1',
+                           'a2', 'a2:b0', 'a2:b1'], sets)
+        headers = list(self._client.listIdentifiers(metadataPrefix='oai_dc'))
+        for setSpec in ['a1', 'a2:b0']:
+            expected = [header.identifier() for header in headers
+                        if header.setSpec()[0] == setSpec or
+                        header.setSpec()[0].startswith(setSpec + ':')]
+            self.assertEquals(expected, [
+                header.identifier() for header in self._client.listIdentifiers(
+                    metadataPrefix='oai_dc', set=setSpec)])
+
+    def test_range(self):
+        headers = list(self._client.listIdentifiers(metadataPrefix='oai_dc'))
+        from_ = datetime(2003, 1, 1)
+        until = datetime(2004, 6, 30)
+        expected = [header.identifier() for header in headers
+                    if from_ <= header.datestamp() <= until and
+                    header.setSpec() == ['a0:b1']]
+        self.assertEquals(expected, [
+            header.identifier() for header in self._client.listIdentifiers(
+                metadataPrefix='oai_dc', set='a0:b1', from_=from_,
+                until=until)])
+
+    def test_getRecord(self):
+        header, metadata, about = self._client.getRecord(
+            metadataPrefix='oai_dc', identifier='oai:synthetic:3')
+        self.assertEquals([u'Record 3'], metadata['title'])
+        self.assertRaises(error.IdDoesNotExistError, self._client.getRecord,
+                          metadataPrefix='oai_dc',
+                          identifier='oai:synthetic:500')
+
+    def test_no_sets(self):
+        repository = synthetic.SyntheticRepository(record_count=10,
+                                                   set_fanout=())
+        self.assertRaises(error.NoSetHierarchyError, repository.listSets)
+        self.assertEquals([], repository.header(0).setSpec())
+
+    def test_unbatched(self):
+        # a Server gives the same lists as a BatchingServer
+        unbatched = client.ServerClient(
+            synthetic.createServer(self._repository, batch_size=30,
+                                   batching=False),
+            createRegistry())
+        for verb in ['listIdentifiers', 'listRecords']:
+            kw = {'metadataPrefix': 'oai_dc', 'set': 'a1',
+                  'from_': datetime(2003, 1, 1)}
+            expected = list(getattr(self._client, verb)(**kw))
+            result = list(getattr(unbatched, verb)(**kw))
+            self.assertEquals(len(expected), len(result))
+            if verb == 'listRecords':
+                expected = [header for header, m, a in expected]
+                result = [header for header, m, a in result]
+            self.assertEquals([h.identifier() for h in expected],
+                              [h.identifier() for h in result])
+        self.assertEquals(list(self._client.listSets()),
+                          list(unbatched.listSets()))
+
+class RecordingTestCase(TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_replay(self):
+        repository = synthetic.SyntheticRepository(record_count=95)
+        pages = synthetic.writeRecording(repository, self._dir,
+                                         batch_size=20)
+        # Identify, ListMetadataFormats, 1 + 5 + 5 list pages
+        self.assertEquals(13, pages)
+        replayclient = replay.ReplayClient(self._dir, createRegistry())
+        try:
+            self.assertEquals('Synthetic',
+                              replayclient.identify().repositoryName())
+            self.assertEquals(16, len(list(replayclient.listSets())))
+            records = list(replayclient.listRecords(metadataPrefix='oai_dc'))
+            self.assertEquals(['oai:synthetic:%s' % i for i in range(95)],
+                              [header.identifier()
+                               for header, m, a in records])
+        finally:
+            replayclient.close()
+
+def test_suite():
+    return TestSuite((makeSuite(SyntheticRepositoryTestCase),
+                      makeSuite(RecordingTestCase)))
+
+if __name__=='__main__':
+    main(defaultTest='test_suite')